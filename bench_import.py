@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+# Замер в отдельном процессе: import skillbit, сборка приложения и первая статичная клавиатура.
+# Так же стартуют бот после перезапуска и каждый воркер, порожденный через spawn.
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import skillbit
+imported = time.perf_counter()
+skillbit.API_KEY = '1:IMPORT'
+application = skillbit.build_application()
+built = time.perf_counter()
+skillbit.main_menu_keyboard('skillbit_bot').to_json()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'build_ms': (built - imported) * 1000,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    # Строки «import time: self [us] | cumulative | module» из python -X importtime
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def probe() -> Tuple[Dict[str, Any], Dict[str, Tuple[int, int]]]:
+    env = dict(os.environ, SKILLBIT_STATE_BACKEND='memory', SKILLBIT_METRICS_PORT='0')
+    done = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], env=env,
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if done.returncode:
+        raise SystemExit(done.stderr)
+    return json.loads(done.stdout.splitlines()[-1]), parse_importtime(done.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Время старта SkillBit: импорт модуля и сборка приложения')
+    parser.add_argument('--runs', type=int, default=10, help='сколько раз запускать (берется медиана)')
+    parser.add_argument('--top', type=int, default=10, help='сколько самых дорогих пакетов показать')
+    parser.add_argument('--json', action='store_true', help='печатать результат в JSON')
+    args = parser.parse_args()
+
+    # Первый прогон прогревает кэш байткода и диска и в замер не идет
+    probe()
+    runs: List[Dict[str, Any]] = []
+    packages: Dict[str, List[int]] = defaultdict(list)
+    for _ in range(args.runs):
+        run, modules = probe()
+        runs.append(run)
+        # Собственное время модулей, сложенное по пакетам верхнего уровня
+        own: Dict[str, int] = defaultdict(int)
+        for name, (own_us, _) in modules.items():
+            own[name.split('.')[0]] += own_us
+        for package, total in own.items():
+            packages[package].append(total)
+
+    result = {
+        'runs': args.runs,
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+        'build_ms': round(statistics.median(run['build_ms'] for run in runs), 1),
+        'modules': runs[-1]['modules'],
+        'packages_ms': {
+            package: round(statistics.median(values) / 1000, 1)
+            for package, values in sorted(packages.items(), key=lambda item: -statistics.median(item[1]))[:args.top]
+        },
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"import={result['import_ms']}ms build_application={result['build_ms']}ms "
+          f"modules={result['modules']} (медиана {args.runs} запусков)")
+    for package, ms in result['packages_ms'].items():
+        print(f'  {package:<24} {ms:>7} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Any, Coroutine, Deque, Dict, List, Optional, Tuple
+
+# Нагрузочный стенд держит состояние игр только в памяти и не открывает порт метрик
+os.environ.setdefault('SKILLBIT_STATE_BACKEND', 'memory')
+os.environ.setdefault('SKILLBIT_METRICS_PORT', '0')
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder
+from telegram.request import BaseRequest, RequestData
+
+import skillbit
+
+BOT_ID = 777000
+BOT_USERNAME = 'skillbit_bench_bot'
+FAKE_TOKEN = f'{BOT_ID}:BENCH'
+GROUP_BASE = -1000000000000
+USER_BASE = 100000000
+POLL_INTERVAL = 0.005  # как часто сценарии проверяют состояние игры на настоящих часах
+
+
+class FakeBotAPI(BaseRequest):
+    # Подменный Bot API в том же процессе: отвечает как Telegram, имитирует задержку сети
+    # и лимиты (30 сообщений/с на бота, 20 сообщений/мин на группу) с ответом 429
+    def __init__(self, latency: float, enforce_limits: bool) -> None:
+        self.latency = latency
+        self.enforce_limits = enforce_limits
+        self.calls: Counter = Counter()
+        self.rejected = 0
+        self._message_ids: Dict[int, int] = {}
+        self._global_window: Deque[float] = deque()
+        self._chat_windows: Dict[int, Deque[float]] = {}
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout: Any = None, write_timeout: Any = None,
+                         connect_timeout: Any = None, pool_timeout: Any = None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[1]
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[endpoint] += 1
+
+        if endpoint in skillbit.LIMITED_ENDPOINTS:
+            retry_after = self._check_limits(params.get('chat_id'))
+            if retry_after:
+                self.rejected += 1
+                return 429, json.dumps({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }).encode()
+
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, params)}).encode()
+
+    def _check_limits(self, chat_id: Any) -> int:
+        if not self.enforce_limits:
+            return 0
+        now = time.monotonic()
+        windows = [(self._global_window, 1.0, skillbit.GLOBAL_RATE)]
+        if isinstance(chat_id, int) and chat_id < 0:
+            windows.append((self._chat_windows.setdefault(chat_id, deque()), 60.0, skillbit.GROUP_RATE))
+        for window, span, limit in windows:
+            while window and window[0] <= now - span:
+                window.popleft()
+            if len(window) >= limit:
+                return max(1, int(window[0] + span - now + 1))
+        for window, _, _ in windows:
+            window.append(now)
+        return 0
+
+    def _result(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'SkillBit', 'username': BOT_USERNAME}
+        if endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = params['chat_id']
+            if endpoint == 'sendMessage':
+                message_id = self._message_ids[chat_id] = self._message_ids.get(chat_id, 0) + 1
+            else:
+                message_id = params['message_id']
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': chat_payload(chat_id),
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'SkillBit'},
+                'text': params.get('text', ''),
+            }
+        if endpoint == 'getChatMember':
+            return {'status': 'member', 'user': user_payload(params['user_id'])}
+        if endpoint == 'getChatAdministrators':
+            return [
+                {'status': 'creator', 'is_anonymous': False, 'user': user_payload(player_id(params['chat_id'], 0))},
+                {'status': 'administrator', 'user': {'id': BOT_ID, 'is_bot': True, 'first_name': 'SkillBit'},
+                 **{key: True for key in ADMIN_RIGHTS}},
+            ]
+        return True
+
+
+ADMIN_RIGHTS = (
+    'can_be_edited', 'is_anonymous', 'can_manage_chat', 'can_delete_messages', 'can_manage_video_chats',
+    'can_restrict_members', 'can_promote_members', 'can_change_info', 'can_invite_users',
+    'can_post_stories', 'can_edit_stories', 'can_delete_stories',
+)
+
+
+def chat_payload(chat_id: int) -> Dict[str, Any]:
+    if chat_id < 0:
+        return {'id': chat_id, 'type': 'supergroup', 'title': f'Bench {chat_id}'}
+    return {'id': chat_id, 'type': 'private', 'first_name': f'User {chat_id}'}
+
+
+def user_payload(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Игрок {user_id}'}
+
+
+def topic_payload(thread_id: int) -> Dict[str, Any]:
+    # Поля сообщения из темы форума; 0 — обычный чат без тем
+    return {'message_thread_id': thread_id, 'is_topic_message': True} if thread_id else {}
+
+
+def player_id(chat_id: int, index: int) -> int:
+    return USER_BASE + (GROUP_BASE - chat_id) * 10 + index
+
+
+class Driver:
+    # Строит синтетические апдейты и прогоняет их через обработчики, замеряя задержку.
+    # На виртуальных часах сценарии не опрашивают игры, а ждут в pause() следующего
+    # шага часов, который делает advance_clock, когда все сценарии ждут.
+    def __init__(self, application: Application, virtual: bool = False) -> None:
+        self.application = application
+        self.virtual = virtual
+        self.update_ids = itertools.count(1)
+        self.latencies: List[float] = []
+        self.turns = 0
+        self.in_flight = 0
+        self.scenarios = 0
+        self.waiting = 0
+        self.tick: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def run(self, scenario: Coroutine) -> None:
+        self.scenarios += 1
+        try:
+            await scenario
+        finally:
+            self.scenarios -= 1
+
+    async def pause(self) -> None:
+        if not self.virtual:
+            await asyncio.sleep(POLL_INTERVAL)
+            return
+        self.waiting += 1
+        try:
+            await asyncio.shield(self.tick)
+        finally:
+            self.waiting -= 1
+
+    async def feed(self, data: Dict[str, Any]) -> None:
+        data['update_id'] = next(self.update_ids)
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            await self.application.process_update(update)
+        finally:
+            self.in_flight -= 1
+        self.latencies.append(time.perf_counter() - started)
+
+    async def text(self, chat_id: int, user_id: int, text: str, thread_id: int = 0) -> None:
+        message: Dict[str, Any] = {
+            'message_id': next(self.update_ids),
+            'date': int(time.time()),
+            'chat': chat_payload(chat_id),
+            'from': user_payload(user_id),
+            'text': text,
+            **topic_payload(thread_id),
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self.feed({'message': message})
+
+    async def click(self, chat_id: int, user_id: int, data: str, message_id: int = 1, thread_id: int = 0) -> None:
+        await self.feed({'callback_query': {
+            'id': str(next(self.update_ids)),
+            'from': user_payload(user_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': chat_payload(chat_id),
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'SkillBit'},
+                'text': '',
+                **topic_payload(thread_id),
+            },
+        }})
+
+
+async def wait_for(driver: Driver, predicate: Any, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await driver.pause()
+    return True
+
+
+async def play_quiz(driver: Driver, key: skillbit.GameKey, players: int, timeout: float) -> None:
+    chat_id, thread_id = key
+    await driver.text(chat_id, player_id(chat_id, 0), '/quiz', thread_id)
+    answered = None
+    deadline = time.monotonic() + timeout
+    while key in skillbit.games and time.monotonic() < deadline:
+        game = skillbit.games.get(key)
+        # Отвечаем, когда вопрос раунда отправлен, а не сразу после итогов предыдущего
+        if game and game.stage == 'asking' and game.round_started_at != answered:
+            answered = game.round_started_at
+            driver.turns += 1
+            options = len(game.current_question()['options'])
+            for index in range(players):
+                data = skillbit.encode_callback(skillbit.CB_QUIZ_ANSWER, *key, game.current_round, index % options)
+                await driver.click(chat_id, player_id(chat_id, index), data, thread_id=thread_id)
+        await driver.pause()
+
+
+async def play_crocodile(driver: Driver, key: skillbit.GameKey, players: int, timeout: float) -> None:
+    chat_id, thread_id = key
+    crocodile = player_id(chat_id, 0)
+    await driver.text(chat_id, crocodile, '/crocodile', thread_id)
+    if not await wait_for(driver, lambda: key in skillbit.games, timeout):
+        return
+    data = skillbit.encode_callback(skillbit.CB_CROC_WORD, *key, 0)
+    await driver.click(crocodile, crocodile, data)
+    driver.turns += 1
+    game = skillbit.games.get(key)
+    if game and game.word:
+        for index in range(1, max(2, players)):
+            if key not in skillbit.games:
+                break
+            await driver.text(chat_id, player_id(chat_id, index), game.word, thread_id)
+
+
+async def play_cities(driver: Driver, key: skillbit.GameKey, players: int, timeout: float, max_turns: int) -> None:
+    chat_id, thread_id = key
+    host = player_id(chat_id, 0)
+    await driver.text(chat_id, host, '/cities', thread_id)
+    await driver.click(chat_id, host, skillbit.encode_callback(skillbit.CB_CITIES_MODE, 0, -1), thread_id=thread_id)
+    for index in range(1, players):
+        data = skillbit.encode_callback(skillbit.CB_JOIN_CITIES, *key)
+        await driver.click(chat_id, player_id(chat_id, index), data, thread_id=thread_id)
+
+    def started() -> bool:
+        return key not in skillbit.games or skillbit.games[key].stage == 'playing'
+
+    deadline = time.monotonic() + timeout
+    if not await wait_for(driver, started, timeout):
+        return
+    turns = 0
+    while key in skillbit.games and turns < max_turns and time.monotonic() < deadline:
+        game = skillbit.games[key]
+        state = game.word_pool
+        letter = skillbit.find_available_letter(state, game.used_words[-1])
+        word = skillbit.find_next_word(letter, state)
+        if word is None:
+            break
+        await driver.text(chat_id, game.players[game.current_player], word, thread_id)
+        turns += 1
+        driver.turns += 1
+    skillbit.finish_game(key)
+
+
+async def advance_clock(driver: Driver) -> None:
+    # Виртуальные часы: когда апдейтов в обработке нет и все сценарии ждут, время
+    # перескакивает к ближайшему сроку, все таймеры этого срока срабатывают, и сценарии просыпаются
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(0)
+        if driver.in_flight or driver.waiting < driver.scenarios:
+            continue
+        deadline = skillbit.timers.next_deadline()
+        if deadline is not None:
+            await skillbit.timers.run_until(deadline)
+        tick, driver.tick = driver.tick, loop.create_future()
+        tick.set_result(None)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_level(args: argparse.Namespace, chats: int) -> Dict[str, Any]:
+    if args.virtual:
+        skillbit.clock = skillbit.VirtualClock(time.time())
+    skillbit.timers = skillbit.TimerScheduler(skillbit.clock)
+    api = FakeBotAPI(args.latency / 1000, not args.no_limits)
+    builder = ApplicationBuilder().token(FAKE_TOKEN).request(api).get_updates_request(api)
+    application = skillbit.build_application(builder)
+    driver = Driver(application, args.virtual)
+    peak_tasks = 0
+    result: Dict[str, Any] = {}
+
+    async def sample_tasks() -> None:
+        nonlocal peak_tasks
+        while True:
+            peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.05)
+
+    async def serve() -> None:
+        sampler = asyncio.create_task(sample_tasks())
+        pump = asyncio.create_task(advance_clock(driver)) if args.virtual else None
+        virtual_start = skillbit.clock.time()
+        scenarios = []
+        for i in range(chats * args.topics):
+            # При --topics > 1 каждый чат — форум, и игры идут параллельно в темах 1..N
+            key = (GROUP_BASE - i // args.topics, i % args.topics + 1 if args.topics > 1 else 0)
+            game = args.games[i % len(args.games)]
+            if game == 'quiz':
+                scenarios.append(play_quiz(driver, key, args.players, args.timeout))
+            elif game == 'crocodile':
+                scenarios.append(play_crocodile(driver, key, args.players, args.timeout))
+            else:
+                scenarios.append(play_cities(driver, key, args.players, args.timeout, args.cities_turns))
+        started = time.perf_counter()
+        await asyncio.gather(*(driver.run(scenario) for scenario in scenarios))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        if pump is not None:
+            pump.cancel()
+        outbound = sum(count for endpoint, count in api.calls.items() if endpoint != 'getMe')
+        result.update({
+            'chats': chats,
+            'games': chats * args.topics,
+            'updates': len(driver.latencies),
+            'elapsed_s': round(elapsed, 3),
+            'virtual_s': round(skillbit.clock.time() - virtual_start, 1) if args.virtual else None,
+            'games_per_s': round(chats * args.topics / elapsed, 1) if elapsed else 0.0,
+            'updates_per_s': round(len(driver.latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(driver.latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(driver.latencies, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.fmean(driver.latencies) * 1000, 3) if driver.latencies else 0.0,
+            'turns': driver.turns,
+            'outbound_per_turn': round(outbound / driver.turns, 2) if driver.turns else 0.0,
+            'outbound_by_method': dict(api.calls),
+            'rejected_429': api.rejected,
+            'peak_tasks': peak_tasks,
+            'pending_timers_after': skillbit.timers.pending,
+        })
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    await skillbit.run_application(application, serve)
+    if args.tracemalloc:
+        result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    elif sys.platform != 'win32':
+        import resource
+        result['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный стенд SkillBit с подменным Bot API')
+    parser.add_argument('--chats', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='уровни числа одновременных чатов (до 10000)')
+    parser.add_argument('--games', nargs='+', default=['quiz', 'crocodile', 'cities'],
+                        choices=['quiz', 'crocodile', 'cities'], help='какие игры запускать по кругу')
+    parser.add_argument('--players', type=int, default=4, help='игроков в каждой игре')
+    parser.add_argument('--topics', type=int, default=1, help='параллельных игр в каждом чате (темы форума)')
+    parser.add_argument('--latency', type=float, default=20.0, help='задержка Bot API, мс')
+    parser.add_argument('--no-limits', action='store_true',
+                        help='не имитировать лимиты Telegram и снять лимиты исходящей очереди бота')
+    parser.add_argument('--round-time', type=float, default=None,
+                        help='длина игровых таймеров в стенде, с (по умолчанию 0.2, на виртуальных часах — как в боте)')
+    parser.add_argument('--virtual', action='store_true',
+                        help='виртуальные часы: таймеры срабатывают без ожидания, задержка Bot API не имитируется')
+    parser.add_argument('--cities-turns', type=int, default=10, help='максимум ходов в городах')
+    parser.add_argument('--timeout', type=float, default=120.0, help='предел на одну игру, с')
+    parser.add_argument('--tracemalloc', action='store_true', help='мерить пик памяти через tracemalloc (медленно)')
+    parser.add_argument('--json', action='store_true', help='печатать результаты в JSON')
+    args = parser.parse_args()
+
+    if args.virtual:
+        args.latency = 0.0
+    elif args.round_time is None:
+        args.round_time = 0.2
+    if args.round_time is not None:
+        # Укорачиваем игровые таймеры, чтобы партия шла секунды, а не минуты
+        skillbit.ANSWER_TIME = args.round_time
+        skillbit.JOIN_TIMEOUT = args.round_time
+        skillbit.CITIES_ANSWER_TIMEOUT = max(args.round_time, 5.0)
+    skillbit.MAX_GAMES_PER_CHAT = max(skillbit.MAX_GAMES_PER_CHAT, args.topics)
+    if args.no_limits:
+        skillbit.GLOBAL_RATE = skillbit.GROUP_RATE = skillbit.PRIVATE_RATE = 10 ** 6
+
+    for chats in args.chats:
+        result = asyncio.run(run_level(args, chats))
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            print(
+                f"chats={result['chats']:>6} games={result['games']:>6} updates={result['updates']:>7} "
+                f"upd/s={result['updates_per_s']:>9} games/s={result['games_per_s']:>8} p50={result['p50_ms']:>8}ms p99={result['p99_ms']:>8}ms "
+                f"out/turn={result['outbound_per_turn']:>6} 429={result['rejected_429']:>5} "
+                f"tasks={result['peak_tasks']:>6} "
+                f"mem={result.get('peak_memory_mb', result.get('max_rss_mb', '?'))}MB"
+            )
+        skillbit.games = skillbit.GameStore(skillbit.MemoryStateBackend())
+
+
+if __name__ == '__main__':
+    main()
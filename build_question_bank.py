@@ -0,0 +1,121 @@
+import argparse
+import csv
+import json
+import os
+import struct
+import sys
+from typing import Any, Dict, Iterable, Iterator, List
+
+MAX_OPTIONS = 10  # больше кнопок в сообщение с вопросом не помещается
+
+
+def read_json(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            data = json.load(f)
+            # Список вопросов или словарь {"questions": [...]}
+            yield from data['questions'] if isinstance(data, dict) else data
+
+
+def read_csv(path: str) -> Iterator[Dict[str, Any]]:
+    # Столбцы: question, answer, options (через «|») или option1..optionN, category, language
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('options'):
+                options = row['options'].split('|')
+            else:
+                columns = sorted((k for k in row if k and k.startswith('option')),
+                                 key=lambda k: int(k[len('option'):] or 0))
+                options = [row[k] for k in columns if row[k]]
+            yield {
+                'question': row.get('question', ''),
+                'options': [option.strip() for option in options],
+                'answer': (row.get('answer') or '').strip(),
+                'category': (row.get('category') or '').strip(),
+                'language': (row.get('language') or '').strip(),
+            }
+
+
+def read_sources(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        yield from read_csv(path) if path.lower().endswith('.csv') else read_json(path)
+
+
+def normalize(raw: Dict[str, Any], category: str, language: str) -> Dict[str, Any]:
+    question = str(raw.get('question') or '').strip()
+    options = [str(option).strip() for option in raw.get('options') or []]
+    answer = raw.get('answer')
+    # Ответ можно задать текстом варианта или его номером
+    if isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < len(options):
+        answer = options[answer]
+    answer = str(answer or '').strip()
+    if not question:
+        raise ValueError('пустой вопрос')
+    if not 2 <= len(options) <= MAX_OPTIONS:
+        raise ValueError(f'нужно от 2 до {MAX_OPTIONS} вариантов, а их {len(options)}')
+    if len(set(options)) != len(options) or not all(options):
+        raise ValueError('пустые или повторяющиеся варианты')
+    if answer not in options:
+        raise ValueError(f'ответ «{answer}» не входит в варианты')
+    return {
+        'question': question,
+        'options': options,
+        'answer': answer,
+        'category': str(raw.get('category') or category).strip(),
+        'language': str(raw.get('language') or language).strip(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сборка банка вопросов викторины SkillBit из JSON/JSONL/CSV')
+    parser.add_argument('sources', nargs='+', help='файлы с вопросами (.json, .jsonl, .csv)')
+    parser.add_argument('-o', '--output', default='questions.skqb', help='куда записать банк')
+    parser.add_argument('--category', default='', help='категория для вопросов без своей категории')
+    parser.add_argument('--language', default='', help='язык для вопросов без своего языка')
+    args = parser.parse_args()
+
+    # skillbit при импорте переходит в свою папку, поэтому пути разрешаем заранее
+    sources = [os.path.abspath(path) for path in args.sources]
+    output = os.path.abspath(args.output)
+    import skillbit
+
+    questions: List[Dict[str, Any]] = []
+    seen = set()
+    skipped = duplicates = 0
+    for number, raw in enumerate(read_sources(sources), 1):
+        try:
+            question = normalize(raw, args.category or skillbit.DEFAULT_CATEGORY,
+                                 args.language or skillbit.QUIZ_LANGUAGE)
+            skillbit.encode_question(question)
+        except (ValueError, TypeError, AttributeError, struct.error) as e:
+            skipped += 1
+            print(f'Вопрос {number} пропущен: {e}', file=sys.stderr)
+            continue
+        key = (question['language'], question['question'].casefold())
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        questions.append(question)
+
+    data = skillbit.encode_question_bank(questions)
+    temporary = output + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    # Замена атомарная: работающий бот держит старый файл через mmap
+    os.replace(temporary, output)
+
+    bank = skillbit.QuestionBank.open(output)
+    print(f'{output}: {len(bank)} вопросов, {len(bank.groups)} групп, {len(data) / 1024:.1f} КБ '
+          f'(пропущено {skipped}, повторов {duplicates})')
+    for (category, language), numbers in sorted(bank.groups.items()):
+        print(f'  {language} / {category}: {len(numbers)}')
+    bank.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Повтор держит состояние только в памяти, не открывает порт метрик и сам ничего не записывает
+os.environ.setdefault('SKILLBIT_STATE_BACKEND', 'memory')
+os.environ.setdefault('SKILLBIT_METRICS_PORT', '0')
+os.environ['SKILLBIT_RECORD'] = ''
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest, RequestData
+
+import skillbit
+
+MISMATCHES_SHOWN = 10
+
+
+def read_log(paths: Iterable[str]) -> Iterator[List[Any]]:
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Последняя строка могла не дописаться, если бот упал
+                    print(f'{path}:{number}: строка пропущена', file=sys.stderr)
+
+
+class RecordedBotAPI(BaseRequest):
+    # Подменный Bot API: отвечает так, как Telegram ответил при записи. Ответы разложены
+    # по (метод, адресат) в порядке записи; вызов с другим текстом или лишний вызов
+    # считается расхождением, и на него отвечает заглушка. Виртуальные часы сдвигаются
+    # на момент, когда записанный ответ пришел (но не дальше следующего события журнала):
+    # время на сетевой вызов тоже часть игры.
+    def __init__(self, bot: Dict[str, Any], calls: Iterable[List[Any]]) -> None:
+        self.bot = bot
+        self.expected: Dict[Tuple[str, Any], Deque[Tuple[float, Dict[str, Any], Any, Optional[str]]]] = {}
+        for _, moment, endpoint, params, result, error in calls:
+            self.expected.setdefault((endpoint, self.target(params)), deque()).append((moment, params, result, error))
+        self.horizon = float('inf')
+        self.calls = 0
+        self.mismatches: List[str] = []
+        self._message_ids: Dict[Any, int] = {}
+
+    @staticmethod
+    def target(params: Dict[str, Any]) -> Any:
+        return params.get('chat_id') or params.get('callback_query_id') or params.get('inline_query_id')
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def missing(self) -> int:
+        # Записанные вызовы, которых при повторе не было
+        return sum(len(queue) for (endpoint, _), queue in self.expected.items() if endpoint != 'getMe')
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout: Any = None, write_timeout: Any = None,
+                         connect_timeout: Any = None, pool_timeout: Any = None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            return 200, json.dumps({'ok': True, 'result': self.bot}).encode()
+        self.calls += 1
+
+        queue = self.expected.get((endpoint, self.target(params)))
+        if not queue:
+            self.mismatches.append(f'лишний вызов {endpoint} в чате {params.get("chat_id")}: {params.get("text", "")!r}')
+            return 200, json.dumps({'ok': True, 'result': self._stub(endpoint, params)}).encode()
+        moment, recorded, result, error = queue.popleft()
+        skillbit.clock.set(min(moment, self.horizon))
+        if recorded.get('text') != params.get('text'):
+            self.mismatches.append(f'{endpoint} в чате {params.get("chat_id")}: '
+                                   f'записано {recorded.get("text")!r}, получено {params.get("text")!r}')
+        if error is not None:
+            return 400, json.dumps({'ok': False, 'error_code': 400, 'description': error}).encode()
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _stub(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = params['chat_id']
+            if endpoint == 'sendMessage':
+                message_id = self._message_ids[chat_id] = self._message_ids.get(chat_id, 0) + 1
+            else:
+                message_id = params['message_id']
+            return {
+                'message_id': message_id,
+                'date': int(skillbit.clock.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'},
+                'from': self.bot,
+                'text': params.get('text', ''),
+            }
+        if endpoint == 'getChatMember':
+            return {'status': 'member', 'user': {'id': params['user_id'], 'is_bot': False, 'first_name': 'Игрок'}}
+        if endpoint == 'getChatAdministrators':
+            return []
+        return True
+
+
+def restore_state(entries: List[List[Any]]) -> None:
+    # Состояние чатов из базы записано при первом чтении; кладем его в хранилища до повтора,
+    # чтобы викторина исключила те же вопросы, а игры шли с теми же таймингами
+    seen: Dict[Tuple[int, int], str] = {}
+    settings: Dict[Tuple[int, int], str] = {}
+    for entry in entries:
+        if entry[0] != 's':
+            continue
+        _, _, kind, chat_id, value = entry
+        if kind == 'seen':
+            seen.setdefault((chat_id, 0), value)
+        elif kind == 'settings':
+            settings.setdefault((chat_id, 0), json.dumps(value, separators=(',', ':')))
+    skillbit.seen_questions = skillbit.SeenQuestions(skillbit.MemoryStateBackend())
+    skillbit.seen_questions.backend.write_batch(seen, set())
+    # Загружает их on_startup, как настройки из базы при запуске бота
+    skillbit.chat_settings = skillbit.ChatSettings(skillbit.MemoryStateBackend())
+    skillbit.chat_settings.backend.write_batch(settings, set())
+
+
+async def replay(entries: List[List[Any]]) -> Dict[str, Any]:
+    headers = [entry[1] for entry in entries if entry[0] == 'h']
+    if not headers:
+        raise SystemExit('В журнале нет заголовка сессии')
+    bot = headers[0].get('bot') or {'id': 1, 'is_bot': True, 'first_name': 'SkillBit', 'username': 'skillbit_bot'}
+    api = RecordedBotAPI(bot, (entry for entry in entries if entry[0] == 'c'))
+
+    # Время идет только от события к событию журнала; фоновый цикл таймеров не запускается
+    clock = skillbit.VirtualClock(headers[0]['time'])
+    skillbit.clock = clock
+    skillbit.timers = skillbit.TimerScheduler(clock)
+    skillbit.games = skillbit.GameStore(skillbit.MemoryStateBackend())
+    skillbit.name_cache = skillbit.NameCache()
+    restore_state(entries)
+    entries = [entry for entry in entries if entry[0] != 's']
+
+    builder = ApplicationBuilder().token(f"{bot['id']}:REPLAY").request(api).get_updates_request(api)
+    application = skillbit.build_application(builder)
+    result: Dict[str, Any] = {}
+
+    async def serve() -> None:
+        updates = 0
+        started = time.perf_counter()
+        for number, entry in enumerate(entries):
+            api.horizon = next((later[1] for later in entries[number + 1:number + 2] if later[0] != 'h'), float('inf'))
+            if entry[0] == 'h':
+                # Новая сессия записи (перезапуск бота) — со своим зерном случайности
+                skillbit.RANDOM_SEED = entry[1]['seed']
+            elif entry[0] == 't':
+                # Таймер срабатывает в записанный момент, а не точно в срок: живой бот опаздывает
+                # на миллисекунды, и от этого зависят, например, очки за скорость ответа
+                clock.set(entry[1])
+                if not await skillbit.timers.fire((entry[2], entry[3]), entry[4]):
+                    api.mismatches.append(f'таймер {entry[4]} в чате {entry[2]} не был запущен')
+            elif entry[0] == 'u':
+                clock.set(entry[1])
+                await application.process_update(Update.de_json(entry[2], application.bot))
+                updates += 1
+        elapsed = time.perf_counter() - started
+        span = clock.now - headers[0]['time']
+        result.update({
+            'updates': updates,
+            'calls': api.calls,
+            'mismatches': len(api.mismatches),
+            'missing_calls': api.missing,
+            'virtual_s': round(span, 1),
+            'elapsed_s': round(elapsed, 3),
+            'updates_per_s': round(updates / elapsed, 1) if elapsed else 0.0,
+            'speedup': round(span / elapsed, 1) if elapsed else 0.0,
+            'first_mismatches': api.mismatches[:MISMATCHES_SHOWN],
+        })
+
+    await skillbit.run_application(application, serve)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Воспроизведение журнала SkillBit (SKILLBIT_RECORD) на виртуальных часах. '
+                    'Журнал должен начинаться с запуска бота без восстановленных игр.')
+    parser.add_argument('logs', nargs='+', help='файлы журнала по порядку')
+    parser.add_argument('--strict', action='store_true', help='код выхода 1, если повтор разошелся с записью')
+    parser.add_argument('--json', action='store_true', help='печатать результат в JSON')
+    args = parser.parse_args()
+
+    # Ответы Telegram уже в журнале, ограничивать исходящие незачем
+    skillbit.GLOBAL_RATE = skillbit.GROUP_RATE = skillbit.PRIVATE_RATE = 10 ** 6
+
+    result = asyncio.run(replay(list(read_log(args.logs))))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print(
+            f"updates={result['updates']} calls={result['calls']} mismatches={result['mismatches']} "
+            f"missing={result['missing_calls']} virtual={result['virtual_s']}s elapsed={result['elapsed_s']}s "
+            f"upd/s={result['updates_per_s']} speedup={result['speedup']}x"
+        )
+        for line in result['first_mismatches']:
+            print(f'  {line}')
+    if args.strict and (result['mismatches'] or result['missing_calls']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,60 @@
 import logging
 import os
+import json
+import math
+import mmap
 import random
 import asyncio
+import base64
+import bisect
+import hashlib
+import heapq
+import hmac
+import html
+import itertools
+import queue
+import re
 import signal
+import sqlite3
+import ssl
+import struct
 import sys
-from typing import Any, Coroutine, List, Dict, Optional, Set
+import time
+from array import array
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Deque, List, Dict, Iterable, Optional, Set, Tuple, Union
+import certifi
 from telegram import (
+    Bot,
+    CallbackQuery,
     Update,
+    User,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, InvalidToken, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    BaseRateLimiter,
+    CallbackContext,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
 
+if TYPE_CHECKING:
+    # Нужен только супервизору с воркерами; процесс без воркеров его не импортирует
+    import multiprocessing
+
 # Исправление для Windows - настройка политики цикла событий
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -30,47 +63,276 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 API_KEY = ''
 
+# Режим приема обновлений: 'polling' или 'webhook'
+RUN_MODE = os.environ.get('SKILLBIT_MODE', 'polling')
+WEBHOOK_HOST = os.environ.get('SKILLBIT_WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('SKILLBIT_WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('SKILLBIT_WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('SKILLBIT_WEBHOOK_SECRET', '')
+# Публичный адрес вебхука; если пусто, setWebhook не вызывается (удобно для локальных тестов)
+WEBHOOK_URL = os.environ.get('SKILLBIT_WEBHOOK_URL', '')
+MAX_CONCURRENT_UPDATES = 256
+HTTP_MAX_BODY = 1 << 20
+# Сколько keep-alive соединение может молчать между запросами и сколько читаются
+# заголовки и тело начатого запроса; по истечении соединение закрывается
+HTTP_IDLE_TIMEOUT = 60
+HTTP_READ_TIMEOUT = 10
+
+# Горизонтальное масштабирование: число процессов-воркеров (0 или 1 — один процесс)
+WORKERS = int(os.environ.get('SKILLBIT_WORKERS', '0'))
+WORKER_QUEUE_SIZE = 10000
+WORKER_STATS_INTERVAL = 10  # секунд
+POLL_BACKOFF_MAX = 30  # предельная пауза между неудачными getUpdates в супервизоре, с
+# Номер текущего воркера и их общее число; в однопроцессном режиме — 0 и 1
+WORKER_INDEX = 0
+WORKER_COUNT = 1
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logging.info('Starting Bot...')
 
-games: Dict[int, Dict] = {}
+# Хранилище состояния игр
+STATE_BACKEND = os.environ.get('SKILLBIT_STATE_BACKEND', 'sqlite')  # 'sqlite' или 'memory'
+STATE_DB_PATH = os.environ.get('SKILLBIT_STATE_DB', 'skillbit_state.db')
+SNAPSHOT_INTERVAL = 5  # секунд между снимками состояния
+# Сколько игр одновременно может идти в одном чате (в разных темах форума)
+MAX_GAMES_PER_CHAT = int(os.environ.get('SKILLBIT_MAX_GAMES_PER_CHAT', '10'))
 
-# Описания игр
-game_descriptions = {
-    "Викторина": (
-        "🎓 **Викторина**\n\n"
-        "Интеллектуальная битва на общие знания. Отвечайте на вопросы быстрее других!\n\n"
-        "**Правила:**\n"
-        "- Вопросы с вариантами ответов (A/B/C/D)\n"
-        "- **20 секунд** на обдумывание\n"
-        "- **+2 очка** за правильный ответ\n"
-        "- Итоговый рейтинг после 5 раундов"
-    ),
-    "Крокодил": (
-        "🐊 **Крокодил**\n\n"
-        "Объясняйте слова без прямых подсказок, а другие игроки должны угадать!\n\n"
-        "**Правила:**\n"
-        "- **Крокодил** выбирает слово из 3 вариантов\n"
-        "- **15 секунд** на объяснение (жесты, ассоциации)\n"
-        "- **60 секунд** на угадывание\n"
-        "- Нельзя использовать однокоренные слова"
-    ),
-    "Города и страны": (
-        "🏙️ **Города и страны**\n\n"
-        "Назовите город или страну на последнюю букву предыдущего слова\n\n"
-        "**Правила:**\n"
-        "- Режимы: **города** или **страны**\n"
-        "- На **20 секунд** дается на ответ\n"
-        "- Буквы **Ь, Ы, Ъ, Й** пропускаются (берется предыдущая)\n"
-        "- Буква **Я** обрабатывается специально: слова на 'Я' имеют приоритет\n"
-        "- Когда слова на текущую букву заканчиваются, ищется следующая подходящая буква\n"
-        "- Повторять слова нельзя\n"
-        "- Проигрывает тот, кто не успел или ошибся"
-    )
-}
+# Журнал для воспроизведения: входящие апдейты и вызовы Bot API дописываются в JSONL-файл
+# (пусто — не писать). Зерно случайности пишется в журнал, чтобы повтор выбрал то же самое.
+RECORD_PATH = os.environ.get('SKILLBIT_RECORD', '')
+RECORD_VERSION = 2
+RANDOM_SEED = int(os.environ.get('SKILLBIT_SEED') or random.SystemRandom().randrange(2 ** 32))
+
+# Игра живет в теме чата: (chat_id, message_thread_id), 0 — чат без тем или общая тема
+GameKey = Tuple[int, int]
+
+
+def shard_for_chat(chat_id: int, shards: int) -> int:
+    return chat_id % shards
+
+
+class StateBackend:
+    # Интерфейс бэкенда: хранит сериализованные снимки по ключу (chat_id, thread_id)
+
+    def load_all(self, shard: int = 0, shards: int = 1) -> Dict[GameKey, str]:
+        raise NotImplementedError
+
+    def load_one(self, key: GameKey) -> Optional[str]:
+        raise NotImplementedError
+
+    def write_batch(self, upserts: Dict[GameKey, str], deletes: Set[GameKey]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    def __init__(self) -> None:
+        self._rows: Dict[GameKey, str] = {}
+
+    def load_all(self, shard: int = 0, shards: int = 1) -> Dict[GameKey, str]:
+        return {key: raw for key, raw in self._rows.items() if shard_for_chat(key[0], shards) == shard}
+
+    def load_one(self, key: GameKey) -> Optional[str]:
+        return self._rows.get(key)
+
+    def write_batch(self, upserts: Dict[GameKey, str], deletes: Set[GameKey]) -> None:
+        self._rows.update(upserts)
+        for key in deletes:
+            self._rows.pop(key, None)
+
+
+class SQLiteStateBackend(StateBackend):
+    def __init__(self, path: str, table: str = 'games') -> None:
+        self.path = path
+        self.table = table
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Подключаемся при первом обращении, чтобы импорт модуля не трогал диск
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA busy_timeout=5000')
+            self._create_table(self._conn)
+        return self._conn
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({self.table})')]
+        schema = (f'CREATE TABLE {self.table} (chat_id INTEGER NOT NULL, thread_id INTEGER NOT NULL DEFAULT 0, '
+                  'state TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (chat_id, thread_id))')
+        if not columns:
+            conn.execute(schema)
+        elif 'thread_id' not in columns:
+            # Таблица старого формата (одна запись на чат): записи переезжают в общую тему
+            with conn:
+                conn.execute('BEGIN')
+                conn.execute(f'ALTER TABLE {self.table} RENAME TO {self.table}_old')
+                conn.execute(schema)
+                conn.execute(f'INSERT INTO {self.table} (chat_id, thread_id, state, updated_at) '
+                             f'SELECT chat_id, 0, state, updated_at FROM {self.table}_old')
+                conn.execute(f'DROP TABLE {self.table}_old')
+
+    def load_all(self, shard: int = 0, shards: int = 1) -> Dict[GameKey, str]:
+        rows = self.conn.execute(f'SELECT chat_id, thread_id, state FROM {self.table}').fetchall()
+        return {(chat_id, thread_id): raw for chat_id, thread_id, raw in rows
+                if shard_for_chat(chat_id, shards) == shard}
+
+    def load_one(self, key: GameKey) -> Optional[str]:
+        row = self.conn.execute(
+            f'SELECT state FROM {self.table} WHERE chat_id = ? AND thread_id = ?', key).fetchone()
+        return row[0] if row else None
+
+    def write_batch(self, upserts: Dict[GameKey, str], deletes: Set[GameKey]) -> None:
+        now = time.time()
+        conn = self.conn
+        with conn:
+            conn.execute('BEGIN')
+            if upserts:
+                conn.executemany(
+                    f'INSERT INTO {self.table} (chat_id, thread_id, state, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(chat_id, thread_id) DO UPDATE SET '
+                    'state = excluded.state, updated_at = excluded.updated_at',
+                    [(chat_id, thread_id, raw, now) for (chat_id, thread_id), raw in upserts.items()]
+                )
+            if deletes:
+                conn.executemany(f'DELETE FROM {self.table} WHERE chat_id = ? AND thread_id = ?', list(deletes))
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def encode_state_value(value: Any) -> Any:
+    if isinstance(value, RoundAnswers):
+        return value.dump()
+    raise TypeError(f'{type(value).__name__} не сохраняется в снимок')
+
+
+def dump_game(game: 'Game') -> str:
+    return json.dumps(game.dump(), ensure_ascii=False, separators=(',', ':'), default=encode_state_value)
+
+
+def load_game(key: GameKey, raw: str) -> 'Game':
+    state = json.loads(raw)
+    return GAME_TYPES[state['type']].load(key, state)
+
+
+class GameStore:
+    # Словарь активных игр с отложенной записью: изменения помечают игру грязной,
+    # а снимки пачкой уходят в бэкенд раз в SNAPSHOT_INTERVAL секунд.
+    # Игры лежат по ключу (chat_id, thread_id), а индекс по чатам хранит темы
+    # с играми, чтобы /stop и лимит игр на чат не перебирали весь словарь.
+    def __init__(self, backend: StateBackend) -> None:
+        self.backend = backend
+        self._games: Dict[GameKey, 'Game'] = {}
+        self._by_chat: Dict[int, Set[int]] = {}
+        self._dirty: Set[GameKey] = set()
+        self._deleted: Set[GameKey] = set()
+        self._flush_lock = asyncio.Lock()
+
+    def __contains__(self, key: GameKey) -> bool:
+        return key in self._games
+
+    def __getitem__(self, key: GameKey) -> 'Game':
+        return self._games[key]
+
+    def __setitem__(self, key: GameKey, game: 'Game') -> None:
+        self._games[key] = game
+        self._by_chat.setdefault(key[0], set()).add(key[1])
+        self._deleted.discard(key)
+        self._dirty.add(key)
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def __iter__(self):
+        return iter(self._games)
+
+    def get(self, key: GameKey, default: Optional['Game'] = None) -> Optional['Game']:
+        return self._games.get(key, default)
+
+    def pop(self, key: GameKey, default: Optional['Game'] = None) -> Optional['Game']:
+        game = self._games.pop(key, default)
+        threads = self._by_chat.get(key[0])
+        if threads is not None:
+            threads.discard(key[1])
+            if not threads:
+                del self._by_chat[key[0]]
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        return game
+
+    def in_chat(self, chat_id: int) -> List[GameKey]:
+        return [(chat_id, thread_id) for thread_id in self._by_chat.get(chat_id, ())]
+
+    def count_in_chat(self, chat_id: int) -> int:
+        return len(self._by_chat.get(chat_id, ()))
+
+    def values(self):
+        return self._games.values()
+
+    def items(self):
+        return self._games.items()
+
+    def touch(self, key: GameKey) -> None:
+        if key in self._games:
+            self._dirty.add(key)
+
+    def load(self, shard: int = 0, shards: int = 1) -> None:
+        for key, raw in self.backend.load_all(shard, shards).items():
+            try:
+                game = load_game(key, raw)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f'Не удалось восстановить игру {key}: {e}')
+                continue
+            self._games[key] = game
+            self._by_chat.setdefault(key[0], set()).add(key[1])
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty and not self._deleted:
+                return
+            upserts = {key: dump_game(self._games[key]) for key in self._dirty}
+            deletes = self._deleted
+            self._dirty, self._deleted = set(), set()
+            try:
+                await asyncio.to_thread(self.backend.write_batch, upserts, deletes)
+            except sqlite3.Error:
+                logging.error('Не удалось сохранить снимок игр', exc_info=True)
+                self._dirty.update(key for key in upserts if key in self._games)
+                self._deleted.update(key for key in deletes if key not in self._games)
+
+    async def run_snapshots(self, interval: float = SNAPSHOT_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+def create_state_backend(table: str = 'games') -> StateBackend:
+    if STATE_BACKEND == 'memory':
+        return MemoryStateBackend()
+    return SQLiteStateBackend(STATE_DB_PATH, table)
+
+
+games = GameStore(create_state_backend())
+
+# Префиксы callback_data. Данные кнопок держим короткими: Telegram ограничивает их 64 байтами
+CALLBACK_DATA_LIMIT = 64
+CB_GAMES_LIST = 'gl'
+CB_MAIN_MENU = 'mm'
+CB_GAME_INFO = 'gi'
+CB_QUIZ_ANSWER = 'qa'
+CB_CROC_WORD = 'cw'
+CB_CITIES_MODE = 'cm'
+CB_JOIN_CITIES = 'jc'
 
 # Данные для викторины
 QUIZ_QUESTIONS = [
@@ -84,9 +346,48 @@ QUIZ_QUESTIONS = [
 ]
 ROUND_COUNT = 5
 ANSWER_TIME = 20  # секунд на ответ
+# 'speed' — за верный ответ от 1 до SPEED_MAX_POINTS очков в зависимости от скорости, 'fixed' — всегда FIXED_POINTS
+QUIZ_SCORING = os.environ.get('SKILLBIT_QUIZ_SCORING', 'speed')
+FIXED_POINTS = 2
+SPEED_MAX_POINTS = 5
+LATENCY_HISTOGRAM_BINS = 5  # столбцов в гистограмме скорости ответов
+ROUND_PAUSE = 3  # секунд между итогами раунда и следующим вопросом
+# Раунд закрывается досрочно, когда ответила доля QUIZ_QUORUM активных игроков —
+# тех, кто отвечал в последних QUIZ_ACTIVE_ROUNDS раундах
+QUIZ_QUORUM = float(os.environ.get('SKILLBIT_QUIZ_QUORUM', '1.0'))
+QUIZ_ACTIVE_ROUNDS = 2
+
+# Банк вопросов собирается build_question_bank.py; без файла викторина берет QUIZ_QUESTIONS
+QUESTION_BANK_PATH = os.environ.get('SKILLBIT_QUESTION_BANK', 'questions.skqb')
+QUIZ_LANGUAGE = os.environ.get('SKILLBIT_QUIZ_LANGUAGE', 'ru')
+DEFAULT_CATEGORY = 'Общие'
+QUESTION_CACHE_SIZE = 1024  # раскодированных вопросов в памяти
+QUESTION_BANK_MAGIC = b'SKQB'
+QUESTION_BANK_VERSION = 1
+QUESTION_BANK_HEADER = struct.Struct('<4sHHIQQ')  # сигнатура, версия, резерв, число вопросов, смещения индекса и метаданных
+QUESTION_OFFSET = struct.Struct('<Q')
+QUESTION_HEAD = struct.Struct('<BB')  # номер правильного варианта, число вариантов
+STRING_LENGTH = struct.Struct('<H')
+
+# Недавно заданные вопросы: на чат два поколения фильтра Блума по SEEN_GENERATION_SIZE вопросов,
+# 600 байт и 7 хэшей дают около 1% ложных срабатываний на поколение
+SEEN_GENERATION_SIZE = 500
+SEEN_FILTER_BYTES = 600
+SEEN_FILTER_HASHES = 7
+SEEN_CACHE_SIZE = 10000  # фильтров чатов в памяти
+SEEN_SAMPLE_FACTOR = 8  # кандидатов на один вопрос при выборке без уже заданных
+
+# Статистика игроков: итоги игр копятся в памяти и пачкой сливаются в SQLite
+STATS_DB_PATH = os.environ.get('SKILLBIT_STATS_DB', STATE_DB_PATH)
+STATS_GAME_NAMES = {"quiz": "Викторина", "cities": "Города", "crocodile": "Крокодил"}
+ALL_GAMES = '*'  # сводная строка по всем играм
+GLOBAL_CHAT = 0  # сводная строка по всем чатам
+TOP_LIMIT = 10
 
 # Данные для крокодила
 CROC_WORDS = ["слон", "велосипед", "кошка", "самолет", "дерево", "компьютер"]
+CROC_EXPLAIN_TIME = 15  # секунд на объяснение
+CROC_GUESS_TIME = 60  # секунд на угадывание после объяснения
 
 # Данные для игры "Города/Страны"
 BAD_ENDING_LETTERS = {'ь', 'ы', 'ъ', 'й'}
@@ -111,777 +412,3030 @@ CITIES = [
     "Флоренция", "Филадельфия", "Хельсинки", "Хартум", "Хьюстон", "Цюрих", "Чикаго", "Шанхай",
     "Шэньчжэнь", "Эдмонтон", "Южно-Сахалинск", "Ярославль", "Ялта", "Якутск"
 ]
+# Другие названия -> название из списка. Псевдоним должен начинаться на ту же букву,
+# что и название: иначе ход на одну букву записался бы словом на другую.
+CITY_ALIASES = {
+    "СПб": "Санкт-Петербург", "Мумбай": "Мумбаи", "Таллинн": "Таллин", "Киів": "Киев",
+    "Лос-Анжелес": "Лос-Анджелес", "Рио": "Рио-де-Жанейро",
+}
+COUNTRY_ALIASES = {
+    "Соединенные Штаты": "США", "Соединенные Штаты Америки": "США",
+    "Южно-Африканская Республика": "ЮАР", "Чешская Республика": "Чехия", "Тайланд": "Таиланд",
+    "Российская Федерация": "Россия",
+}
+# Словари с диска: <режим>.txt, строка «Название|другое название|...», # — комментарий.
+# Другие названия на иную букву, чем само название, не учитываются.
+# Если файла нет, используется встроенный список.
+GAZETTEER_DIR = os.environ.get('SKILLBIT_GAZETTEER_DIR', 'gazetteers')
+CITIES_MODES = ("cities", "countries")
+# Бот-соперник для игры в одиночку: стратегия по умолчанию ('off' — без бота)
+BOT_STRATEGIES = ("random", "trap", "lookahead")
+BOT_STRATEGY_NAMES = {"random": "легкий", "trap": "средний", "lookahead": "сложный"}
+CITIES_BOT = os.environ.get('SKILLBIT_CITIES_BOT', 'trap')
+CITIES_BOT_DELAY = 1.5  # секунд «на раздумье» перед ходом бота
+ROUTE_LETTERS = 3  # сколько запасных букв различает бот при выборе слова
+# Перебор ботов: (полуходов вперед, сколько лучших ходов смотреть на каждом полуходе)
+BOT_SEARCH = {"trap": (3, 2), "lookahead": (5, 2)}
+BOT_WIN = 10 ** 6
+# Сколько узлов дерева маршрутов бот просматривает, собирая ходы на одну букву: в конце
+# партии на большом словаре полный обход стоил десятки миллисекунд на каждый ход
+BOT_ROUTE_LIMIT = 200
 CITIES_ANSWER_TIMEOUT = 20
 JOIN_TIMEOUT = 20
 
+# Сроки, которые администраторы чата меняют командой /timers: имя -> (описание, минимум, максимум секунд).
+# По умолчанию действуют константы выше; новое значение применяется к следующей игре
+TIMER_SETTINGS = {
+    'answer': ('ответ на вопрос викторины', 5, 300),
+    'pause': ('пауза между вопросами викторины', 0, 60),
+    'explain': ('объяснение в крокодиле', 5, 300),
+    'guess': ('угадывание в крокодиле', 10, 600),
+    'join': ('набор игроков в городах', 5, 300),
+    'turn': ('ход в городах', 5, 300),
+}
+
+# Лимиты исходящих сообщений Bot API
+GLOBAL_RATE = 30  # сообщений в секунду на бота
+GROUP_RATE = 20  # сообщений в минуту на группу
+PRIVATE_RATE = 1  # сообщений в секунду в личный чат
+RATE_WINDOW_MARGIN = 0.05  # запас к окнам лимитов на разброс задержки до Telegram, с
+MAX_SEND_RETRIES = 3
+CHAT_WINDOWS_LIMIT = 10000
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = 0, 1, 2
+# rate_limit_args принимают только методы context.bot, но не шорткаты вроде reply_text
+RL_URGENT = {'priority': PRIORITY_HIGH}  # таймеры и результаты
+RL_COSMETIC = {'priority': PRIORITY_LOW, 'coalesce': True}  # правки, которые можно схлопнуть
+LIMITED_ENDPOINTS = frozenset({
+    'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'deleteMessage',
+    'sendPhoto', 'sendSticker', 'sendAnimation',
+})
+
+# Кэш имен игроков
+NAME_CACHE_TTL = 600  # секунд
+NAME_CACHE_SIZE = 10000
+NAME_FETCH_CONCURRENCY = 20  # одновременных get_chat_member при подведении итогов
+
+# Итоги раундов помещаются в одно сообщение
+MESSAGE_LIMIT = 4096
+RESULT_LINES_LIMIT = 50  # игроков в итогах, остальные сводятся в одну строку
+
+# Метрики: /metrics в формате Prometheus на локальном порту (0 — выключено), воркеры слушают METRICS_PORT+1+номер
+METRICS_HOST = os.environ.get('SKILLBIT_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('SKILLBIT_METRICS_PORT', '9108'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # секунд
+# Telegram id пользователей, которым доступна команда /stats
+ADMIN_IDS = frozenset(int(x) for x in os.environ.get('SKILLBIT_ADMIN_IDS', '').replace(',', ' ').split())
+
+
+def plural(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+# Начисление очков в викторине описывается по включенному режиму QUIZ_SCORING
+if QUIZ_SCORING == 'speed':
+    QUIZ_CALL = "Отвечайте на вопросы быстрее других!"
+    QUIZ_SCORING_RULE = f"**от 1 до {SPEED_MAX_POINTS} очков** за правильный ответ: чем быстрее, тем больше"
+else:
+    QUIZ_CALL = "Отвечайте на вопросы точнее других!"
+    QUIZ_SCORING_RULE = f"**{FIXED_POINTS} {plural(FIXED_POINTS, 'очко', 'очка', 'очков')}** за правильный ответ"
+
+# Описания игр (сроки — значения по умолчанию, чат может поменять их через /timers)
+game_descriptions = {
+    "Викторина": (
+        "🎓 **Викторина**\n\n"
+        f"Интеллектуальная битва на общие знания. {QUIZ_CALL}\n\n"
+        "**Правила:**\n"
+        "- Вопросы с вариантами ответов (A/B/C/D)\n"
+        f"- **{ANSWER_TIME} секунд** на обдумывание\n"
+        f"- {QUIZ_SCORING_RULE}\n"
+        f"- Итоговый рейтинг после {ROUND_COUNT} раундов\n"
+        "- Тему можно выбрать: /quiz <категория>"
+    ),
+    "Крокодил": (
+        "🐊 **Крокодил**\n\n"
+        "Объясняйте слова без прямых подсказок, а другие игроки должны угадать!\n\n"
+        "**Правила:**\n"
+        "- **Крокодил** выбирает слово из 3 вариантов\n"
+        f"- **{CROC_EXPLAIN_TIME} секунд** на объяснение (жесты, ассоциации)\n"
+        f"- **{CROC_GUESS_TIME} секунд** на угадывание\n"
+        "- Нельзя использовать однокоренные слова"
+    ),
+    "Города и страны": (
+        "🏙️ **Города и страны**\n\n"
+        "Назовите город или страну на последнюю букву предыдущего слова\n\n"
+        "**Правила:**\n"
+        "- Режимы: **города** или **страны**\n"
+        f"- На **{CITIES_ANSWER_TIMEOUT} секунд** дается на ответ\n"
+        "- Буквы **Ь, Ы, Ъ, Й** пропускаются (берется предыдущая)\n"
+        "- Буква **Я** обрабатывается специально: слова на 'Я' имеют приоритет\n"
+        "- Когда слова на текущую букву заканчиваются, ищется следующая подходящая буква\n"
+        "- Повторять слова нельзя\n"
+        "- Проигрывает тот, кто не успел или ошибся"
+    )
+}
+
+GAME_NAMES = tuple(game_descriptions)
+
+
+WORD_SEPARATORS = re.compile(r'[\s\-\u2010-\u2015]+')
+
+
+def normalize_word(text: str) -> str:
+    # Регистр, ё/е, дефисы, тире и пробелы между частями названия не различаются:
+    # «нью йорк», «Нью-Йорк» и «НЬЮ – ЙОРК» дают один ключ
+    text = text.strip().strip('.,!?;:"\'«»').casefold().replace('ё', 'е')
+    return WORD_SEPARATORS.sub('-', text).strip('-')
+
+
+def first_letter(word: str) -> str:
+    return normalize_word(word)[:1]
+
 
 def get_effective_letters(word: str) -> List[str]:
     letters = []
-    for ch in reversed(word.lower()):
-        if ch not in BAD_ENDING_LETTERS:
+    for ch in reversed(normalize_word(word)):
+        if ch.isalpha() and ch not in BAD_ENDING_LETTERS:
             letters.append(ch)
     return letters
 
 
-def find_available_letter(used_words: List[str], word_pool: List[str], last_word: str) -> str:
-    if not last_word:
-        return random.choice(word_pool)[0].lower()
+def word_route(tails: Tuple[str, ...]) -> Tuple[str, ...]:
+    # Буквы, на которые может начаться следующее слово, в порядке, в каком их
+    # пробует next_letter: «я» первой, затем остальные без повторов. Дальше
+    # ROUTE_LETTERS букв запасные почти не нужны, поэтому хвост отбрасывается.
+    route = ('я',) if 'я' in tails else ()
+    for letter in tails:
+        if letter not in route:
+            route += (letter,)
+    return route[:ROUTE_LETTERS]
+
+
+class WordPool:
+    # Неизменяемый словарь режима: слова, разложенные по первой букве, индекс
+    # нормализованных названий и псевдонимов и граф переходов между буквами.
+    # Один экземпляр на режим, общий для всех игр.
+    __slots__ = ('words', 'index', 'by_letter', 'letters', 'by_edge', 'routes', 'route_sizes')
+
+    def __init__(self, words: Iterable[str], aliases: Optional[Dict[str, str]] = None) -> None:
+        index: Dict[str, str] = {}
+        for word in words:
+            index.setdefault(normalize_word(word), word)
+        self.words: Tuple[str, ...] = tuple(dict.fromkeys(index.values()))
+        for alias, word in (aliases or {}).items():
+            canonical = index.get(normalize_word(word))
+            if canonical is not None and first_letter(alias) == first_letter(canonical):
+                index.setdefault(normalize_word(alias), canonical)
+        self.index: Dict[str, str] = index
+        by_letter: Dict[str, List[str]] = {}
+        for word in self.words:
+            by_letter.setdefault(first_letter(word), []).append(word)
+        self.by_letter: Dict[str, Tuple[str, ...]] = {letter: tuple(ws) for letter, ws in by_letter.items()}
+
+        # Для каждого слова заранее: первая буква и буквы, на которые может начинаться следующее
+        self.letters: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+            word: (first_letter(word), tuple(get_effective_letters(word))) for word in self.words
+        }
+        # Слова по ребрам (первая буква, маршрут) — для выбора хода ботом: слова одного
+        # ребра для игры взаимозаменяемы. Маршруты каждой буквы сложены в префиксное дерево,
+        # чтобы перебирать не все ребра, а только буквы, к которым ход реально приводит.
+        # route_sizes — сколько слов в поддереве узла: бот не заходит в поддеревья без неназванных слов.
+        by_edge: Dict[Tuple[str, Tuple[str, ...]], List[str]] = {}
+        routes: Dict[Tuple[str, Tuple[str, ...]], Dict[str, None]] = {}
+        sizes: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        for word, (start, tails) in self.letters.items():
+            route = word_route(tails)
+            by_edge.setdefault((start, route), []).append(word)
+            for i, letter in enumerate(route):
+                routes.setdefault((start, route[:i]), {})[letter] = None
+            for i in range(len(route) + 1):
+                sizes[(start, route[:i])] = sizes.get((start, route[:i]), 0) + 1
+        self.route_sizes: Dict[Tuple[str, Tuple[str, ...]], int] = sizes
+        self.by_edge: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, ...]] = {
+            edge: tuple(ws) for edge, ws in by_edge.items()
+        }
+        self.routes: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, ...]] = {
+            node: tuple(letters) for node, letters in routes.items()
+        }
+
+    def __contains__(self, word: str) -> bool:
+        return normalize_word(word) in self.index
+
+    def lookup(self, text: str) -> Optional[str]:
+        # Название из списка для введенного текста: O(длина слова)
+        return self.index.get(normalize_word(text))
+
+    def new_game(self, used_words: Iterable[str] = ()) -> 'WordPoolState':
+        return WordPoolState(self, used_words)
+
+
+class WordPoolState:
+    # Состояние словаря в конкретной игре: использованные слова и остатки по буквам —
+    # сколько неназванных слов начинается на каждую букву.
+    # Остатки меняются на каждом ходу за O(1), поэтому следующая буква и конец игры
+    # определяются без просмотра словаря. Курсор по букве сдвигается только вперед,
+    # так что поиск следующего слова в сумме за игру стоит O(размер корзины).
+    __slots__ = ('pool', 'used', 'remaining', 'cursors', 'edge_cursors', 'route_words', 'route_used')
+
+    def __init__(self, pool: WordPool, used_words: Iterable[str] = ()) -> None:
+        self.pool = pool
+        self.used: Set[str] = set()
+        self.remaining: Dict[str, int] = {letter: len(ws) for letter, ws in pool.by_letter.items()}
+        self.cursors: Dict[str, int] = {}
+        self.edge_cursors: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        self.route_words: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+        self.route_used: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        for word in used_words:
+            self.use(word)
+
+    def is_used(self, word: str) -> bool:
+        return word in self.used
+
+    def use(self, word: str) -> None:
+        if word in self.used:
+            return
+        self.used.add(word)
+        letters = self.pool.letters.get(word)
+        if letters is not None:
+            start, route = letters[0], word_route(letters[1])
+            self.remaining[start] -= 1
+            for i in range(len(route) + 1):
+                self.route_used[(start, route[:i])] = self.route_used.get((start, route[:i]), 0) + 1
+
+    def count(self, letter: str) -> int:
+        return self.remaining.get(letter, 0)
+
+    def left(self, letter: str, taken: Tuple[str, ...] = ()) -> int:
+        # Остаток на букву, если слова с первыми буквами taken уже названы
+        return self.remaining.get(letter, 0) - taken.count(letter)
+
+    def next_letter(self, last_word: str, taken: Tuple[str, ...] = ()) -> str:
+        letters = self.pool.letters.get(last_word)
+        tails = letters[1] if letters is not None else tuple(get_effective_letters(last_word))
+        if not tails:
+            return normalize_word(last_word)[-1:]
+        if 'я' in tails and self.left('я', taken) > 0:
+            return 'я'
+        for letter in tails:
+            if self.left(letter, taken) > 0:
+                return letter
+        return tails[0]
+
+    def is_dead_end(self, letter: str) -> bool:
+        return not self.remaining.get(letter)
+
+    def route_left(self, start: str, route: Tuple[str, ...]) -> int:
+        # Неназванные слова, маршрут которых начинается с route
+        return self.pool.route_sizes.get((start, route), 0) - self.route_used.get((start, route), 0)
+
+    def edge_word(self, edge: Tuple[str, Tuple[str, ...]], skip: Tuple[str, ...] = ()) -> Optional[str]:
+        # Первое неназванное слово ребра, кроме skip; курсор, как и в next_word, только растет
+        bucket = self.pool.by_edge.get(edge, ())
+        i = self.edge_cursors.get(edge, 0)
+        while i < len(bucket) and bucket[i] in self.used:
+            i += 1
+        self.edge_cursors[edge] = i
+        while i < len(bucket) and (bucket[i] in skip or bucket[i] in self.used):
+            i += 1
+        return bucket[i] if i < len(bucket) else None
+
+    def route_word(self, start: str, route: Tuple[str, ...], skip: Tuple[str, ...] = ()) -> Optional[str]:
+        # Любое неназванное слово, маршрут которого начинается с route. Найденное слово
+        # запоминается, пока его не назовут: бот спрашивает одни и те же маршруты много раз.
+        word = self.route_words.get((start, route))
+        if word is not None and word not in self.used and word not in skip:
+            return word
+        if self.route_left(start, route) <= 0:
+            return None
+        word = self.edge_word((start, route), skip)
+        for letter in self.pool.routes.get((start, route), ()):
+            if word is not None:
+                break
+            word = self.route_word(start, route + (letter,), skip)
+        if word is not None:
+            self.route_words[(start, route)] = word
+        return word
+
+    def moves(self, letter: str, played: Tuple[str, ...] = (), limit: int = BOT_ROUTE_LIMIT) -> Dict[str, str]:
+        # Ходы на букву после слов played, различающиеся для соперника: буква,
+        # на которую ему придется отвечать -> одно из слов, которые к ней ведут.
+        # Обход ограничен limit узлами; если за них не нашлось ни одного хода, берется любое слово.
+        taken = tuple(self.pool.letters[word][0] for word in played) + (letter,)
+        moves: Dict[str, str] = {}
+        stack: List[Tuple[str, ...]] = [()]
+        while stack and limit > 0:
+            limit -= 1
+            route = stack.pop()
+            if route and self.left(route[-1], taken) > 0:
+                if route[-1] not in moves:
+                    word = self.route_word(letter, route, played)
+                    if word is not None:
+                        moves[route[-1]] = word
+                continue
+            # Все буквы маршрута кончились: такие слова ведут в тупик (или к дальней запасной букве)
+            word = self.edge_word((letter, route), played)
+            if word is not None:
+                moves.setdefault(self.next_letter(word, taken), word)
+            stack.extend(route + (end,) for end in self.pool.routes.get((letter, route), ())
+                         if self.route_left(letter, route + (end,)) > 0)
+        if not moves and stack:
+            word = self.next_word(letter, played)
+            if word is not None:
+                moves[self.next_letter(word, taken)] = word
+        return moves
+
+    def next_word(self, letter: str, skip: Tuple[str, ...] = ()) -> Optional[str]:
+        if not self.remaining.get(letter):
+            return None
+        bucket = self.pool.by_letter[letter]
+        i = self.cursors.get(letter, 0)
+        while bucket[i] in self.used:
+            i += 1
+        self.cursors[letter] = i
+        while i < len(bucket) and (bucket[i] in skip or bucket[i] in self.used):
+            i += 1
+        return bucket[i] if i < len(bucket) else None
+
+
+BUILTIN_WORDS = {
+    "cities": (CITIES, CITY_ALIASES),
+    "countries": (COUNTRIES, COUNTRY_ALIASES),
+}
+WORD_POOLS: Dict[str, WordPool] = {}
+
+
+def load_gazetteer(path: str) -> Tuple[List[str], Dict[str, str]]:
+    words: List[str] = []
+    aliases: Dict[str, str] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            word, *other_names = (part.strip() for part in line.split('|'))
+            if not word:
+                continue
+            words.append(word)
+            for alias in other_names:
+                if alias:
+                    aliases[alias] = word
+    return words, aliases
+
+
+def get_word_pool(mode: str) -> WordPool:
+    # Словарь режима загружается один раз на процесс и дальше только читается
+    pool = WORD_POOLS.get(mode)
+    if pool is None:
+        words, aliases = BUILTIN_WORDS[mode]
+        path = os.path.join(GAZETTEER_DIR, f'{mode}.txt')
+        try:
+            words, aliases = load_gazetteer(path)
+            logging.info(f'Словарь {path}: {len(words)} названий, {len(aliases)} псевдонимов')
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeDecodeError) as e:
+            logging.error(f'Не удалось прочитать словарь {path}: {e}')
+        pool = WORD_POOLS[mode] = WordPool(words, aliases)
+    return pool
 
-    effective_letters = get_effective_letters(last_word)
 
-    if not effective_letters:
-        return last_word[-1].lower()
+async def load_word_pools() -> None:
+    # Большой словарь с диска строится около секунды; на старте это делается в потоках,
+    # чтобы первый ход в городах не останавливал цикл событий для всех чатов
+    await asyncio.gather(*(asyncio.to_thread(get_word_pool, mode) for mode in CITIES_MODES))
 
-    if 'я' in effective_letters:
-        for word in word_pool:
-            if word.lower().startswith('я') and word not in used_words:
-                return 'я'
 
-    for letter in effective_letters:
-        for word in word_pool:
-            if word.lower().startswith(letter) and word not in used_words:
-                return letter
+def find_available_letter(state: WordPoolState, last_word: str) -> str:
+    if not last_word:
+        return first_letter(random.choice(state.pool.words))
+    return state.next_letter(last_word)
 
-    for letter in last_word.lower()[::-1]:
-        if letter in BAD_ENDING_LETTERS:
-            continue
-        for word in word_pool:
-            if word.lower().startswith(letter) and word not in used_words:
-                return letter
 
-    return effective_letters[0] if effective_letters else last_word[-1].lower()
+def find_next_word(required_letter: str, state: WordPoolState) -> Optional[str]:
+    return state.next_word(required_letter)
 
 
-def find_next_word(required_letter: str, used_words: List[str], word_pool: List[str]) -> Optional[str]:
-    for word in word_pool:
-        if word.lower().startswith(required_letter) and word not in used_words:
+def bot_random_word(state: WordPoolState, letter: str, rng: random.Random) -> Optional[str]:
+    bucket = state.pool.by_letter.get(letter, ())
+    for _ in range(8):
+        word = rng.choice(bucket) if bucket else None
+        if word is not None and not state.is_used(word):
             return word
-    return None
+    return state.next_word(letter)
+
+
+def bot_search_score(state: WordPoolState, played: Tuple[str, ...], letter: str, depth: int, width: int,
+                     rng: random.Random) -> int:
+    # Оценка позиции для того, кто должен назвать слово на letter после слов played:
+    # число его вариантов через depth полуходов, проигрыш — -BOT_WIN
+    taken = tuple(state.pool.letters[word][0] for word in played)
+    left = state.left(letter, taken)
+    if left <= 0:
+        return -BOT_WIN
+    if depth == 0:
+        return left
+    moves = bot_ranked_moves(state, letter, width, rng, played)
+    if depth == 1:
+        # Ходы уже отсортированы по числу вариантов у соперника
+        return -state.left(moves[0][0], taken + (letter,))
+    best = -BOT_WIN
+    for reply_letter, word in moves:
+        best = max(best, -bot_search_score(state, played + (word,), reply_letter, depth - 1, width, rng))
+        if best >= BOT_WIN:
+            break
+    return best
+
+
+def bot_ranked_moves(state: WordPoolState, letter: str, width: int, rng: random.Random,
+                     played: Tuple[str, ...] = ()) -> List[Tuple[str, str]]:
+    # width самых неудобных для соперника ходов
+    taken = tuple(state.pool.letters[word][0] for word in played) + (letter,)
+    moves = list(state.moves(letter, played).items())
+    rng.shuffle(moves)
+    moves.sort(key=lambda move: state.left(move[0], taken))
+    return moves[:width]
+
+
+def bot_search_word(state: WordPoolState, letter: str, depth: int, width: int, rng: random.Random) -> Optional[str]:
+    best, best_score = None, -BOT_WIN - 1
+    for reply_letter, word in bot_ranked_moves(state, letter, width, rng):
+        score = -bot_search_score(state, (word,), reply_letter, depth - 1, width, rng)
+        if score > best_score:
+            best, best_score = word, score
+            if score >= BOT_WIN:
+                break
+    return best
+
+
+def bot_trap_word(state: WordPoolState, letter: str, rng: random.Random) -> Optional[str]:
+    # Загоняет соперника на редкие буквы, но смотрит только пару ходов на полуход.
+    # Просто жадный выбор самой редкой буквы играет слабее случайного: он быстрее
+    # исчерпывает буквы, на которых потом застревает сам.
+    return bot_search_word(state, letter, *BOT_SEARCH["trap"], rng)
+
+
+def bot_lookahead_word(state: WordPoolState, letter: str, rng: random.Random) -> Optional[str]:
+    # Тот же перебор, но шире: соперник тоже отвечает своими лучшими ходами
+    return bot_search_word(state, letter, *BOT_SEARCH["lookahead"], rng)
+
+
+BOT_MOVES: Dict[str, Callable[[WordPoolState, str, random.Random], Optional[str]]] = {
+    "random": bot_random_word,
+    "trap": bot_trap_word,
+    "lookahead": bot_lookahead_word,
+}
 
 
-async def mention_user(user_id: int, user_name: str) -> str:
-    return f'<a href="tg://user?id={user_id}">{user_name}</a>'
+def encode_question(question: Dict) -> bytes:
+    options = question['options']
+    parts = [QUESTION_HEAD.pack(options.index(question['answer']), len(options))]
+    for text in (question['question'], *options):
+        raw = text.encode()
+        parts.append(STRING_LENGTH.pack(len(raw)))
+        parts.append(raw)
+    return b''.join(parts)
+
+
+def encode_question_bank(questions: Iterable[Dict]) -> bytes:
+    # Вопросы группируются по (категория, язык): каждая группа занимает непрерывный
+    # диапазон номеров, и выборка из темы не требует отдельного списка номеров
+    grouped: Dict[Tuple[str, str], List[bytes]] = {}
+    for question in questions:
+        key = (question.get('category') or DEFAULT_CATEGORY, question.get('language') or QUIZ_LANGUAGE)
+        grouped.setdefault(key, []).append(encode_question(question))
+
+    records: List[bytes] = []
+    offsets: List[int] = []
+    groups: List[List] = []
+    position = QUESTION_BANK_HEADER.size
+    for category, language in sorted(grouped):
+        start = len(offsets)
+        for record in grouped[(category, language)]:
+            offsets.append(position)
+            records.append(record)
+            position += len(record)
+        groups.append([category, language, start, len(offsets)])
+    count = len(offsets)
+    offsets.append(position)
+
+    index = struct.pack(f'<{len(offsets)}Q', *offsets)
+    meta = json.dumps({'groups': groups}, ensure_ascii=False).encode()
+    header = QUESTION_BANK_HEADER.pack(QUESTION_BANK_MAGIC, QUESTION_BANK_VERSION, 0, count,
+                                       position, position + len(index))
+    return b''.join((header, *records, index, meta))
+
+
+class QuestionBank:
+    # Банк вопросов: заголовок, записи вопросов, индекс смещений и JSON с диапазонами групп.
+    # Файл открывается через mmap, вопрос раскодируется только когда нужен раунду,
+    # в памяти остаются диапазоны групп и небольшой LRU недавних вопросов.
+    def __init__(self, buffer: Union[bytes, mmap.mmap], source: str = '') -> None:
+        magic, version, _, count, index_offset, meta_offset = QUESTION_BANK_HEADER.unpack_from(buffer, 0)
+        if magic != QUESTION_BANK_MAGIC or version != QUESTION_BANK_VERSION:
+            raise ValueError(f'{source}: не банк вопросов SKQB версии {QUESTION_BANK_VERSION}')
+        self._buffer = buffer
+        self._file = None
+        self._count = count
+        self._index_offset = index_offset
+        meta = json.loads(bytes(buffer[meta_offset:]))
+        self.groups: Dict[Tuple[str, str], range] = {
+            (category, language): range(start, end) for category, language, start, end in meta['groups']
+        }
+        self._cache: 'OrderedDict[int, Dict]' = OrderedDict()
+
+    @classmethod
+    def open(cls, path: str) -> 'QuestionBank':
+        file = open(path, 'rb')
+        try:
+            bank = cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), path)
+        except Exception:
+            file.close()
+            raise
+        bank._file = file
+        return bank
+
+    @classmethod
+    def from_questions(cls, questions: Iterable[Dict]) -> 'QuestionBank':
+        return cls(encode_question_bank(questions), 'встроенные вопросы')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def languages(self) -> Set[str]:
+        return {language for _, language in self.groups}
+
+    def categories(self, language: Optional[str] = None) -> List[str]:
+        return sorted({c for c, lang in self.groups if language is None or lang == language})
+
+    def ranges(self, category: Optional[str] = None, language: Optional[str] = None) -> List[range]:
+        return [numbers for (c, lang), numbers in self.groups.items()
+                if (category is None or c == category) and (language is None or lang == language)]
+
+    def sample(self, k: int, category: Optional[str] = None, language: Optional[str] = None,
+               exclude: Optional[Callable[[int], bool]] = None, rng: Optional[random.Random] = None) -> List[int]:
+        # Выборка без повторов по сквозной нумерации выбранных групп: random.sample
+        # на range не строит список всех номеров. С exclude берется больше кандидатов,
+        # и исключенные вопросы идут в дело, только если свежих не хватило.
+        ranges = self.ranges(category, language)
+        total = sum(len(numbers) for numbers in ranges)
+        wanted = k * SEEN_SAMPLE_FACTOR if exclude is not None else k
+        candidates = []
+        for position in (rng or random).sample(range(total), min(wanted, total)):
+            for numbers in ranges:
+                if position < len(numbers):
+                    candidates.append(numbers[position])
+                    break
+                position -= len(numbers)
+        if exclude is None:
+            return candidates
+        fresh, stale = [], []
+        for number in candidates:
+            (stale if exclude(number) else fresh).append(number)
+        return (fresh + stale)[:k]
+
+    def key(self, number: int) -> bytes:
+        # Ключ вопроса не зависит от номера, поэтому переживает пересборку банка
+        return hashlib.blake2b(self.question(number)['question'].casefold().encode(), digest_size=8).digest()
+
+    def question(self, number: int) -> Dict:
+        cached = self._cache.get(number)
+        if cached is not None:
+            self._cache.move_to_end(number)
+            return cached
+        if not 0 <= number < self._count:
+            raise IndexError(f'Нет вопроса с номером {number}')
+
+        buffer = self._buffer
+        (position,) = QUESTION_OFFSET.unpack_from(buffer, self._index_offset + number * QUESTION_OFFSET.size)
+        answer, option_count = QUESTION_HEAD.unpack_from(buffer, position)
+        position += QUESTION_HEAD.size
+        texts = []
+        for _ in range(option_count + 1):
+            (length,) = STRING_LENGTH.unpack_from(buffer, position)
+            position += STRING_LENGTH.size
+            texts.append(buffer[position:position + length].decode())
+            position += length
+
+        question = {'question': texts[0], 'options': texts[1:], 'answer': texts[1 + answer]}
+        self._cache[number] = question
+        if len(self._cache) > QUESTION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return question
+
+
+question_bank: Optional[QuestionBank] = None
+
+
+def get_question_bank() -> QuestionBank:
+    # Банк открывается при первой викторине, а не при старте бота
+    global question_bank
+    if question_bank is None:
+        try:
+            question_bank = QuestionBank.open(QUESTION_BANK_PATH)
+            logging.info(f'Банк вопросов {QUESTION_BANK_PATH}: {len(question_bank)} вопросов')
+        except FileNotFoundError:
+            question_bank = QuestionBank.from_questions(QUIZ_QUESTIONS)
+        except (OSError, ValueError, struct.error) as e:
+            logging.error(f'Не удалось открыть банк вопросов {QUESTION_BANK_PATH}: {e}')
+            question_bank = QuestionBank.from_questions(QUIZ_QUESTIONS)
+    return question_bank
+
+
+class RotatingBloomFilter:
+    # Когда текущее поколение заполнено, предыдущее выбрасывается, а текущее становится
+    # предыдущим: фильтр помнит от SEEN_GENERATION_SIZE до удвоенного числа последних ключей
+    __slots__ = ('current', 'previous', 'count')
+
+    def __init__(self) -> None:
+        self.current = bytearray(SEEN_FILTER_BYTES)
+        self.previous = bytearray(SEEN_FILTER_BYTES)
+        self.count = 0
+
+    @staticmethod
+    def _positions(key: bytes) -> List[int]:
+        # Двойное хэширование: k позиций из двух половин 64-битного ключа
+        h = int.from_bytes(key[:8], 'little')
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits = SEEN_FILTER_BYTES * 8
+        return [(h1 + i * h2) % bits for i in range(SEEN_FILTER_HASHES)]
+
+    @staticmethod
+    def _has(generation: bytearray, positions: List[int]) -> bool:
+        return all(generation[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def __contains__(self, key: bytes) -> bool:
+        positions = self._positions(key)
+        return self._has(self.current, positions) or self._has(self.previous, positions)
+
+    def add(self, key: bytes) -> None:
+        if self.count >= SEEN_GENERATION_SIZE:
+            self.previous, self.current = self.current, bytearray(SEEN_FILTER_BYTES)
+            self.count = 0
+        for p in self._positions(key):
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def dump(self) -> str:
+        return json.dumps({
+            'count': self.count,
+            'current': base64.b64encode(self.current).decode(),
+            'previous': base64.b64encode(self.previous).decode(),
+        })
+
+    @classmethod
+    def load(cls, raw: str) -> 'RotatingBloomFilter':
+        bloom = cls()
+        state = json.loads(raw)
+        current, previous = base64.b64decode(state['current']), base64.b64decode(state['previous'])
+        # После смены размера фильтра старые биты не годятся — начинаем с пустого
+        if len(current) == len(previous) == SEEN_FILTER_BYTES:
+            bloom.current, bloom.previous, bloom.count = bytearray(current), bytearray(previous), state['count']
+        return bloom
+
+
+class SeenQuestions:
+    # Фильтры недавно заданных вопросов по чатам. Фильтр читается из бэкенда при первой
+    # викторине в чате, в памяти держится не больше SEEN_CACHE_SIZE фильтров (LRU),
+    # измененные фильтры сохраняются пачкой вместе со снимками игр.
+    def __init__(self, backend: StateBackend, maxsize: int = SEEN_CACHE_SIZE) -> None:
+        self.backend = backend
+        self.maxsize = maxsize
+        self._filters: 'OrderedDict[int, RotatingBloomFilter]' = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._evicted: Dict[int, str] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    async def get(self, chat_id: int) -> RotatingBloomFilter:
+        bloom = self._filters.get(chat_id)
+        if bloom is None:
+            raw = self._evicted.get(chat_id)
+            if raw is None:
+                try:
+                    raw = await asyncio.to_thread(self.backend.load_one, (chat_id, 0))
+                except sqlite3.Error:
+                    logging.error(f'Не удалось прочитать заданные вопросы чата {chat_id}', exc_info=True)
+                if raw and recorder is not None:
+                    recorder.state('seen', chat_id, raw)
+            # Пока читали, фильтр мог появиться из параллельного апдейта
+            bloom = self._filters.get(chat_id)
+            if bloom is None:
+                try:
+                    bloom = RotatingBloomFilter.load(raw) if raw else RotatingBloomFilter()
+                except (ValueError, KeyError, TypeError):
+                    bloom = RotatingBloomFilter()
+                self._filters[chat_id] = bloom
+                self._evict()
+        self._filters.move_to_end(chat_id)
+        return bloom
+
+    def _evict(self) -> None:
+        while len(self._filters) > self.maxsize:
+            chat_id, bloom = self._filters.popitem(last=False)
+            if chat_id in self._dirty:
+                # Несохраненный фильтр дождется ближайшего снимка
+                self._dirty.discard(chat_id)
+                self._evicted[chat_id] = bloom.dump()
+
+    async def mark(self, chat_id: int, key: bytes) -> None:
+        (await self.get(chat_id)).add(key)
+        self._dirty.add(chat_id)
+        self._evicted.pop(chat_id, None)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty and not self._evicted:
+                return
+            # Вопросы общие для всех тем чата и хранятся под общей темой
+            upserts = {(chat_id, 0): raw for chat_id, raw in self._evicted.items()}
+            upserts.update(((chat_id, 0), self._filters[chat_id].dump())
+                           for chat_id in self._dirty if chat_id in self._filters)
+            dirty, evicted = self._dirty, self._evicted
+            self._dirty, self._evicted = set(), {}
+            try:
+                await asyncio.to_thread(self.backend.write_batch, upserts, set())
+            except sqlite3.Error:
+                logging.error('Не удалось сохранить заданные вопросы', exc_info=True)
+                self._dirty.update(chat_id for chat_id in dirty if chat_id in self._filters)
+                for chat_id, raw in evicted.items():
+                    self._evicted.setdefault(chat_id, raw)
 
+    async def run_snapshots(self, interval: float = SNAPSHOT_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if update.effective_chat.type == 'private':
-        await update.message.reply_text(
-            'Привет, я СкиллБит! Бот, который имеет коллекцию из логических и настольных игр.'
-        )
-        bot_username = context.bot.username
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("➕ Добавить в группу", url=f"https://t.me/{bot_username}?startgroup=true")],
-            [InlineKeyboardButton("Мини-игры", callback_data="games_list")]
-        ])
-        await update.message.reply_text(
-            "Я предназначен для работы в групповых чатах. Добавьте меня в свою беседу!",
-            reply_markup=keyboard
-        )
-    else:
-        await update.message.reply_text('Привет! Используйте команды, чтобы начать игру.')
 
+seen_questions = SeenQuestions(create_state_backend('seen_questions'))
 
-async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    bot_username = context.bot.username
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Добавить в группу", url=f"https://t.me/{bot_username}?startgroup=true")],
-        [InlineKeyboardButton("Мини-игры", callback_data="games_list")]
-    ])
-    await update.message.reply_text(
-        "Выберите действие:",
-        reply_markup=keyboard
-    )
 
+def default_timings() -> Dict[str, float]:
+    return {'answer': ANSWER_TIME, 'pause': ROUND_PAUSE, 'explain': CROC_EXPLAIN_TIME,
+            'guess': CROC_GUESS_TIME, 'join': JOIN_TIMEOUT, 'turn': CITIES_ANSWER_TIMEOUT}
 
-async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
 
-    if update.effective_chat.type == 'private':
-        if chat_id in games:
-            game = games[chat_id]
-            if game['type'] == 'cities' and 'join_message_id' in game:
-                try:
-                    await context.bot.delete_message(chat_id, game['join_message_id'])
-                except BadRequest:
-                    pass
-            games.pop(chat_id, None)
-            await update.message.reply_text('Игра остановлена.')
-        else:
-            await update.message.reply_text('Нет активной игры для остановки.')
-        return
+class ChatSettings:
+    # Настройки, которые администраторы задали своему чату. Строки есть только у измененных
+    # чатов, поэтому воркер загружает свою долю целиком при старте и читает синхронно,
+    # а изменение сразу пишется в бэкенд. Записи идут по одной: у бэкенда одно соединение
+    # на все потоки, и параллельные транзакции на нем падают.
+    def __init__(self, backend: StateBackend) -> None:
+        self.backend = backend
+        self._chats: Dict[int, Dict[str, Any]] = {}
+        self._recorded: Set[int] = set()
+        self._write_lock = asyncio.Lock()
 
-    try:
-        admins = [a.user.id for a in await context.bot.get_chat_administrators(chat_id)]
-    except BadRequest:
-        admins = []
+    def load(self, shard: int = 0, shards: int = 1) -> None:
+        for (chat_id, _), raw in self.backend.load_all(shard, shards).items():
+            try:
+                self._chats[chat_id] = json.loads(raw)
+            except ValueError as e:
+                logging.warning(f'Не удалось прочитать настройки чата {chat_id}: {e}')
 
-    if user_id not in admins:
-        return await update.message.reply_text('Только админ может сбросить игры.')
+    def _record(self, chat_id: int) -> None:
+        # Настройки из базы попадают в журнал при первом обращении, иначе повтор их не увидит
+        if recorder is None or chat_id in self._recorded:
+            return
+        self._recorded.add(chat_id)
+        if chat_id in self._chats:
+            recorder.state('settings', chat_id, self._chats[chat_id])
+
+    def timings(self, chat_id: int) -> Dict[str, float]:
+        self._record(chat_id)
+        timings = default_timings()
+        for name, value in self._chats.get(chat_id, {}).get('timers', {}).items():
+            if name in timings:
+                timings[name] = value
+        return timings
+
+    async def set_timing(self, chat_id: int, name: str, value: Optional[float]) -> bool:
+        # value=None возвращает значение по умолчанию
+        self._record(chat_id)
+        settings = self._chats.setdefault(chat_id, {})
+        timers = settings.setdefault('timers', {})
+        if value is None:
+            timers.pop(name, None)
+        else:
+            timers[name] = value
+        key = (chat_id, 0)
+        if any(settings.values()):
+            upserts, deletes = {key: json.dumps(settings, separators=(',', ':'))}, set()
+        else:
+            del self._chats[chat_id]
+            upserts, deletes = {}, {key}
+        async with self._write_lock:
+            try:
+                await asyncio.to_thread(self.backend.write_batch, upserts, deletes)
+            except sqlite3.Error:
+                logging.error(f'Не удалось сохранить настройки чата {chat_id}', exc_info=True)
+                return False
+        return True
+
+
+chat_settings = ChatSettings(create_state_backend('chat_settings'))
+
+
+def stats_periods(timestamp: float) -> Tuple[str, str, str]:
+    # Корзины, в которые попадает результат: за все время, месяц и ISO-неделя (UTC)
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    year, week, _ = moment.isocalendar()
+    return 'all', f'{moment.year}-{moment.month:02d}', f'{year}-W{week:02d}'
+
+
+class StatsStore:
+    # Очки, победы и число игр по (чат, период, игра, игрок). Итоги игры не пишутся
+    # из обработчика: record складывает их в словарь приращений, а flush раз в
+    # SNAPSHOT_INTERVAL одной транзакцией прибавляет их к агрегатам в SQLite.
+    # Индекс по (чат, период, игра, очки) отдает топ за O(log n + k), а строки
+    # игрока читаются по первичному ключу. Отображаемое имя игрока сохраняется
+    # вместе с результатами, чтобы общий топ не спрашивал имена у других чатов.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[Tuple[int, str, str, int], List[int]] = {}
+        self._names: Dict[int, str] = {}
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA busy_timeout=5000')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS player_stats ('
+                'chat_id INTEGER NOT NULL, period TEXT NOT NULL, game TEXT NOT NULL, user_id INTEGER NOT NULL, '
+                'points INTEGER NOT NULL, wins INTEGER NOT NULL, games INTEGER NOT NULL, '
+                'PRIMARY KEY (chat_id, period, user_id, game)) WITHOUT ROWID'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS player_stats_top '
+                'ON player_stats (chat_id, period, game, points DESC, wins DESC)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS player_names (user_id INTEGER PRIMARY KEY, name TEXT NOT NULL)'
+            )
+        return self._conn
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def record(self, chat_id: int, game: str, results: Dict[int, Tuple[int, bool]],
+               timestamp: Optional[float] = None) -> None:
+        # results: игрок -> (очки, победа). Каждый результат попадает в строки чата и общую,
+        # по своей игре и по всем играм, во все периоды
+        periods = stats_periods(clock.time() if timestamp is None else timestamp)
+        for user_id, (points, won) in results.items():
+            name = name_cache.peek(chat_id, user_id)
+            if name is not None:
+                self._names[user_id] = name
+            for scope in (chat_id, GLOBAL_CHAT):
+                for period in periods:
+                    for game_key in (game, ALL_GAMES):
+                        totals = self._pending.setdefault((scope, period, game_key, user_id), [0, 0, 0])
+                        totals[0] += points
+                        totals[1] += won
+                        totals[2] += 1
+
+    def write_batch(self, batch: Dict[Tuple[int, str, str, int], List[int]], names: Dict[int, str]) -> None:
+        conn = self.conn
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                'INSERT INTO player_stats (chat_id, period, game, user_id, points, wins, games) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(chat_id, period, user_id, game) DO UPDATE SET '
+                'points = points + excluded.points, wins = wins + excluded.wins, games = games + excluded.games',
+                [(*key, *totals) for key, totals in batch.items()]
+            )
+            conn.executemany(
+                'INSERT INTO player_names (user_id, name) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET name = excluded.name',
+                names.items()
+            )
 
-    if chat_id in games:
-        game = games[chat_id]
-        if game['type'] == 'cities' and 'join_message_id' in game:
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending and not self._names:
+                return
+            batch, self._pending = self._pending, {}
+            names, self._names = self._names, {}
             try:
-                await context.bot.delete_message(chat_id, game['join_message_id'])
-            except BadRequest:
-                pass
-        games.pop(chat_id, None)
-        await update.message.reply_text('Игра остановлена.')
-    else:
-        await update.message.reply_text('Нет активной игры для остановки.')
+                await asyncio.to_thread(self.write_batch, batch, names)
+            except sqlite3.Error:
+                logging.error('Не удалось сохранить статистику игроков', exc_info=True)
+                # Приращения складываются, так что несохраненные просто вернутся в очередь
+                for key, totals in batch.items():
+                    pending = self._pending.setdefault(key, [0, 0, 0])
+                    for i, value in enumerate(totals):
+                        pending[i] += value
+                # Имена, записанные после сбоя, новее
+                self._names = {**names, **self._names}
 
+    def _top(self, chat_id: int, period: str, game: str,
+             limit: int) -> List[Tuple[int, int, int, int, Optional[str]]]:
+        return self.conn.execute(
+            'SELECT s.user_id, s.points, s.wins, s.games, n.name FROM player_stats AS s '
+            'LEFT JOIN player_names AS n ON n.user_id = s.user_id '
+            'WHERE s.chat_id = ? AND s.period = ? AND s.game = ? ORDER BY s.points DESC, s.wins DESC LIMIT ?',
+            (chat_id, period, game, limit)
+        ).fetchall()
 
-async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat = update.effective_chat
-    if chat.type not in ['group', 'supergroup']:
-        await update.message.reply_text("Викторина доступна только в группах.")
-        return
+    def _player(self, chat_id: int, period: str, user_id: int) -> Dict[str, Tuple[int, int, int]]:
+        rows = self.conn.execute(
+            'SELECT game, points, wins, games FROM player_stats WHERE chat_id = ? AND period = ? AND user_id = ?',
+            (chat_id, period, user_id)
+        ).fetchall()
+        return {game: (points, wins, games) for game, points, wins, games in rows}
 
-    if chat.id in games:
-        await update.message.reply_text("В этом чате уже идет другая игра. Сначала завершите её (/stop).")
-        return
+    async def top(self, chat_id: int, period: str = 'all', game: str = ALL_GAMES,
+                  limit: int = TOP_LIMIT) -> List[Tuple[int, int, int, int, Optional[str]]]:
+        # Перед чтением досылаем накопленное, чтобы только что сыгранная игра была видна
+        await self.flush()
+        return await asyncio.to_thread(self._top, chat_id, period, game, limit)
 
-    questions = random.sample(QUIZ_QUESTIONS, min(ROUND_COUNT, len(QUIZ_QUESTIONS)))
+    async def player(self, chat_id: int, period: str, user_id: int) -> Dict[str, Tuple[int, int, int]]:
+        await self.flush()
+        return await asyncio.to_thread(self._player, chat_id, period, user_id)
 
-    games[chat.id] = {
-        'type': 'quiz',
-        'chat_id': chat.id,
-        'questions': questions,
-        'current_round': 0,
-        'scores': {},
-        'answers': {},
-    }
-    await send_next_question(chat.id, context)
+    async def run_snapshots(self, interval: float = SNAPSHOT_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
 
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
-async def send_next_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    game = games.get(chat_id)
-    if not game or game['type'] != 'quiz':
-        return
 
-    if game['current_round'] >= len(game['questions']):
-        await show_final_scores(chat_id, context)
-        games.pop(chat_id, None)
-        return
+def create_stats_store() -> StatsStore:
+    # В режиме без диска статистика живет в памяти процесса
+    return StatsStore(':memory:' if STATE_BACKEND == 'memory' else STATS_DB_PATH)
 
-    question_info = game['questions'][game['current_round']]
-    keyboard = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(opt, callback_data=f'quiz_answer:{chat_id}:{opt}')] for opt in question_info['options']])
 
-    game['answers'] = {}
-    message_text = (f"Вопрос {game['current_round'] + 1} из {len(game['questions'])}:\n\n"
-                    f"{question_info['question']}\n\nУ вас есть {ANSWER_TIME} секунд на ответ!")
+stats = create_stats_store()
 
-    await context.bot.send_message(chat_id, message_text, reply_markup=keyboard)
-    asyncio.create_task(wait_answer_time(chat_id, context))
 
+class Clock:
+    # Время игр: стенные часы для сроков в снимках и статистики, монотонные — для таймеров
+    # и скорости ответов. Обычные часы идут сами, ручные (manual) стоят, пока их не сдвинут.
+    manual = False
 
-async def wait_answer_time(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await asyncio.sleep(ANSWER_TIME)
-    game = games.get(chat_id)
-    if not game or game['type'] != 'quiz':
-        return
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
 
-    question_info = game['questions'][game['current_round']]
-    correct_answer = question_info['answer']
 
-    results = [f"Время истекло! Результаты вопроса:\n"]
-    for user_id, answer in game['answers'].items():
+class VirtualClock(Clock):
+    # Часы для воспроизведения журнала: время перескакивает к следующему событию,
+    # поэтому час трафика с таймерами раундов проходит за секунды
+    manual = True
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def set(self, now: float) -> None:
+        self.now = max(self.now, now)
+
+
+clock = Clock()
+
+
+def game_random(key: GameKey, salt: Any) -> random.Random:
+    # Генератор на одно событие игры вместо общего: при воспроизведении журнала с тем же
+    # RANDOM_SEED игра получает те же вопросы, слова и ходы бота, как бы ни перемежались
+    # апдейты разных чатов. Строковое зерно не зависит от PYTHONHASHSEED.
+    return random.Random(f'{RANDOM_SEED}:{key[0]}:{key[1]}:{salt}')
+
+
+def encode_record_value(value: Any) -> Any:
+    # Клавиатуры и прочие объекты telegram в параметрах вызовов пишутся как в Bot API
+    return value.to_dict() if hasattr(value, 'to_dict') else str(value)
+
+
+class Recorder:
+    # Журнал для воспроизведения (replay_log.py): строка JSON на событие, файл только дописывается.
+    #   ["h", {version, seed, time, bot}] — начало сессии
+    #   ["u", время, апдейт] — входящий апдейт
+    #   ["t", время, chat_id, thread_id, вид] — сработал игровой таймер
+    #   ["c", время, метод, параметры, результат, ошибка] — вызов Bot API и ответ Telegram
+    #   ["s", время, вид, chat_id, значение] — сохраненное состояние чата при первом чтении:
+    #     фильтр заданных вопросов ('seen') или настройки чата ('settings')
+    # Строки копятся в буфере файла, на диск он сбрасывается раз в SNAPSHOT_INTERVAL и при остановке.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self.events = 0
+
+    def _write(self, entry: List[Any]) -> None:
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=encode_record_value))
+        self._file.write('\n')
+        self.events += 1
+
+    def header(self, bot: Optional[User]) -> None:
+        self._write(['h', {'version': RECORD_VERSION, 'seed': RANDOM_SEED, 'time': clock.time(),
+                           'bot': bot.to_dict() if bot is not None else None}])
+
+    def update(self, update: Update) -> None:
+        self._write(['u', clock.time(), update.to_dict()])
+
+    def timer(self, key: GameKey, kind: str) -> None:
+        self._write(['t', clock.time(), key[0], key[1], kind])
+
+    def call(self, endpoint: str, data: Dict[str, Any], result: Any = None, error: Optional[str] = None) -> None:
+        self._write(['c', clock.time(), endpoint, data, result, error])
+
+    def state(self, kind: str, chat_id: int, value: Any) -> None:
+        self._write(['s', clock.time(), kind, chat_id, value])
+
+    async def run_flushes(self, interval: float = SNAPSHOT_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+recorder: Optional[Recorder] = None
+
+
+class TimerScheduler:
+    # Все игровые таймеры процесса: куча сроков и словарь записей по ключу (игра, вид).
+    # Отмена только помечает запись мертвой (O(1)), а мертвые записи выбрасываются
+    # из кучи при извлечении или при перестройке, когда их становится больше половины.
+    def __init__(self, source: Optional[Clock] = None) -> None:
+        self.clock = source or clock
+        self._heap: List[List] = []
+        self._entries: Dict[Tuple[GameKey, str], List] = {}
+        self._by_game: Dict[GameKey, Set[str]] = {}
+        self._seq = itertools.count()
+        self._dead = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap and self._heap[0][3] is None:
+            heapq.heappop(self._heap)
+            self._dead = max(0, self._dead - 1)
+        return self._heap[0][0] if self._heap else None
+
+    def schedule(self, key: GameKey, kind: str, delay: float,
+                 callback: Callable[..., Coroutine], *args: Any) -> None:
+        self.cancel(key, kind)
+        deadline = self.clock.monotonic() + delay
+        entry = [deadline, next(self._seq), (key, kind), callback, args]
+        self._entries[(key, kind)] = entry
+        self._by_game.setdefault(key, set()).add(kind)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, key: GameKey, kind: str) -> bool:
+        entry = self._entries.pop((key, kind), None)
+        if entry is None:
+            return False
+        self._kill(entry)
+        kinds = self._by_game[key]
+        kinds.discard(kind)
+        if not kinds:
+            del self._by_game[key]
+        return True
+
+    def cancel_game(self, key: GameKey) -> None:
+        for kind in self._by_game.pop(key, ()):
+            self._kill(self._entries.pop((key, kind)))
+
+    def _kill(self, entry: List) -> None:
+        entry[3] = None
+        self._dead += 1
+        if self._dead > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if e[3] is not None]
+            heapq.heapify(self._heap)
+            self._dead = 0
+
+    def start(self) -> None:
+        # Ручные часы двигает run_until, фоновый цикл им не нужен
+        if self._loop_task is None and not self.clock.manual:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+
+    def _pop_due(self, now: float) -> Optional[List]:
+        # Следующая живая запись со сроком не позже now
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if entry[3] is None:
+                self._dead = max(0, self._dead - 1)
+                continue
+            key, kind = entry[2]
+            del self._entries[entry[2]]
+            kinds = self._by_game[key]
+            kinds.discard(kind)
+            if not kinds:
+                del self._by_game[key]
+            return entry
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            now = self.clock.monotonic()
+            entry = self._pop_due(now)
+            while entry is not None:
+                task = asyncio.create_task(self._fire(entry[2], entry[3], entry[4]))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                entry = self._pop_due(now)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_until(self, moment: float) -> None:
+        # Для ручных часов: таймеры со сроком до moment срабатывают по порядку, часы
+        # перескакивают от срока к сроку, и каждый таймер отрабатывает до следующего
+        entry = self._pop_due(moment)
+        while entry is not None:
+            self.clock.set(entry[0])
+            await self._fire(entry[2], entry[3], entry[4])
+            entry = self._pop_due(moment)
+        self.clock.set(moment)
+
+    async def fire(self, key: GameKey, kind: str) -> bool:
+        # Сработать таймер прямо сейчас, не дожидаясь срока (повтор записанного журнала)
+        entry = self._entries.get((key, kind))
+        if entry is None:
+            return False
+        callback, args = entry[3], entry[4]
+        self.cancel(key, kind)
+        await self._fire((key, kind), callback, args)
+        return True
+
+    @staticmethod
+    async def _fire(key: Tuple[GameKey, str], callback: Callable[..., Coroutine], args: Tuple) -> None:
         try:
-            user = await context.bot.get_chat_member(chat_id, user_id)
-            user_name = await mention_user(user_id, user.user.full_name)
-        except BadRequest:
-            user_name = "Игрок"
-        if answer == correct_answer:
-            game['scores'][user_id] = game['scores'].get(user_id, 0) + 2
-            results.append(f"✅ {user_name} выбрал «{answer}» — правильно! +2 очка")
-        else:
-            results.append(f"❌ {user_name} выбрал «{answer}» — неверно. +0 очков")
+            await callback(*args)
+        except Exception:
+            logging.error(f'Ошибка в таймере {key}', exc_info=True)
 
-    if not game['answers']:
-        results.append("Никто не ответил на этот вопрос.")
+    async def drain(self, timeout: float = 10) -> None:
+        # Останавливает цикл и дожидается уже сработавших таймеров. Невзведенные сроки
+        # остаются в снимках игр и взводятся заново при следующем запуске.
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        if self._running:
+            await asyncio.wait(self._running, timeout=timeout)
 
-    await context.bot.send_message(chat_id, "\n".join(results), parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
 
-    game['current_round'] += 1
-    await asyncio.sleep(3)
-    await send_next_question(chat_id, context)
+timers = TimerScheduler()
 
 
-async def handle_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    if not data.startswith('quiz_answer:'):
-        return
-    parts = data.split(':', 2)
-    if len(parts) < 3:
-        return
-    _, chat_id_str, answer = parts
-    try:
-        chat_id = int(chat_id_str)
-    except ValueError:
+def arm_timer(key: GameKey, kind: str, delay: float, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Срок таймера сохраняется в игре, чтобы после перезапуска его можно было взвести заново
+    game = games.get(key)
+    if not game:
         return
+    game.timer_kind = kind
+    game.deadline = clock.time() + delay
+    games.touch(key)
+    timers.schedule(key, kind, delay, fire_game_timer, key, kind, context)
 
-    game = games.get(chat_id)
-    if not game or game['type'] != 'quiz':
-        await query.answer("Нет активной викторины в этом чате.", show_alert=True)
-        return
-    if game['current_round'] >= len(game['questions']):
-        await query.answer("Викторина уже завершена.", show_alert=True)
-        return
 
-    user_id = query.from_user.id
-    game['answers'][user_id] = answer
-    await query.answer(f"Ваш ответ «{answer}» принят.", show_alert=False)
+def finish_game(key: GameKey) -> None:
+    timers.cancel_game(key)
+    games.pop(key, None)
 
 
-async def show_final_scores(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    game = games.get(chat_id)
-    if not game or game['type'] != 'quiz':
-        return
-    if not game['scores']:
-        await context.bot.send_message(chat_id, "Игра завершена. Никто не набрал очков.")
-        return
+def message_thread(message: Any) -> int:
+    # Тема форума, в которой написано сообщение; ответы в обычных группах тоже несут
+    # message_thread_id, поэтому смотрим на is_topic_message
+    if message is not None and getattr(message, 'is_topic_message', False):
+        return message.message_thread_id or 0
+    return 0
 
-    sorted_scores = sorted(game['scores'].items(), key=lambda x: x[1], reverse=True)
-    result_lines = ["🏆 Итоги викторины:\n"]
-    places = ['🥇', '🥈', '🥉']
-    for i, (user_id, score) in enumerate(sorted_scores):
-        try:
-            user = await context.bot.get_chat_member(chat_id, user_id)
-            user_name = await mention_user(user_id, user.user.full_name)
-        except BadRequest:
-            user_name = "Игрок"
-        place_icon = places[i] if i < 3 else f"{i + 1}."
-        result_lines.append(f"{place_icon} {user_name}: {score} очков")
 
-    await context.bot.send_message(chat_id, "\n".join(result_lines), parse_mode="HTML",
-                                   reply_markup=ReplyKeyboardRemove())
+def update_key(update: Update) -> GameKey:
+    return update.effective_chat.id, message_thread(update.effective_message)
 
 
-async def crocodile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat = update.effective_chat
-    if chat.type not in ['group', 'supergroup']:
-        await update.message.reply_text("Эта команда доступна только в группах.")
-        return
+async def send_to_game(context: ContextTypes.DEFAULT_TYPE, key: GameKey, text: str, **kwargs: Any) -> Any:
+    # Сообщение в тему игры
+    chat_id, thread_id = key
+    return await context.bot.send_message(chat_id, text, message_thread_id=thread_id or None, **kwargs)
 
-    if chat.id in games:
-        await update.message.reply_text("В этом чате уже идет другая игра. Сначала завершите её (/stop).")
-        return
 
-    chat_admins = await context.bot.get_chat_administrators(chat.id)
-    bot_id = context.bot.id
-    candidates = [a.user for a in chat_admins if a.user.id != bot_id]
+async def mention_user(user_id: int, user_name: str) -> str:
+    return f'<a href="tg://user?id={user_id}">{html.escape(user_name)}</a>'
 
-    if not candidates:
-        await update.message.reply_text("Не удалось найти подходящего игрока для роли Крокодила.")
-        return
 
-    crocodile_player = random.choice(candidates)
-    words_for_choice = random.sample(CROC_WORDS, 3)
+def fit_message(lines: List[str], omitted: int = 0, limit: int = MESSAGE_LIMIT) -> str:
+    # Склеивает строки, пока сообщение помещается в лимит Telegram; строки, которые не вошли,
+    # и заранее отброшенные (omitted) сводятся в одну приписку в конце
+    tail_reserve = 40
+    kept: List[str] = []
+    size = 0
+    for line in lines:
+        if size + len(line) + 1 > limit - tail_reserve:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    omitted += len(lines) - len(kept)
+    if omitted:
+        kept.append(f"…и еще игроков: {omitted}")
+    return "\n".join(kept)
 
-    keyboard = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(w, callback_data=f'croc_word:{w}')] for w in words_for_choice])
 
-    try:
-        await context.bot.send_message(
-            crocodile_player.id,
-            "Вы — Крокодил! Выберите слово для объяснения из списка ниже:",
-            reply_markup=keyboard
-        )
-    except BadRequest:
-        await update.message.reply_text(
-            "Не удалось отправить сообщение выбранному игроку в личку. Пусть он начнет диалог с ботом.")
-        return
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
-    games[chat.id] = {
-        'type': 'crocodile',
-        'chat_id': chat.id,
-        'crocodile_id': crocodile_player.id,
-        'word': None,
-        'stage': 'waiting_word',
-    }
 
-    try:
-        user_name = await mention_user(crocodile_player.id, crocodile_player.full_name)
-        await update.message.reply_text(f"Крокодил выбран: {user_name}. Ждем, пока он выберет слово.",
-                                        parse_mode="HTML")
-    except BadRequest:
-        await update.message.reply_text(f"Крокодил выбран: {crocodile_player.full_name}. Ждем, пока он выберет слово.")
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
 
 
-async def handle_crocodile_word_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    if not data.startswith('croc_word:'):
-        return
-    parts = data.split(':', 1)
-    if len(parts) < 2:
-        return
-    chosen_word = parts[1]
-    user_id = query.from_user.id
+class CounterChild:
+    __slots__ = ('value',)
 
-    for game in list(games.values()):
-        if game['type'] == 'crocodile' and game['crocodile_id'] == user_id and game['stage'] == 'waiting_word':
-            game['word'] = chosen_word
-            game['stage'] = 'explaining'
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class HistogramChild:
+    # counts[i] — наблюдения в i-й корзине (не накопительно), последняя корзина — +Inf
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
 
-            await query.edit_message_text(f"Вы выбрали слово: {chosen_word}. Теперь объясняйте его в группе!")
-            await context.bot.send_message(game['chat_id'], "Крокодил начал объяснение. У него есть 15 секунд!")
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
 
-            async def explanation_time_up():
-                await asyncio.sleep(15)
-                current_game = games.get(game['chat_id'])
-                if current_game and current_game['stage'] == 'explaining':
-                    await context.bot.send_message(game['chat_id'],
-                                                   "Время вышло! Попробуйте угадать слово, у вас есть 60 секунд.")
-                    current_game['stage'] = 'guessing'
-                    asyncio.create_task(guessing_time_up(game['chat_id'], context))
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
 
-            async def guessing_time_up(chat_id: int, ctx: ContextTypes.DEFAULT_TYPE):
-                await asyncio.sleep(60)
-                current_game = games.get(chat_id)
-                if current_game and current_game['stage'] == 'guessing':
-                    await ctx.bot.send_message(chat_id,
-                                               f"Время на угадывание вышло! Слово было: {current_game['word']}\nИгра завершена.")
-                    games.pop(chat_id, None)
+    def quantile(self, q: float) -> float:
+        # Верхняя граница корзины, в которую попадает квантиль (inf — за последней границей)
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
 
-            asyncio.create_task(explanation_time_up())
-            return
 
-    await query.edit_message_text("Ошибка: игра не найдена или слово уже выбрано.")
+class Metric:
+    # Семейство метрик с метками. Дочерние серии создаются один раз через labels()
+    # и дальше пишутся напрямую — в горячем пути нет поиска и аллокаций.
+    kind = 'untyped'
 
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.children: Dict[Tuple[str, ...], Any] = {}
 
-async def handle_crocodile_guess(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = update.message.text
-    chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
+    def labels(self, *values: str) -> Any:
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name}: ожидались метки {self.labelnames}, получено {values}')
+            child = self.children[values] = self._new_child()
+        return child
 
-    game = games.get(chat_id)
-    if not game or game['type'] != 'crocodile':
-        return
+    def _new_child(self) -> Any:
+        raise NotImplementedError
 
-    if game['stage'] in ['explaining', 'guessing']:
-        if user_id == game['crocodile_id'] and text.lower() == (game['word'] or '').lower():
-            await update.message.reply_text(
-                "❌ Крокодил подсказал слово! Игра завершена. Нарушение правила.\n"
-                "Для новой игры напишите /crocodile"
-            )
-            games.pop(chat_id, None)
-            return
-        elif text.lower() == (game['word'] or '').lower():
-            try:
-                user_name = await mention_user(user_id, update.effective_user.full_name)
-                await update.message.reply_text(
-                    f"✅ {user_name} угадал слово! Игра завершена.\n"
-                    "Для новой игры напишите /crocodile",
-                    parse_mode="HTML"
-                )
-            except BadRequest:
-                await update.message.reply_text(
-                    f"✅ {update.effective_user.full_name} угадал слово! Игра завершена.\n"
-                    "Для новой игры напишите /crocodile"
-                )
-            games.pop(chat_id, None)
-            return
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
 
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}', *self.samples()]
 
-async def cities_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat = update.effective_chat
-    if chat.type not in ['group', 'supergroup']:
-        await update.message.reply_text("Эта команда доступна только в группах.")
-        return
 
-    if chat.id in games:
-        await update.message.reply_text("В этом чате уже идет другая игра. Сначала завершите её (/stop).")
-        return
+class Counter(Metric):
+    kind = 'counter'
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Города", callback_data="cities_mode:cities")],
-        [InlineKeyboardButton("Страны", callback_data="cities_mode:countries")],
-    ])
-    await update.message.reply_text("Выберите режим игры:", reply_markup=keyboard)
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
 
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self.children.items()):
+            yield f'{self.name}{format_labels(self.labelnames, values)} {child.value:g}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
 
-async def handle_cities_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    if not data.startswith("cities_mode:"):
-        return
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
 
-    mode = data.split(":")[1]
-    chat_id = query.message.chat.id
-    word_pool = CITIES if mode == "cities" else COUNTRIES
-    first_word = random.choice(word_pool)
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
 
-    try:
-        await query.message.delete()
-    except BadRequest:
-        pass
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                yield f'{self.name}_bucket{format_labels(self.labelnames, values, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, values)} {child.sum:g}'
+            yield f'{self.name}_count{format_labels(self.labelnames, values)} {child.count}'
 
-    join_keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Присоединиться", callback_data="join_cities")]
-    ])
 
-    try:
-        user_name = await mention_user(query.from_user.id, query.from_user.full_name)
-    except BadRequest:
-        user_name = query.from_user.full_name
-
-    join_message = await context.bot.send_message(
-        chat_id,
-        f"🎮 Режим: {'Города' if mode == 'cities' else 'Страны'}\n"
-        f"⏳ На присоединение дается {JOIN_TIMEOUT} секунд\n\n"
-        f"Игроки:\n1. {user_name}",
-        parse_mode="HTML",
-        reply_markup=join_keyboard
-    )
+class CallbackMetric(Metric):
+    # Значения снимаются только при чтении метрик: счетчики, которые и так ведут
+    # другие объекты (игры, таймеры, очередь), не трогаются в горячем пути
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for values, value in self.collect():
+            yield f'{self.name}{format_labels(self.labelnames, values)} {value:g}'
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Any:
+        # Повторная регистрация с тем же именем заменяет метрику (например, при новом Application)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.error(f'Не удалось собрать метрику {metric.name}', exc_info=True)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+HANDLER_LATENCY = metrics.register(Histogram(
+    'skillbit_handler_seconds', 'Время обработки апдейта по команде или префиксу callback_data', ('kind', 'name')))
+HANDLER_ERRORS = metrics.register(Counter('skillbit_handler_errors_total', 'Необработанные ошибки в обработчиках'))
+API_LATENCY = metrics.register(Histogram(
+    'skillbit_bot_api_seconds', 'Время вызова Bot API без ожидания в очереди', ('method',)))
+API_ERRORS = metrics.register(Counter(
+    'skillbit_bot_api_errors_total', 'Ошибки вызовов Bot API', ('method', 'error')))
+HANDLER_ERRORS_TOTAL = HANDLER_ERRORS.labels()
+BOT_MOVE_LATENCY = metrics.register(Histogram(
+    'skillbit_cities_bot_move_seconds', 'Время выбора хода ботом в городах',
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))).labels()
+
+
+def timed(child: HistogramChild, handler: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        started = time.perf_counter()
+        try:
+            await handler(update, context)
+        finally:
+            child.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def command_handler(command: str, handler: Callable[..., Coroutine]) -> CommandHandler:
+    return CommandHandler(command, timed(HANDLER_LATENCY.labels('command', command), handler))
+
+
+class SlidingWindow:
+    # Не больше limit отправок за любые span секунд — так же считает сам Telegram.
+    # Выданное разрешение занимает место в окне сразу, а время отправки отмечается,
+    # когда запрос действительно уходит: под нагрузкой между ними проходят миллисекунды.
+    __slots__ = ('limit', 'span', 'sent', 'reserved', 'blocked_until')
+
+    def __init__(self, limit: int, span: float) -> None:
+        self.limit = limit
+        self.span = span
+        self.sent: Deque[float] = deque()
+        self.reserved = 0
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        # Сколько секунд ждать до следующей отправки (0 — можно сейчас)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        sent = self.sent
+        while sent and sent[0] <= now - self.span:
+            sent.popleft()
+        if len(sent) + self.reserved < self.limit:
+            return 0.0
+        if not sent:
+            # Окно занято выданными разрешениями: место освободится не раньше чем через span
+            return self.span
+        return max(sent[0] + self.span - now, 1e-6)
+
+    def take(self) -> None:
+        self.reserved += 1
+
+    def stamp(self, now: float) -> None:
+        self.reserved -= 1
+        self.sent.append(now)
+
+    def block(self, now: float, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        return (not self.reserved and now >= self.blocked_until
+                and (not self.sent or self.sent[-1] <= now - self.span))
+
+
+class OutboundRequest:
+    __slots__ = ('endpoint', 'chat_id', 'priority', 'coalesce_key', 'call', 'followers', 'granted', 'seq')
+
+    def __init__(self, endpoint: str, chat_id: Any, priority: int, coalesce_key: Optional[Tuple], call: Tuple) -> None:
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.call = call
+        self.followers: List[asyncio.Future] = []
+        self.granted: Optional[asyncio.Future] = None
+        self.seq = 0
+
+
+class OutboundLimiter(BaseRateLimiter[Dict[str, Any]]):
+    # Очередь исходящих сообщений: общий лимит бота, лимит на чат и приоритетные полосы.
+    # Ожидающие правки одного и того же сообщения схлопываются в последнюю.
+    # У каждого чата свои полосы; в куче _ready лежат головы чатов, которым можно
+    # отправлять, а чаты, упершиеся в свой лимит, ждут в куче _parked до срока.
+    # Устаревшие записи куч отбрасываются при извлечении, так что выдача — O(log n).
+    def __init__(self, global_rate: float = GLOBAL_RATE) -> None:
+        # Воркер получает долю общего лимита; округление вниз, чтобы в сумме не превысить его
+        self._global = SlidingWindow(max(1, int(global_rate)), 1 + RATE_WINDOW_MARGIN)
+        self._windows: Dict[Any, SlidingWindow] = {}
+        self._queues: Dict[Any, Tuple[Deque[OutboundRequest], ...]] = {}
+        self._ready: List[Tuple[int, int, Any]] = []
+        self._parked: List[Tuple[float, int, Any]] = []
+        self._parked_chats: Set[Any] = set()
+        self._seq = itertools.count(1)
+        self._depth = 0
+        self._coalescing: Dict[Tuple, OutboundRequest] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._latency: Dict[str, HistogramChild] = {}
+        self.coalesced = 0
+        self.retries = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    async def initialize(self) -> None:
+        if self._pump_task is None:
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self) -> None:
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+
+    def _window(self, chat_id: Any) -> SlidingWindow:
+        window = self._windows.get(chat_id)
+        if window is None:
+            if len(self._windows) > CHAT_WINDOWS_LIMIT:
+                now = time.monotonic()
+                self._windows = {key: w for key, w in self._windows.items() if not w.is_idle(now)}
+            if isinstance(chat_id, int) and chat_id < 0:
+                window = SlidingWindow(GROUP_RATE, 60 + RATE_WINDOW_MARGIN)
+            else:
+                window = SlidingWindow(PRIVATE_RATE, 1 + RATE_WINDOW_MARGIN)
+            self._windows[chat_id] = window
+        return window
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if recorder is None:
+            return await self._process(callback, args, kwargs, endpoint, data, rate_limit_args)
+        try:
+            result = await self._process(callback, args, kwargs, endpoint, data, rate_limit_args)
+        except TelegramError as e:
+            recorder.call(endpoint, data, error=e.message)
+            raise
+        recorder.call(endpoint, data, result)
+        return result
+
+    async def _process(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if endpoint not in LIMITED_ENDPOINTS:
+            return await self._call(endpoint, callback, args, kwargs)
+
+        options = rate_limit_args or {}
+        chat_id = data.get('chat_id')
+        key = None
+        if options.get('coalesce') and endpoint.startswith('edit'):
+            key = (endpoint, chat_id, data.get('message_id'), data.get('inline_message_id'))
+            pending = self._coalescing.get(key)
+            if pending is not None:
+                pending.call = (callback, args, kwargs)
+                follower = asyncio.get_running_loop().create_future()
+                pending.followers.append(follower)
+                self.coalesced += 1
+                return await follower
+
+        request = OutboundRequest(endpoint, chat_id, options.get('priority', PRIORITY_NORMAL), key, (callback, args, kwargs))
+        if key is not None:
+            self._coalescing[key] = request
+        try:
+            result = await self._send(request)
+        except asyncio.CancelledError:
+            for follower in request.followers:
+                follower.cancel()
+            raise
+        except Exception as e:
+            for follower in request.followers:
+                if not follower.done():
+                    follower.set_exception(e)
+            raise
+        finally:
+            if key is not None and self._coalescing.get(key) is request:
+                del self._coalescing[key]
+        for follower in request.followers:
+            if not follower.done():
+                follower.set_result(result)
+        return result
+
+    async def _send(self, request: OutboundRequest) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        # Правка остается под своим ключом схлопывания, пока не дойдет: более новая правка того же
+        # сообщения подменяет request.call, а не встает отдельным запросом. Поэтому после повтора
+        # из-за flood control старый текст не может прийти позже нового.
+        attempt = 0
+        while True:
+            await self._acquire(request)
+            self._stamp(request)
+            call = request.call
+            callback, args, kwargs = call
+            try:
+                result = await self._call(request.endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_SEND_RETRIES:
+                    raise
+                attempt += 1
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                now = time.monotonic()
+                self._window(request.chat_id).block(now, retry_after)
+                if request.chat_id is None:
+                    self._global.block(now, retry_after)
+                self.retries += 1
+                logging.warning(f'Flood control в чате {request.chat_id}: пауза {retry_after} с')
+                continue
+            # Пока запрос был в пути, пришла правка новее — отправляем и ее
+            if request.call is call:
+                return result
+
+    async def _call(self, endpoint: str, callback: Callable[..., Coroutine], args: Any, kwargs: Dict[str, Any]) -> Any:
+        latency = self._latency.get(endpoint)
+        if latency is None:
+            latency = self._latency[endpoint] = API_LATENCY.labels(endpoint)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception as e:
+            API_ERRORS.labels(endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+    async def _acquire(self, request: OutboundRequest) -> None:
+        request.granted = asyncio.get_running_loop().create_future()
+        request.seq = next(self._seq)
+        lanes = self._queues.get(request.chat_id)
+        if lanes is None:
+            lanes = self._queues[request.chat_id] = (deque(), deque(), deque())
+        lanes[request.priority].append(request)
+        self._depth += 1
+        if request.chat_id not in self._parked_chats and self._head(lanes) is request:
+            heapq.heappush(self._ready, (request.priority, request.seq, request.chat_id))
+        self._wakeup.set()
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            if request.granted.done() and not request.granted.cancelled():
+                self._stamp(request)
+            else:
+                self._drop(request)
+            raise
+
+    def _drop(self, request: OutboundRequest) -> None:
+        lanes = self._queues[request.chat_id]
+        was_head = self._head(lanes) is request
+        lanes[request.priority].remove(request)
+        self._depth -= 1
+        if self._head(lanes) is None:
+            del self._queues[request.chat_id]
+        elif was_head and request.chat_id not in self._parked_chats:
+            self._push_ready(request.chat_id)
+
+    @staticmethod
+    def _head(lanes: Tuple[Deque[OutboundRequest], ...]) -> Optional[OutboundRequest]:
+        for lane in lanes:
+            if lane:
+                return lane[0]
+        return None
+
+    def _push_ready(self, chat_id: Any) -> None:
+        lanes = self._queues.get(chat_id)
+        head = self._head(lanes) if lanes is not None else None
+        if head is not None:
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _stamp(self, request: OutboundRequest) -> None:
+        now = time.monotonic()
+        self._global.stamp(now)
+        self._window(request.chat_id).stamp(now)
+        self._wakeup.set()
+
+    async def _pump(self) -> None:
+        while True:
+            delay = self._grant(time.monotonic())
+            if delay == 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if delay == float('inf') else delay)
+            except asyncio.TimeoutError:
+                pass
 
-    games[chat_id] = {
-        "type": "cities",
-        "mode": mode,
-        "players": [query.from_user.id],
-        "used_words": [first_word],
-        "current_player": 0,
-        "word_pool": word_pool,
-        "join_message_id": join_message.message_id,
-        "timer": None,
-        "game_started": False,
-        "active_timer": None
-    }
-
-    games[chat_id]['timer'] = asyncio.create_task(cities_join_timer(chat_id, context))
-
-
-async def cities_join_timer(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await asyncio.sleep(JOIN_TIMEOUT)
-    game = games.get(chat_id)
-    if not game or game["type"] != "cities" or game["game_started"]:
-        return
+    def _grant(self, now: float) -> float:
+        # Выдает разрешение самому приоритетному и раннему запросу среди чатов, которым можно отправлять.
+        # Возвращает 0, если разрешение выдано, иначе время до ближайшей возможности.
+        if not self._depth:
+            return float('inf')
+        while self._parked and self._parked[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._parked)
+            self._parked_chats.discard(chat_id)
+            self._push_ready(chat_id)
+        wait = self._global.delay(now)
+        if wait:
+            return wait
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            lanes = self._queues.get(chat_id)
+            if lanes is None or chat_id in self._parked_chats:
+                continue
+            request = self._head(lanes)
+            if request is None or request.seq != seq:
+                continue
+            window = self._window(chat_id)
+            wait = window.delay(now)
+            if wait:
+                self._parked_chats.add(chat_id)
+                heapq.heappush(self._parked, (now + wait, seq, chat_id))
+                continue
+            lanes[priority].popleft()
+            self._depth -= 1
+            if self._head(lanes) is None:
+                del self._queues[chat_id]
+            else:
+                self._push_ready(chat_id)
+            self._global.take()
+            window.take()
+            if not request.granted.done():
+                request.granted.set_result(None)
+            return 0.0
+        return self._parked[0][0] - now if self._parked else float('inf')
+
+
+class NameCache:
+    # Кэш отображаемых имен (chat_id, user_id) -> имя с TTL и вытеснением по LRU.
+    # Пополняется из каждого входящего апдейта, поэтому get_chat_member
+    # вызывается только для игроков, которых бот давно не видел.
+    def __init__(self, ttl: float = NAME_CACHE_TTL, maxsize: int = NAME_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Tuple[int, int], Tuple[str, float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, chat_id: int, user_id: int, name: str) -> None:
+        key = (chat_id, user_id)
+        self._entries[key] = (name, clock.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def remember(self, chat_id: int, user: Optional[User]) -> None:
+        if user is not None:
+            self.put(chat_id, user.id, user.full_name)
+
+    def peek(self, chat_id: int, user_id: int) -> Optional[str]:
+        # Последнее известное имя, даже устаревшее: для подписи в статистике его хватает
+        entry = self._entries.get((chat_id, user_id))
+        return entry[0] if entry is not None else None
+
+    def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        key = (chat_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < clock.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def fetch(self, bot: Bot, chat_id: int, user_id: int) -> Optional[str]:
+        name = self.get(chat_id, user_id)
+        if name is None:
+            try:
+                member = await bot.get_chat_member(chat_id, user_id)
+            except BadRequest:
+                return None
+            name = member.user.full_name
+            self.put(chat_id, user_id, name)
+        return name
 
-    game["game_started"] = True
 
-    try:
-        await context.bot.delete_message(chat_id, game["join_message_id"])
-    except BadRequest:
-        pass
+name_cache = NameCache()
 
-    await start_cities_game(chat_id, context)
 
+async def player_mention(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> str:
+    name = await name_cache.fetch(context.bot, chat_id, user_id)
+    if name is None:
+        return "Игрок"
+    return await mention_user(user_id, name)
 
-async def start_cities_game(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    game = games.get(chat_id)
-    if not game:
-        return
 
-    first_word = game["used_words"][0]
-    last_letter = find_available_letter(
-        game["used_words"],
-        game["word_pool"],
-        first_word
-    )
+async def player_mentions(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                          user_ids: Iterable[int]) -> Dict[int, str]:
+    # Имена из кэша сразу, недостающие запрашиваются параллельно, но не больше
+    # NAME_FETCH_CONCURRENCY за раз — время не растет с числом игроков
+    slots = asyncio.Semaphore(NAME_FETCH_CONCURRENCY)
 
-    current_player_id = game["players"][game["current_player"]]
+    async def fetch(user_id: int) -> Tuple[int, str]:
+        async with slots:
+            return user_id, await player_mention(context, chat_id, user_id)
 
-    try:
-        player = await context.bot.get_chat_member(chat_id, current_player_id)
-        player_name = await mention_user(current_player_id, player.user.full_name)
-    except BadRequest:
-        player_name = "Игрок"
-
-    await context.bot.send_message(
-        chat_id,
-        f"🎮 Игра начинается!\n"
-        f"Первое слово: *{first_word}*\n"
-        f"Следующее слово на букву *{last_letter.upper()}*\n\n"
-        f"Первый ход: {player_name}\n"
-        f"⏳ У вас есть {CITIES_ANSWER_TIMEOUT} секунд!",
-        parse_mode="HTML"
-    )
+    return dict(await asyncio.gather(*(fetch(user_id) for user_id in user_ids)))
 
-    game["active_timer"] = asyncio.create_task(cities_turn_timer(chat_id, context))
 
+async def record_update(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    if recorder is not None:
+        recorder.update(update)
 
-async def cities_turn_timer(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await asyncio.sleep(CITIES_ANSWER_TIMEOUT)
-    game = games.get(chat_id)
-    if not game or game["type"] != "cities" or not game["game_started"]:
-        return
 
-    current_player_id = game["players"][game["current_player"]]
-    try:
-        player = await context.bot.get_chat_member(chat_id, current_player_id)
-        player_name = await mention_user(current_player_id, player.user.full_name)
-    except BadRequest:
-        player_name = "Игрок"
-
-    last_word = game["used_words"][-1]
-    next_letter = find_available_letter(
-        game["used_words"],
-        game["word_pool"],
-        last_word
-    )
+async def remember_user(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat and update.effective_user:
+        name_cache.remember(update.effective_chat.id, update.effective_user)
 
-    next_word = find_next_word(
-        next_letter,
-        game["used_words"],
-        game["word_pool"]
-    )
 
-    if not next_word:
-        await context.bot.send_message(
-            chat_id,
-            f"🏁 Игра окончена! Больше нет подходящих слов.\n"
-            f"Всего названо: {len(game['used_words'])} слов.",
-            parse_mode="HTML"
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat.type == 'private':
+        await update.message.reply_text(
+            'Привет, я СкиллБит! Бот, который имеет коллекцию из логических и настольных игр.'
         )
-        games.pop(chat_id, None)
-        return
+        await update.message.reply_text(
+            "Я предназначен для работы в групповых чатах. Добавьте меня в свою беседу!",
+            reply_markup=main_menu_keyboard(context.bot.username)
+        )
+    else:
+        await update.message.reply_text('Привет! Используйте команды, чтобы начать игру.')
 
-    game["current_player"] = (game["current_player"] + 1) % len(game["players"])
-    next_player_id = game["players"][game["current_player"]]
 
-    try:
-        next_player = await context.bot.get_chat_member(chat_id, next_player_id)
-        next_player_name = await mention_user(next_player_id, next_player.user.full_name)
-    except BadRequest:
-        next_player_name = "Игрок"
-
-    await context.bot.send_message(
-        chat_id,
-        f"⏰ Время вышло! {player_name} не успел.\n"
-        f"Следующий игрок: {next_player_name}. Буква: *{next_letter.upper()}*\n"
-        f"⏳ У вас есть {CITIES_ANSWER_TIMEOUT} секунд!",
-        parse_mode="HTML"
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(
+        "Выберите действие:",
+        reply_markup=main_menu_keyboard(context.bot.username)
     )
 
-    game["active_timer"] = asyncio.create_task(cities_turn_timer(chat_id, context))
 
+async def stop_game(key: GameKey, context: ContextTypes.DEFAULT_TYPE) -> None:
+    game = games.get(key)
+    if game is not None:
+        await game.on_stop(context)
+    finish_game(key)
 
-async def handle_join_cities(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
 
-    chat_id = query.message.chat.id
-    user_id = query.from_user.id
-    game = games.get(chat_id)
+async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
 
-    if not game or game["type"] != "cities" or game["game_started"]:
-        await query.answer("Игра не найдена или уже началась.", show_alert=True)
-        return
+    if update.effective_chat.type != 'private':
+        try:
+            admins = [a.user.id for a in await context.bot.get_chat_administrators(chat_id)]
+        except BadRequest:
+            admins = []
+
+        if user_id not in admins:
+            return await update.message.reply_text('Только админ может сбросить игры.')
+
+    # /stop — игра в этой теме, /stop все — все игры чата
+    if context.args and context.args[0].casefold() in ('все', 'all'):
+        keys = games.in_chat(chat_id)
+    else:
+        key = update_key(update)
+        keys = [key] if key in games else []
+
+    if not keys:
+        return await update.message.reply_text('Нет активной игры для остановки.')
+    for key in keys:
+        await stop_game(key, context)
+    await update.message.reply_text('Игра остановлена.' if len(keys) == 1 else f'Остановлено игр: {len(keys)}.')
+
+
+STATS_PERIOD_TITLES = {'all': 'за все время', 'month': 'за месяц', 'week': 'за неделю'}
+
+
+def parse_stats_args(args: List[str], chat_id: int) -> Tuple[int, str, str]:
+    # /top [викторина|города|крокодил] [неделя|месяц] [везде] — в любом порядке
+    scope, period, game = chat_id, 'all', ALL_GAMES
+    for arg in args:
+        word = arg.casefold()
+        if word in ('неделя', 'week'):
+            period = 'week'
+        elif word in ('месяц', 'month'):
+            period = 'month'
+        elif word in ('везде', 'global'):
+            scope = GLOBAL_CHAT
+        else:
+            game = next((key for key, name in STATS_GAME_NAMES.items() if word in (key, name.casefold())), game)
+    return scope, period, game
 
-    if user_id in game["players"]:
-        await query.answer("Вы уже в игре!", show_alert=True)
-        return
 
-    game["players"].append(user_id)
+def stats_period_key(period: str) -> str:
+    all_time, month, week = stats_periods(clock.time())
+    return {'all': all_time, 'month': month, 'week': week}[period]
 
-    players_list = []
-    for i, player_id in enumerate(game["players"]):
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    scope, period, game = parse_stats_args(context.args or [], chat_id)
+    if update.effective_chat.type == 'private':
+        # В личке игр нет, показываем общий рейтинг
+        scope = GLOBAL_CHAT
+    rows = await stats.top(scope, stats_period_key(period), game)
+    if not rows:
+        return await update.message.reply_text('Пока никто не играл.')
+    # Имена берутся из статистики; у чата спрашиваются только те, что еще не сохранены,
+    # и только для топа этого чата — игроки других чатов в нем не состоят
+    names = {user_id: await mention_user(user_id, name) for user_id, *_, name in rows if name is not None}
+    missing = [row[0] for row in rows if row[0] not in names]
+    if missing and scope != GLOBAL_CHAT:
+        names.update(await player_mentions(context, chat_id, missing))
+    title = 'всех чатов' if scope == GLOBAL_CHAT else 'чата'
+    lines = [f"🏆 Топ {title}: {STATS_GAME_NAMES.get(game, 'все игры')}, {STATS_PERIOD_TITLES[period]}"]
+    for place, (user_id, points, wins, played, _) in enumerate(rows, 1):
+        lines.append(f"{place}. {names.get(user_id, 'Игрок')} — {points} {plural(points, 'очко', 'очка', 'очков')}, "
+                     f"побед: {wins}, игр: {played}")
+    await update.message.reply_text(fit_message(lines), parse_mode="HTML")
+
+
+async def me_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat = update.effective_chat
+    user_id = update.effective_user.id
+    _scope, period, _game = parse_stats_args(context.args or [], chat.id)
+    sections = [(GLOBAL_CHAT, 'Во всех чатах')]
+    if chat.type != 'private':
+        sections.insert(0, (chat.id, 'В этом чате'))
+    lines = [f"📊 Ваша статистика {STATS_PERIOD_TITLES[period]}"]
+    for scope, title in sections:
+        totals = await stats.player(scope, stats_period_key(period), user_id)
+        if not totals:
+            continue
+        lines.append(f"\n{title}:")
+        for game in (ALL_GAMES, *STATS_GAME_NAMES):
+            if game not in totals:
+                continue
+            points, wins, played = totals[game]
+            name = STATS_GAME_NAMES.get(game, 'Все игры')
+            lines.append(f"{name}: {points} {plural(points, 'очко', 'очка', 'очков')}, "
+                         f"побед: {wins}, игр: {played}")
+    if len(lines) == 1:
+        return await update.message.reply_text('Вы еще не играли.')
+    await update.message.reply_text("\n".join(lines))
+
+
+async def timers_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /timers — сроки игр в чате, /timers <имя> <секунды|сброс> — изменить (только админы)
+    chat = update.effective_chat
+    if chat.type not in ['group', 'supergroup']:
+        return await update.message.reply_text("Эта команда доступна только в группах.")
+
+    args = context.args or []
+    if args:
+        user_id = update.effective_user.id
         try:
-            player = await context.bot.get_chat_member(chat_id, player_id)
-            players_list.append(f"{i + 1}. {await mention_user(player_id, player.user.full_name)}")
+            admins = [a.user.id for a in await context.bot.get_chat_administrators(chat.id)]
         except BadRequest:
-            players_list.append(f"{i + 1}. Игрок")
+            admins = []
+        if user_id not in admins and user_id not in ADMIN_IDS:
+            return await update.message.reply_text('Только админ может менять сроки игр.')
+
+        name = args[0].casefold()
+        if name not in TIMER_SETTINGS or len(args) != 2:
+            return await update.message.reply_text(
+                f"Использование: /timers <{'|'.join(TIMER_SETTINGS)}> <секунды|сброс>")
+        description, low, high = TIMER_SETTINGS[name]
+        value: Optional[float] = None
+        if args[1].casefold() not in ('сброс', 'default'):
+            try:
+                value = float(args[1].replace(',', '.'))
+            except ValueError:
+                value = math.nan
+            if not low <= value <= high:
+                return await update.message.reply_text(
+                    f"{description.capitalize()}: от {low} до {high} секунд.")
+        if not await chat_settings.set_timing(chat.id, name, value):
+            return await update.message.reply_text('Не удалось сохранить настройку, попробуйте позже.')
+
+    timings, defaults = chat_settings.timings(chat.id), default_timings()
+    lines = ["⏱ Сроки игр в этом чате:"]
+    for name, (description, _, _) in TIMER_SETTINGS.items():
+        changed = '' if timings[name] == defaults[name] else ' (изменено)'
+        lines.append(f"{name} — {description}: {timings[name]:g} с{changed}")
+    lines.append("\nИзменить: /timers <имя> <секунды>, вернуть: /timers <имя> сброс. "
+                 "Новые сроки действуют со следующей игры.")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def check_game_slot(update: Update, key: GameKey) -> bool:
+    # Можно ли начать игру: в теме не больше одной игры, в чате — не больше MAX_GAMES_PER_CHAT
+    if key in games:
+        await update.message.reply_text("Здесь уже идет другая игра. Сначала завершите её (/stop).")
+        return False
+    if games.count_in_chat(key[0]) >= MAX_GAMES_PER_CHAT:
+        await update.message.reply_text(
+            f"В чате уже идет {MAX_GAMES_PER_CHAT} {plural(MAX_GAMES_PER_CHAT, 'игра', 'игры', 'игр')} — "
+            "дождитесь окончания одной из них.")
+        return False
+    return True
+
+
+class Game:
+    # Игра в теме чата. Состояние лежит в __slots__ подклассов, а не в словаре: так меньше
+    # памяти на игру и опечатка в имени поля падает сразу. Стадии меняются только через
+    # transition() по таблице stages. Роутеры команд, кнопок, сообщений и таймеров знают
+    # лишь реестр GAME_TYPES и хуки ниже, поэтому новая игра подключается одним классом.
+    # Сроки (timings) берутся из настроек чата при создании игры и не меняются до ее конца.
+    __slots__ = ('key', 'stage', 'timer_kind', 'deadline', 'timings')
+    name = ''  # ключ в реестре и в снимках
+    command = ''  # команда, которой начинается игра
+    initial_stage = ''
+    stages: Dict[str, Tuple[str, ...]] = {}  # стадия -> в какие можно перейти
+    transient: Tuple[str, ...] = ()  # поля, которые живут только в памяти и не сохраняются
+    timeouts: Dict[str, str] = {}  # вид таймера -> метод
+    # Префикс callback_data -> (метод, типы аргументов после ключа игры)
+    callbacks: Dict[str, Tuple[str, Tuple[type, ...]]] = {}
+    # Кнопки до начала игры: префикс -> (метод класса, типы аргументов)
+    setup_callbacks: Dict[str, Tuple[str, Tuple[type, ...]]] = {}
+    missing_text = "Игра не найдена."
+    fields: Tuple[str, ...] = ()
+
+    def __init__(self, key: GameKey) -> None:
+        self.key = key
+        self.stage = self.initial_stage
+        self.timer_kind: Optional[str] = None
+        self.deadline = 0.0
+        self.timings = chat_settings.timings(key[0])
+
+    def transition(self, stage: str) -> None:
+        if stage not in self.stages.get(self.stage, ()):
+            raise ValueError(f'{self.name}: переход {self.stage} -> {stage} не предусмотрен')
+        self.stage = stage
+        games.touch(self.key)
+
+    @classmethod
+    async def on_command(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    async def on_missing(cls, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply') -> None:
+        await reply(cls.missing_text, show_alert=True)
+
+    async def on_start(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        pass
 
-    try:
-        await query.edit_message_text(
-            f"🎮 Режим: {'Города' if game['mode'] == 'cities' else 'Страны'}\n"
-            f"⏳ На присоединение дается {JOIN_TIMEOUT} секунд\n\n"
-            f"Игроки:\n" + "\n".join(players_list),
+    async def on_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        pass
+
+    async def on_timeout(self, kind: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await getattr(self, self.timeouts[kind])(context)
+
+    async def on_stop(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        pass
+
+    def dump(self) -> Dict[str, Any]:
+        state = {field: getattr(self, field) for field in self.fields if field not in self.transient}
+        del state['key']
+        state['type'] = self.name
+        return state
+
+    @classmethod
+    def load(cls, key: GameKey, state: Dict[str, Any]) -> 'Game':
+        game = cls.__new__(cls)
+        game.key = key
+        for field in cls.fields:
+            if field != 'key' and field not in cls.transient:
+                setattr(game, field, state[field])
+        game.restore()
+        return game
+
+    def restore(self) -> None:
+        # Пересобирает после загрузки снимка то, что JSON не сохраняет как есть
+        pass
+
+
+GAME_TYPES: Dict[str, type] = {}
+
+
+def register_game(game_type: type) -> type:
+    game_type.fields = tuple(field for klass in reversed(game_type.__mro__)
+                             for field in getattr(klass, '__slots__', ()))
+    GAME_TYPES[game_type.name] = game_type
+    return game_type
+
+
+async def start_game(game: Game, context: ContextTypes.DEFAULT_TYPE) -> None:
+    games[game.key] = game
+    await game.on_start(context)
+
+
+async def fire_game_timer(key: GameKey, kind: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if recorder is not None:
+        recorder.timer(key, kind)
+    game = games.get(key)
+    if game is not None:
+        await game.on_timeout(kind, context)
+
+
+def game_callback(game_type: type, method: str) -> Callable[..., Coroutine]:
+    # Кнопки игры несут ее ключ: игра находится одним поиском, откуда бы ни пришел клик
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply',
+                      chat_id: int, thread_id: int, *args: Any) -> None:
+        game = games.get((chat_id, thread_id))
+        if not isinstance(game, game_type):
+            await game_type.on_missing(update, context, reply)
+            return
+        await getattr(game, method)(update, context, reply, *args)
+    return handler
+
+
+class RoundAnswers:
+    # Ответы раунда в трех параллельных массивах фиксированной ширины: кто, какой вариант
+    # и через сколько миллисекунд после начала раунда. Засчитывается первый ответ игрока;
+    # номер его строки хранится в словаре, чтобы повторный ответ находился за O(1).
+    __slots__ = ('users', 'options', 'latency_ms', 'slots')
+
+    def __init__(self) -> None:
+        self.users = array('q')
+        self.options = array('B')
+        self.latency_ms = array('I')
+        self.slots: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def option_of(self, user_id: int) -> Optional[int]:
+        slot = self.slots.get(user_id)
+        return self.options[slot] if slot is not None else None
+
+    def add(self, user_id: int, option: int, latency_ms: int) -> bool:
+        if user_id in self.slots:
+            return False
+        self.slots[user_id] = len(self.users)
+        self.users.append(user_id)
+        self.options.append(option)
+        # После восстановления из снимка монотонные часы могут оказаться раньше начала раунда
+        self.latency_ms.append(max(0, latency_ms))
+        return True
+
+    def histogram(self, limit_ms: int, bins: int = LATENCY_HISTOGRAM_BINS) -> List[int]:
+        counts = [0] * bins
+        for latency in self.latency_ms:
+            counts[min(bins - 1, latency * bins // max(1, limit_ms))] += 1
+        return counts
+
+    def dump(self) -> Dict[str, List[int]]:
+        return {'users': self.users.tolist(), 'options': self.options.tolist(), 'latency_ms': self.latency_ms.tolist()}
+
+    @classmethod
+    def load(cls, state: Dict[str, List[int]]) -> 'RoundAnswers':
+        answers = cls()
+        answers.users.extend(state['users'])
+        answers.options.extend(state['options'])
+        answers.latency_ms.extend(state['latency_ms'])
+        answers.slots = {user_id: slot for slot, user_id in enumerate(answers.users)}
+        return answers
+
+
+def answer_points(latency_ms: int, answer_time: float) -> int:
+    if QUIZ_SCORING != 'speed':
+        return FIXED_POINTS
+    remaining = max(0.0, 1 - latency_ms / (answer_time * 1000))
+    return 1 + round((SPEED_MAX_POINTS - 1) * remaining)
+
+
+def render_latency_histogram(answers: RoundAnswers, answer_time: float) -> List[str]:
+    limit_ms = int(answer_time * 1000)
+    counts = answers.histogram(limit_ms)
+    peak = max(counts)
+    lines = ["⏱ Скорость ответов:"]
+    for i, count in enumerate(counts):
+        low, high = answer_time * i / len(counts), answer_time * (i + 1) / len(counts)
+        bar = '█' * round(10 * count / peak) if count else ''
+        lines.append(f"{low:g}–{high:g} с {bar} {count}")
+    return lines
+
+
+@register_game
+class QuizGame(Game):
+    # 'asking' — вопрос открыт и принимает ответы, 'reviewing' — итоги раунда и пауза перед следующим
+    __slots__ = ('questions', 'current_round', 'scores', 'answers', 'last_answered',
+                 'round_quorum', 'round_active_answers', 'round_clock', 'round_started_at')
+    name = 'quiz'
+    command = 'quiz'
+    initial_stage = 'created'
+    stages = {'created': ('asking',), 'asking': ('reviewing',), 'reviewing': ('asking',)}
+    transient = ('round_clock',)
+    timeouts = {'quiz_answer': 'close_round', 'quiz_quorum': 'close_round_early', 'quiz_next': 'next_question'}
+    callbacks = {CB_QUIZ_ANSWER: ('on_answer', (int, int))}
+    missing_text = "Нет активной викторины в этом чате."
+
+    def __init__(self, key: GameKey, questions: List[int]) -> None:
+        super().__init__(key)
+        # В игре хранятся только номера вопросов в банке, тексты раскодируются по раундам
+        self.questions = questions
+        self.current_round = 0
+        self.scores: Dict[int, int] = {}
+        self.answers = RoundAnswers()
+        self.last_answered: Dict[int, int] = {}
+        self.round_quorum = 0
+        self.round_active_answers = 0
+        self.round_clock = 0.0
+        self.round_started_at = 0.0
+
+    def restore(self) -> None:
+        # JSON превращает ключи-идентификаторы пользователей в строки
+        self.scores = {int(user_id): value for user_id, value in self.scores.items()}
+        self.last_answered = {int(user_id): value for user_id, value in self.last_answered.items()}
+        self.answers = RoundAnswers.load(self.answers)
+        # Монотонные часы не переживают перезапуск: переносим начало раунда со стенных часов
+        self.round_clock = clock.monotonic() - (clock.time() - self.round_started_at)
+
+    @classmethod
+    async def on_command(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+        if chat.type not in ['group', 'supergroup']:
+            await update.message.reply_text("Викторина доступна только в группах.")
+            return
+
+        key = update_key(update)
+        if not await check_game_slot(update, key):
+            return
+
+        bank = get_question_bank()
+        # Вопросы на языке бота, если они есть в банке, иначе на любом
+        language = QUIZ_LANGUAGE if QUIZ_LANGUAGE in bank.languages() else None
+        category = None
+        if context.args:
+            wanted = ' '.join(context.args).casefold()
+            category = next((c for c in bank.categories(language) if c.casefold() == wanted), None)
+            if category is None:
+                await update.message.reply_text(
+                    "Такой категории нет. Доступные: " + ", ".join(bank.categories(language)))
+                return
+
+        seen = await seen_questions.get(chat.id)
+        questions = bank.sample(ROUND_COUNT, category, language, exclude=lambda number: bank.key(number) in seen,
+                                rng=game_random(key, update.update_id))
+        if not questions:
+            await update.message.reply_text("В банке нет вопросов для викторины.")
+            return
+
+        await start_game(cls(key, questions), context)
+
+    async def on_start(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.next_question(context)
+
+    def current_question(self) -> Dict:
+        return get_question_bank().question(self.questions[self.current_round])
+
+    def is_active_player(self, user_id: int) -> bool:
+        return self.last_answered.get(user_id, -QUIZ_ACTIVE_ROUNDS - 1) >= self.current_round - QUIZ_ACTIVE_ROUNDS
+
+    def count_quorum(self) -> int:
+        # Сколько активных игроков должно ответить, чтобы закрыть раунд досрочно (0 — ждать до конца)
+        active = sum(1 for user_id in self.last_answered if self.is_active_player(user_id))
+        return math.ceil(active * QUIZ_QUORUM) if active else 0
+
+    async def next_question(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        key = self.key
+        if self.current_round >= len(self.questions):
+            await self.show_final_scores(context)
+            finish_game(key)
+            return
+
+        question_info = self.current_question()
+        keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(opt, callback_data=encode_callback(CB_QUIZ_ANSWER, *key, self.current_round, i))]
+             for i, opt in enumerate(question_info['options'])])
+
+        message_text = (f"Вопрос {self.current_round + 1} из {len(self.questions)}:\n\n"
+                        f"{question_info['question']}\n\nУ вас есть {self.timings['answer']:g} секунд на ответ!")
+
+        # Часы и таймер раунда запускаются до отправки: ответ может прийти раньше, чем send_message вернется
+        self.answers = RoundAnswers()
+        self.round_quorum = self.count_quorum()
+        self.round_active_answers = 0
+        self.round_clock = clock.monotonic()
+        self.round_started_at = clock.time()
+        self.transition('asking')
+        arm_timer(key, 'quiz_answer', self.timings['answer'], context)
+        await send_to_game(context, key, message_text, reply_markup=keyboard, rate_limit_args=RL_URGENT)
+        await seen_questions.mark(key[0], get_question_bank().key(self.questions[self.current_round]))
+
+    async def close_round_early(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.close_round(context, early=True)
+
+    async def close_round(self, context: ContextTypes.DEFAULT_TYPE, early: bool = False) -> None:
+        # early — раунд закрыт кворумом ответов, а не по истечении времени
+        if self.stage != 'asking':
+            return
+        self.transition('reviewing')
+
+        key = self.key
+        question = self.current_question()
+        options = question['options']
+        correct_option = options.index(question['answer'])
+        answers = self.answers
+
+        # Очки начисляются за один проход до любых запросов к Bot API
+        correct, wrong = [], []
+        for i, user_id in enumerate(answers.users):
+            if answers.options[i] == correct_option:
+                points = answer_points(answers.latency_ms[i], self.timings['answer'])
+                self.scores[user_id] = self.scores.get(user_id, 0) + points
+                correct.append((i, points))
+            else:
+                wrong.append((i, 0))
+        games.touch(key)
+
+        shown = (correct + wrong)[:RESULT_LINES_LIMIT]
+        names = await player_mentions(context, key[0], [answers.users[i] for i, _ in shown])
+        headline = "Ответы собраны, раунд закрыт досрочно!" if early else "Время истекло!"
+        results = [f"{headline} Правильный ответ: «{html.escape(question['answer'])}»",
+                   f"Ответили верно: {len(correct)} из {len(answers)}\n"]
+        if answers:
+            results += render_latency_histogram(answers, self.timings['answer']) + [""]
+        for i, points in shown:
+            name = names[answers.users[i]]
+            answer = html.escape(options[answers.options[i]])
+            seconds = answers.latency_ms[i] / 1000
+            if points:
+                results.append(f"✅ {name} выбрал «{answer}» за {seconds:.1f} с — правильно! +{points} {plural(points, 'очко', 'очка', 'очков')}")
+            else:
+                results.append(f"❌ {name} выбрал «{answer}» за {seconds:.1f} с — неверно. +0 очков")
+
+        if not answers:
+            results.append("Никто не ответил на этот вопрос.")
+
+        await send_to_game(context, key, fit_message(results, len(answers) - len(shown)),
+                           parse_mode="HTML", reply_markup=REMOVE_KEYBOARD, rate_limit_args=RL_URGENT)
+
+        self.current_round += 1
+        # После последнего раунда итоги игры идут сразу
+        arm_timer(key, 'quiz_next', self.timings['pause'] if self.current_round < len(self.questions) else 0, context)
+
+    async def on_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply',
+                        round_number: int, option: int) -> None:
+        if self.current_round >= len(self.questions):
+            await reply("Викторина уже завершена.", show_alert=True)
+            return
+        if round_number != self.current_round or self.stage != 'asking':
+            await reply("Этот вопрос уже закрыт.", show_alert=True)
+            return
+        latency_ms = max(0, int((clock.monotonic() - self.round_clock) * 1000))
+        if latency_ms > self.timings['answer'] * 1000:
+            await reply("Время на ответ вышло.", show_alert=True)
+            return
+        options = self.current_question()['options']
+        if not 0 <= option < len(options):
+            return
+
+        user_id = update.callback_query.from_user.id
+        if not self.answers.add(user_id, option, latency_ms):
+            await reply(f"Засчитан первый ответ: «{options[self.answers.option_of(user_id)]}».")
+            return
+        if self.is_active_player(user_id):
+            self.round_active_answers += 1
+        self.last_answered[user_id] = round_number
+        games.touch(self.key)
+        await reply(f"Ваш ответ «{options[option]}» принят за {latency_ms / 1000:.1f} с.")
+        if self.round_quorum and self.round_active_answers == self.round_quorum:
+            # Все нужные ответы есть: таймер раунда заменяется немедленным
+            arm_timer(self.key, 'quiz_quorum', 0, context)
+
+    async def show_final_scores(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        key = self.key
+        # Участник — любой, кто ответил хотя бы раз; побеждают все с лучшим результатом
+        best = max(self.scores.values(), default=0)
+        stats.record(key[0], self.name, {
+            user_id: (self.scores.get(user_id, 0), best > 0 and self.scores.get(user_id, 0) == best)
+            for user_id in set(self.last_answered) | set(self.scores)
+        })
+        if not self.scores:
+            await send_to_game(context, key, "Игра завершена. Никто не набрал очков.", rate_limit_args=RL_URGENT)
+            return
+
+        sorted_scores = sorted(self.scores.items(), key=lambda x: x[1], reverse=True)
+        top = sorted_scores[:RESULT_LINES_LIMIT]
+        names = await player_mentions(context, key[0], [user_id for user_id, _ in top])
+        result_lines = ["🏆 Итоги викторины:\n"]
+        places = ['🥇', '🥈', '🥉']
+        for i, (user_id, score) in enumerate(top):
+            place_icon = places[i] if i < 3 else f"{i + 1}."
+            result_lines.append(f"{place_icon} {names[user_id]}: {score} {plural(score, 'очко', 'очка', 'очков')}")
+
+        await send_to_game(context, key, fit_message(result_lines, len(sorted_scores) - len(top)),
+                           parse_mode="HTML", reply_markup=REMOVE_KEYBOARD, rate_limit_args=RL_URGENT)
+
+
+@register_game
+class CrocodileGame(Game):
+    __slots__ = ('crocodile_id', 'word')
+    name = 'crocodile'
+    command = 'crocodile'
+    initial_stage = 'waiting_word'
+    stages = {'waiting_word': ('explaining',), 'explaining': ('guessing',), 'guessing': ()}
+    timeouts = {'croc_explain': 'explanation_time_up', 'croc_guess': 'guessing_time_up'}
+    callbacks = {CB_CROC_WORD: ('on_word_choice', (int,))}
+
+    def __init__(self, key: GameKey, crocodile_id: int) -> None:
+        super().__init__(key)
+        self.crocodile_id = crocodile_id
+        self.word: Optional[str] = None
+
+    @classmethod
+    async def on_command(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+        if chat.type not in ['group', 'supergroup']:
+            await update.message.reply_text("Эта команда доступна только в группах.")
+            return
+
+        key = update_key(update)
+        if not await check_game_slot(update, key):
+            return
+
+        chat_admins = await context.bot.get_chat_administrators(chat.id)
+        for admin in chat_admins:
+            name_cache.remember(chat.id, admin.user)
+        bot_id = context.bot.id
+        candidates = [a.user for a in chat_admins if a.user.id != bot_id]
+
+        if not candidates:
+            await update.message.reply_text("Не удалось найти подходящего игрока для роли Крокодила.")
+            return
+
+        rng = game_random(key, update.update_id)
+        crocodile_player = rng.choice(candidates)
+        words_for_choice = rng.sample(CROC_WORDS, 3)
+
+        keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(w, callback_data=encode_callback(CB_CROC_WORD, *key, CROC_WORDS.index(w)))]
+             for w in words_for_choice])
+
+        try:
+            await context.bot.send_message(
+                crocodile_player.id,
+                "Вы — Крокодил! Выберите слово для объяснения из списка ниже:",
+                reply_markup=keyboard
+            )
+        except BadRequest:
+            await update.message.reply_text(
+                "Не удалось отправить сообщение выбранному игроку в личку. Пусть он начнет диалог с ботом.")
+            return
+
+        await start_game(cls(key, crocodile_player.id), context)
+
+        try:
+            user_name = await mention_user(crocodile_player.id, crocodile_player.full_name)
+            await update.message.reply_text(f"Крокодил выбран: {user_name}. Ждем, пока он выберет слово.",
+                                            parse_mode="HTML")
+        except BadRequest:
+            await update.message.reply_text(f"Крокодил выбран: {crocodile_player.full_name}. Ждем, пока он выберет слово.")
+
+    @classmethod
+    async def on_missing(cls, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply') -> None:
+        await reply()
+        await update.callback_query.edit_message_text("Ошибка: игра не найдена или слово уже выбрано.")
+
+    async def on_word_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply',
+                             word_index: int) -> None:
+        # Клик приходит из лички крокодила, поэтому игра ищется по ключу из данных кнопки
+        query = update.callback_query
+        await reply()
+        if not 0 <= word_index < len(CROC_WORDS):
+            return
+        if query.from_user.id != self.crocodile_id or self.stage != 'waiting_word':
+            await query.edit_message_text("Ошибка: игра не найдена или слово уже выбрано.")
+            return
+
+        chosen_word = CROC_WORDS[word_index]
+        self.word = chosen_word
+        self.transition('explaining')
+
+        await query.edit_message_text(f"Вы выбрали слово: {chosen_word}. Теперь объясняйте его в группе!")
+        await send_to_game(context, self.key, f"Крокодил начал объяснение. У него есть {self.timings['explain']:g} секунд!",
+                           rate_limit_args=RL_URGENT)
+        arm_timer(self.key, 'croc_explain', self.timings['explain'], context)
+
+    async def explanation_time_up(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage == 'explaining':
+            await send_to_game(context, self.key,
+                               f"Время вышло! Попробуйте угадать слово, у вас есть {self.timings['guess']:g} секунд.",
+                               rate_limit_args=RL_URGENT)
+            self.transition('guessing')
+            arm_timer(self.key, 'croc_guess', self.timings['guess'], context)
+
+    async def guessing_time_up(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage == 'guessing':
+            stats.record(self.key[0], self.name, {self.crocodile_id: (0, False)})
+            await send_to_game(context, self.key, f"Время на угадывание вышло! Слово было: {self.word}\nИгра завершена.",
+                               rate_limit_args=RL_URGENT)
+            finish_game(self.key)
+
+    async def on_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage not in ['explaining', 'guessing']:
+            return
+        text = update.message.text
+        user_id = update.effective_user.id
+        if text.lower() != (self.word or '').lower():
+            return
+
+        if user_id == self.crocodile_id:
+            stats.record(self.key[0], self.name, {user_id: (0, False)})
+            await update.message.reply_text(
+                "❌ Крокодил подсказал слово! Игра завершена. Нарушение правила.\n"
+                "Для новой игры напишите /crocodile"
+            )
+            finish_game(self.key)
+            return
+
+        # Угадавший побеждает, крокодил получает очко за удачное объяснение
+        stats.record(self.key[0], self.name, {user_id: (1, True), self.crocodile_id: (1, False)})
+        try:
+            user_name = await mention_user(user_id, update.effective_user.full_name)
+            await send_to_game(
+                context, self.key,
+                f"✅ {user_name} угадал слово! Игра завершена.\n"
+                "Для новой игры напишите /crocodile",
+                parse_mode="HTML",
+                rate_limit_args=RL_URGENT
+            )
+        except BadRequest:
+            await update.message.reply_text(
+                f"✅ {update.effective_user.full_name} угадал слово! Игра завершена.\n"
+                "Для новой игры напишите /crocodile"
+            )
+        finish_game(self.key)
+
+
+@register_game
+class CitiesGame(Game):
+    # 'joining' — идет набор игроков, 'playing' — игроки по очереди называют слова
+    __slots__ = ('mode', 'players', 'used_words', 'current_player', 'word_pool', 'join_message_id',
+                 'scores', 'last_player', 'bot_strategy')
+    name = 'cities'
+    command = 'cities'
+    initial_stage = 'joining'
+    stages = {'joining': ('playing',), 'playing': ()}
+    transient = ('word_pool',)
+    timeouts = {'cities_join': 'close_join', 'cities_turn': 'turn_timeout', 'cities_bot': 'bot_move'}
+    callbacks = {CB_JOIN_CITIES: ('on_join', ())}
+    setup_callbacks = {CB_CITIES_MODE: ('on_mode', (int, int))}
+    missing_text = "Игра не найдена или уже началась."
+
+    def __init__(self, key: GameKey, mode: str, host_id: int, first_word: str, join_message_id: int,
+                 bot_strategy: Optional[str]) -> None:
+        super().__init__(key)
+        self.mode = mode
+        self.players = [host_id]
+        self.used_words = [first_word]
+        self.current_player = 0
+        self.word_pool = get_word_pool(mode).new_game(self.used_words)
+        self.join_message_id = join_message_id
+        self.scores: Dict[int, int] = {}
+        self.last_player: Optional[int] = None
+        self.bot_strategy = bot_strategy
+
+    def restore(self) -> None:
+        self.scores = {int(user_id): value for user_id, value in self.scores.items()}
+        self.word_pool = get_word_pool(self.mode).new_game(self.used_words)
+
+    def letter_hint(self, letter: str) -> str:
+        left = self.word_pool.count(letter)
+        return f"(осталось {left} {plural(left, 'слово', 'слова', 'слов')})"
+
+    def join_text(self, players: List[str]) -> str:
+        return (f"🎮 Режим: {'Города' if self.mode == 'cities' else 'Страны'}\n"
+                f"⏳ На присоединение дается {self.timings['join']:g} секунд\n\n"
+                f"Игроки:\n" + "\n".join(f"{i}. {name}" for i, name in enumerate(players, 1)))
+
+    def join_keyboard(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("➕ Присоединиться", callback_data=encode_callback(CB_JOIN_CITIES, *self.key))]
+        ])
+
+    @classmethod
+    async def on_command(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+        if chat.type not in ['group', 'supergroup']:
+            await update.message.reply_text("Эта команда доступна только в группах.")
+            return
+
+        if not await check_game_slot(update, update_key(update)):
+            return
+
+        # Сложность бота-соперника: /cities легкий|средний|сложный (или имя стратегии)
+        strategy = CITIES_BOT
+        if context.args:
+            wanted = context.args[0].casefold()
+            strategy = next((key for key, name in BOT_STRATEGY_NAMES.items() if wanted in (key, name)), strategy)
+        strategy_index = BOT_STRATEGIES.index(strategy) if strategy in BOT_STRATEGIES else -1
+        await update.message.reply_text("Выберите режим игры:", reply_markup=CITIES_MODE_KEYBOARDS[strategy_index])
+
+    @classmethod
+    async def on_mode(cls, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply',
+                      mode_index: int, strategy_index: int) -> None:
+        query = update.callback_query
+        if not 0 <= mode_index < len(CITIES_MODES):
+            return
+        chat_id = query.message.chat.id
+        key = (chat_id, message_thread(query.message))
+        if key in games or games.count_in_chat(chat_id) >= MAX_GAMES_PER_CHAT:
+            await reply("Здесь уже идет другая игра или в чате слишком много игр.", show_alert=True)
+            return
+        await reply()
+
+        mode = CITIES_MODES[mode_index]
+        first_word = game_random(key, update.update_id).choice(get_word_pool(mode).words)
+        strategy = BOT_STRATEGIES[strategy_index] if 0 <= strategy_index < len(BOT_STRATEGIES) else None
+
+        try:
+            await context.bot.delete_message(chat_id, query.message.message_id, rate_limit_args=RL_COSMETIC)
+        except BadRequest:
+            pass
+
+        try:
+            user_name = await mention_user(query.from_user.id, query.from_user.full_name)
+        except BadRequest:
+            user_name = query.from_user.full_name
+
+        # Сообщение набора отправляется до создания игры: его id нужен, чтобы потом его удалить
+        game = cls(key, mode, query.from_user.id, first_word, 0, strategy)
+        join_message = await send_to_game(context, key, game.join_text([user_name]), parse_mode="HTML",
+                                          reply_markup=game.join_keyboard())
+        game.join_message_id = join_message.message_id
+        await start_game(game, context)
+
+    async def on_start(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        arm_timer(self.key, 'cities_join', self.timings['join'], context)
+
+    async def on_stop(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage == 'joining':
+            try:
+                await context.bot.delete_message(self.key[0], self.join_message_id, rate_limit_args=RL_COSMETIC)
+            except BadRequest:
+                pass
+
+    async def on_join(self, update: Update, context: ContextTypes.DEFAULT_TYPE, reply: 'CallbackReply') -> None:
+        query = update.callback_query
+        user_id = query.from_user.id
+
+        if self.stage != 'joining':
+            await reply(self.missing_text, show_alert=True)
+            return
+
+        if user_id in self.players:
+            await reply("Вы уже в игре!", show_alert=True)
+            return
+
+        self.players.append(user_id)
+        games.touch(self.key)
+        await reply(f"{query.from_user.full_name} присоединился к игре!")
+
+        names = await player_mentions(context, self.key[0], self.players)
+        players_list = [names[player_id] for player_id in self.players]
+
+        try:
+            await context.bot.edit_message_text(
+                self.join_text(players_list),
+                chat_id=self.key[0],
+                message_id=query.message.message_id,
+                parse_mode="HTML",
+                reply_markup=self.join_keyboard(),
+                rate_limit_args=RL_COSMETIC
+            )
+        except BadRequest:
+            pass
+
+    async def close_join(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage != 'joining':
+            return
+
+        self.transition('playing')
+        # В одиночной игре соперником становится бот
+        if len(self.players) == 1 and self.bot_strategy:
+            self.players.append(context.bot.id)
+
+        try:
+            await context.bot.delete_message(self.key[0], self.join_message_id, rate_limit_args=RL_COSMETIC)
+        except BadRequest:
+            pass
+
+        first_word = self.used_words[0]
+        last_letter = find_available_letter(self.word_pool, first_word)
+
+        current_player_id = self.players[self.current_player]
+
+        player_name = await player_mention(context, self.key[0], current_player_id)
+
+        await send_to_game(
+            context, self.key,
+            f"🎮 Игра начинается!\n"
+            f"Первое слово: *{first_word}*\n"
+            f"Следующее слово на букву *{last_letter.upper()}* {self.letter_hint(last_letter)}\n\n"
+            f"Первый ход: {player_name}\n"
+            + (f"🤖 Соперник — бот, сложность: {BOT_STRATEGY_NAMES[self.bot_strategy]}\n"
+               if context.bot.id in self.players else "")
+            + f"⏳ У вас есть {self.timings['turn']:g} секунд!",
             parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("➕ Присоединиться", callback_data="join_cities")]
-            ])
+            rate_limit_args=RL_URGENT
         )
-    except BadRequest:
-        pass
 
-    await query.answer(f"{query.from_user.full_name} присоединился к игре!")
+        self.arm_turn(context)
 
+    async def turn_timeout(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage != 'playing':
+            return
 
-async def handle_cities_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
-    game = games.get(chat_id)
+        current_player_id = self.players[self.current_player]
+        player_name = await player_mention(context, self.key[0], current_player_id)
 
-    if not game or game["type"] != "cities" or not game["game_started"]:
-        return
+        last_word = self.used_words[-1]
+        next_letter = find_available_letter(self.word_pool, last_word)
 
-    if user_id != game["players"][game["current_player"]]:
-        return
+        if self.word_pool.is_dead_end(next_letter):
+            await self.finish_dead_end(context)
+            return
 
-    word = update.message.text.strip().capitalize()
-    last_word = game["used_words"][-1]
+        self.current_player = (self.current_player + 1) % len(self.players)
+        next_player_id = self.players[self.current_player]
 
-    required_letter = find_available_letter(
-        game["used_words"],
-        game["word_pool"],
-        last_word
-    )
+        next_player_name = await player_mention(context, self.key[0], next_player_id)
 
-    if word[0].lower() != required_letter:
-        await update.message.reply_text(f"❌ Неверно! Слово должно начинаться на букву '{required_letter.upper()}'.")
-        return
+        await send_to_game(
+            context, self.key,
+            f"⏰ Время вышло! {player_name} не успел.\n"
+            f"Следующий игрок: {next_player_name}. Буква: *{next_letter.upper()}* {self.letter_hint(next_letter)}\n"
+            f"⏳ У вас есть {self.timings['turn']:g} секунд!",
+            parse_mode="HTML",
+            rate_limit_args=RL_URGENT
+        )
 
-    if word not in game["word_pool"]:
-        await update.message.reply_text("❌ Этого слова нет в списке!")
-        return
+        self.arm_turn(context)
 
-    if word in game["used_words"]:
-        await update.message.reply_text("❌ Это слово уже называли!")
-        return
+    async def on_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage != 'playing':
+            return
 
-    if game.get("active_timer"):
-        game["active_timer"].cancel()
+        if update.effective_user.id != self.players[self.current_player]:
+            return
 
-    game["used_words"].append(word)
+        text = update.message.text
+        if not normalize_word(text):
+            return
+        last_word = self.used_words[-1]
 
-    next_letter = find_available_letter(
-        game["used_words"],
-        game["word_pool"],
-        word
-    )
+        required_letter = find_available_letter(self.word_pool, last_word)
 
-    next_word = find_next_word(
-        next_letter,
-        game["used_words"],
-        game["word_pool"]
-    )
+        # Псевдоним засчитывается как название из списка; начинаются они на одну букву
+        word = self.word_pool.pool.lookup(text)
+        if first_letter(word or text) != required_letter:
+            await update.message.reply_text(f"❌ Неверно! Слово должно начинаться на букву '{required_letter.upper()}'.")
+            return
 
-    if not next_word:
-        await update.message.reply_text(
+        if word is None:
+            await update.message.reply_text("❌ Этого слова нет в списке!")
+            return
+
+        if self.word_pool.is_used(word):
+            await update.message.reply_text("❌ Это слово уже называли!")
+            return
+
+        timers.cancel(self.key, 'cities_turn')
+        await self.accept_word(word, context)
+
+    async def accept_word(self, word: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Ход принят (от игрока или бота): запоминаем слово и передаем ход дальше
+        self.used_words.append(word)
+        self.word_pool.use(word)
+        player_id = self.players[self.current_player]
+        self.scores[player_id] = self.scores.get(player_id, 0) + 1
+        self.last_player = player_id
+        games.touch(self.key)
+
+        next_letter = find_available_letter(self.word_pool, word)
+
+        if self.word_pool.is_dead_end(next_letter):
+            await self.finish_dead_end(context)
+            return
+
+        self.current_player = (self.current_player + 1) % len(self.players)
+        next_player_id = self.players[self.current_player]
+
+        next_player_name = await player_mention(context, self.key[0], next_player_id)
+
+        await send_to_game(
+            context, self.key,
+            f"✅ Принято: {word}\n"
+            f"Следующее слово на букву *{next_letter.upper()}* {self.letter_hint(next_letter)}\n"
+            f"Ход игрока: {next_player_name}\n"
+            f"⏳ У вас есть {self.timings['turn']:g} секунд!",
+            parse_mode="HTML",
+            rate_limit_args=RL_URGENT
+        )
+
+        self.arm_turn(context)
+
+    async def finish_dead_end(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Очко за каждое названное слово; побеждает тот, после чьего слова ходить стало некуда.
+        # Бот-соперник в статистику не попадает.
+        stats.record(self.key[0], self.name, {
+            user_id: (self.scores.get(user_id, 0), user_id == self.last_player)
+            for user_id in self.players if user_id != context.bot.id
+        })
+        await send_to_game(
+            context, self.key,
             f"🏁 Игра окончена! Больше нет подходящих слов.\n"
-            f"Всего названо: {len(game['used_words'])} слов.",
-            parse_mode="HTML"
+            f"Всего названо: {len(self.used_words)} слов.",
+            parse_mode="HTML",
+            rate_limit_args=RL_URGENT
         )
-        games.pop(chat_id, None)
-        return
+        finish_game(self.key)
 
-    game["current_player"] = (game["current_player"] + 1) % len(game["players"])
-    next_player_id = game["players"][game["current_player"]]
+    def arm_turn(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.players[self.current_player] == context.bot.id:
+            arm_timer(self.key, 'cities_bot', CITIES_BOT_DELAY, context)
+        else:
+            arm_timer(self.key, 'cities_turn', self.timings['turn'], context)
 
-    try:
-        next_player = await context.bot.get_chat_member(chat_id, next_player_id)
-        next_player_name = await mention_user(next_player_id, next_player.user.full_name)
-    except BadRequest:
-        next_player_name = "Игрок"
+    async def bot_move(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.stage != 'playing' or self.players[self.current_player] != context.bot.id:
+            return
 
-    await update.message.reply_text(
-        f"✅ Принято: {word}\n"
-        f"Следующее слово на букву *{next_letter.upper()}*\n"
-        f"Ход игрока: {next_player_name}\n"
-        f"⏳ У вас есть {CITIES_ANSWER_TIMEOUT} секунд!",
-        parse_mode="HTML"
-    )
+        state = self.word_pool
+        letter = find_available_letter(state, self.used_words[-1])
+        started = time.perf_counter()
+        word = BOT_MOVES[self.bot_strategy or "random"](state, letter, game_random(self.key, len(self.used_words)))
+        BOT_MOVE_LATENCY.observe(time.perf_counter() - started)
+        if word is None:
+            # Конец игры проверяется до передачи хода, так что сюда бот попадает только в сломанном состоянии
+            await self.turn_timeout(context)
+            return
+        await self.accept_word(word, context)
 
-    game["active_timer"] = asyncio.create_task(cities_turn_timer(chat_id, context))
 
+class CallbackReply:
+    # Ответ на callback query ровно один раз: обработчик отвечает, как только знает
+    # результат, а роутер закрывает запрос пустым ответом, если обработчик этого не сделал
+    __slots__ = ('query', 'answered')
 
-async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    bot_username = context.bot.username
-
-    if query.data == 'games_list':
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Викторина", callback_data="game_info:Викторина")],
-            [InlineKeyboardButton("Крокодил", callback_data="game_info:Крокодил")],
-            [InlineKeyboardButton("Города и страны", callback_data="game_info:Города и страны")],
-            [InlineKeyboardButton("◀ Назад", callback_data="main_menu")]
-        ])
-        await query.edit_message_text(
-            "Доступные мини-игры:",
-            reply_markup=keyboard
-        )
-        return
+    def __init__(self, query: CallbackQuery) -> None:
+        self.query = query
+        self.answered = False
 
-    if query.data == 'main_menu':
-        keyboard = InlineKeyboardMarkup([
+    async def __call__(self, text: Optional[str] = None, show_alert: bool = False) -> None:
+        if self.answered:
+            return
+        self.answered = True
+        await self.query.answer(text, show_alert=show_alert)
+
+
+def encode_callback(prefix: str, *args: Any) -> str:
+    data = ':'.join((prefix, *map(str, args)))
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f'callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data!r}')
+    return data
+
+
+def parse_callback(data: Optional[str]) -> Optional[Tuple[Callable[..., Coroutine], Tuple]]:
+    if not data:
+        return None
+    prefix, *parts = data.split(':')
+    route = CALLBACK_ROUTES.get(prefix)
+    if route is None or len(parts) != len(route[1]):
+        return None
+    handler, arg_types = route
+    try:
+        return handler, tuple(arg_type(part) for arg_type, part in zip(arg_types, parts))
+    except ValueError:
+        return None
+
+
+# Неизменяемые клавиатуры собираются один раз: объекты PTB после создания заморожены,
+# поэтому один экземпляр безопасно отдавать во все чаты
+GAMES_LIST_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(name, callback_data=encode_callback(CB_GAME_INFO, i))] for i, name in enumerate(GAME_NAMES)]
+    + [[InlineKeyboardButton("◀ Назад", callback_data=CB_MAIN_MENU)]]
+)
+GAME_INFO_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("◀ Назад", callback_data=CB_GAMES_LIST)]])
+EMPTY_KEYBOARD = InlineKeyboardMarkup([])
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+MENU_REPLY_KEYBOARD = ReplyKeyboardMarkup([['Мини-игры']], resize_keyboard=True, one_time_keyboard=True)
+GAMES_REPLY_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        ['Викторина', 'Крокодил'],
+        ['Города и страны', 'Назад'],
+    ], resize_keyboard=True, one_time_keyboard=True
+)
+# Выбор режима городов для каждой сложности бота (-1 — без бота)
+CITIES_MODE_KEYBOARDS = {
+    strategy_index: InlineKeyboardMarkup([
+        [InlineKeyboardButton("Города", callback_data=encode_callback(
+            CB_CITIES_MODE, CITIES_MODES.index("cities"), strategy_index))],
+        [InlineKeyboardButton("Страны", callback_data=encode_callback(
+            CB_CITIES_MODE, CITIES_MODES.index("countries"), strategy_index))],
+    ])
+    for strategy_index in range(-1, len(BOT_STRATEGIES))
+}
+# Главное меню ссылается на бота по имени, которое известно только после getMe
+MAIN_MENU_KEYBOARDS: Dict[str, InlineKeyboardMarkup] = {}
+
+
+def main_menu_keyboard(bot_username: str) -> InlineKeyboardMarkup:
+    keyboard = MAIN_MENU_KEYBOARDS.get(bot_username)
+    if keyboard is None:
+        keyboard = MAIN_MENU_KEYBOARDS[bot_username] = InlineKeyboardMarkup([
             [InlineKeyboardButton("➕ Добавить в группу", url=f"https://t.me/{bot_username}?startgroup=true")],
-            [InlineKeyboardButton("Мини-игры", callback_data="games_list")]
+            [InlineKeyboardButton("Мини-игры", callback_data=CB_GAMES_LIST)]
         ])
-        await query.edit_message_text(
-            "Выберите действие:",
-            reply_markup=keyboard
-        )
-        return
+    return keyboard
 
-    if query.data.startswith('game_info:'):
-        game_name = query.data.split(':', 1)[1]
-        description = game_descriptions.get(game_name, "Описание игры не найдено.")
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("◀ Назад", callback_data="games_list")]
-        ])
-        await query.edit_message_text(
-            description,
-            parse_mode="Markdown",
-            reply_markup=keyboard
-        )
-        return
 
-    if query.data.startswith('croc_word:'):
-        await handle_crocodile_word_choice(update, context)
-        return
+async def show_games_list(_update: Update, _context: ContextTypes.DEFAULT_TYPE, reply: CallbackReply) -> None:
+    await reply()
+    await reply.query.edit_message_text(
+        "Доступные мини-игры:",
+        reply_markup=GAMES_LIST_KEYBOARD
+    )
 
-    if query.data.startswith('quiz_answer:'):
-        await handle_quiz_answer(update, context)
-        return
 
-    if query.data.startswith('cities_mode:'):
-        await handle_cities_mode(update, context)
-        return
+async def show_main_menu(_update: Update, context: ContextTypes.DEFAULT_TYPE, reply: CallbackReply) -> None:
+    await reply()
+    await reply.query.edit_message_text(
+        "Выберите действие:",
+        reply_markup=main_menu_keyboard(context.bot.username)
+    )
 
-    if query.data == 'join_cities':
-        await handle_join_cities(update, context)
-        return
+
+async def show_game_info(_update: Update, _context: ContextTypes.DEFAULT_TYPE, reply: CallbackReply,
+                         game_index: int) -> None:
+    await reply()
+    if 0 <= game_index < len(GAME_NAMES):
+        description = game_descriptions[GAME_NAMES[game_index]]
+    else:
+        description = "Описание игры не найдено."
+    await reply.query.edit_message_text(
+        description,
+        parse_mode="Markdown",
+        reply_markup=GAME_INFO_KEYBOARD
+    )
+
+
+# Префикс callback_data -> (обработчик, типы аргументов)
+CALLBACK_ROUTES: Dict[str, Tuple[Callable[..., Coroutine], Tuple[type, ...]]] = {
+    CB_GAMES_LIST: (show_games_list, ()),
+    CB_MAIN_MENU: (show_main_menu, ()),
+    CB_GAME_INFO: (show_game_info, (int,)),
+}
+# Кнопки игр берутся из реестра: кнопки идущей игры несут ее ключ (chat_id, thread_id)
+for game_type in GAME_TYPES.values():
+    for prefix, (method, arg_types) in game_type.setup_callbacks.items():
+        CALLBACK_ROUTES[prefix] = (getattr(game_type, method), arg_types)
+    for prefix, (method, arg_types) in game_type.callbacks.items():
+        CALLBACK_ROUTES[prefix] = (game_callback(game_type, method), (int, int, *arg_types))
+
+
+CALLBACK_LATENCY: Dict[Callable[..., Coroutine], HistogramChild] = {
+    handler: HANDLER_LATENCY.labels('callback', prefix) for prefix, (handler, _) in CALLBACK_ROUTES.items()
+}
+UNKNOWN_CALLBACK_LATENCY = HANDLER_LATENCY.labels('callback', 'unknown')
+
+
+async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    started = time.perf_counter()
+    query = update.callback_query
+    reply = CallbackReply(query)
+    latency = UNKNOWN_CALLBACK_LATENCY
+    try:
+        route = parse_callback(query.data)
+        if route is not None:
+            handler, args = route
+            latency = CALLBACK_LATENCY[handler]
+            await handler(update, context, reply, *args)
+    finally:
+        try:
+            await reply()
+        finally:
+            latency.observe(time.perf_counter() - started)
 
 
 async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     text = update.message.text
-    chat_id = update.effective_chat.id
 
     if text == 'Назад':
-        await update.message.reply_text('Отмена. Возвращаемся в начало.', reply_markup=ReplyKeyboardRemove())
-        kb = ReplyKeyboardMarkup([['Мини-игры']], resize_keyboard=True, one_time_keyboard=True)
-        await update.message.reply_text('Выберите действие:', reply_markup=kb)
+        await update.message.reply_text('Отмена. Возвращаемся в начало.', reply_markup=REMOVE_KEYBOARD)
+        await update.message.reply_text('Выберите действие:', reply_markup=MENU_REPLY_KEYBOARD)
         return
 
     if text == 'Мини-игры':
-        kb = ReplyKeyboardMarkup(
-            [
-                ['Викторина', 'Крокодил'],
-                ['Города и страны', 'Назад'],
-            ], resize_keyboard=True, one_time_keyboard=True
-        )
-        await update.message.reply_text('**Выберите мини-игру:**', parse_mode="Markdown", reply_markup=kb)
+        await update.message.reply_text('**Выберите мини-игру:**', parse_mode="Markdown",
+                                        reply_markup=GAMES_REPLY_KEYBOARD)
         return
 
     if text in game_descriptions:
-        description = game_descriptions[text]
-        keyboard = InlineKeyboardMarkup([])
         await update.message.reply_text(
-            description,
+            game_descriptions[text],
             parse_mode="Markdown",
-            reply_markup=keyboard
+            reply_markup=EMPTY_KEYBOARD
         )
         return
 
-    game = games.get(chat_id)
-    if not game:
-        return
-
-    if game["type"] == "cities":
-        await handle_cities_answer(update, context)
-    elif game["type"] == "crocodile":
-        await handle_crocodile_guess(update, context)
+    game = games.get(update_key(update))
+    if game is not None:
+        await game.on_message(update, context)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    HANDLER_ERRORS_TOTAL.inc()
     logging.error(f'Ошибка: {context.error}', exc_info=True)
     if update and update.effective_message:
         try:
@@ -890,31 +3444,689 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             pass
 
 
+def games_by_type() -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for game in games.values():
+        counts[game.name] = counts.get(game.name, 0) + 1
+    return counts
+
+
+def register_runtime_metrics(limiter: 'OutboundLimiter') -> None:
+    metrics.register(CallbackMetric(
+        'skillbit_active_games', 'Активные игры по типу', 'gauge', ('type',),
+        lambda: [((game_type,), count) for game_type, count in games_by_type().items()]))
+    metrics.register(CallbackMetric(
+        'skillbit_pending_timers', 'Взведенные игровые таймеры', 'gauge', (), lambda: [((), timers.pending)]))
+    metrics.register(CallbackMetric(
+        'skillbit_stats_pending', 'Несохраненные строки статистики игроков', 'gauge', (),
+        lambda: [((), stats.pending)]))
+    metrics.register(CallbackMetric(
+        'skillbit_outbound_queue_depth', 'Запросы в очереди исходящих сообщений', 'gauge', (),
+        lambda: [((), limiter.queue_depth)]))
+    metrics.register(CallbackMetric(
+        'skillbit_outbound_coalesced_total', 'Схлопнутые правки сообщений', 'counter', (),
+        lambda: [((), limiter.coalesced)]))
+    metrics.register(CallbackMetric(
+        'skillbit_outbound_retries_total', 'Повторы после flood control', 'counter', (),
+        lambda: [((), limiter.retries)]))
+    metrics.register(CallbackMetric(
+        'skillbit_name_cache_requests_total', 'Обращения к кэшу имен', 'counter', ('result',),
+        lambda: [(('hit',), name_cache.hits), (('miss',), name_cache.misses)]))
+
+
+def format_latency(seconds: float) -> str:
+    return '>10 с' if seconds == float('inf') else f'{seconds * 1000:.0f} мс'
+
+
+def render_stats(limiter: 'OutboundLimiter') -> str:
+    by_type = games_by_type()
+    lines = [f'Воркер {WORKER_INDEX + 1} из {WORKER_COUNT}'] if WORKER_COUNT > 1 else []
+    lines += [
+        f'Игр: {len(games)}' + (' (' + ', '.join(f'{t}: {n}' for t, n in sorted(by_type.items())) + ')' if by_type else ''),
+        f'Таймеров: {timers.pending}',
+        f'Очередь исходящих: {limiter.queue_depth}, схлопнуто {limiter.coalesced}, повторов {limiter.retries}',
+        f'Кэш имен: {name_cache.hits} попаданий, {name_cache.misses} промахов',
+        f'Ошибок в обработчиках: {HANDLER_ERRORS_TOTAL.value:g}',
+    ]
+    for title, histogram, api in (('Обработчики', HANDLER_LATENCY, False), ('Bot API', API_LATENCY, True)):
+        rows = sorted((values, child) for values, child in list(histogram.children.items()) if child.count)
+        if rows:
+            lines.append(f'{title} (вызовов, среднее, p99):')
+        for values, child in rows:
+            errors = sum(c.value for (method, _), c in list(API_ERRORS.children.items()) if method == values[0]) if api else 0
+            lines.append(
+                f'  {" ".join(values)}: {child.count}, {format_latency(child.sum / child.count)}, '
+                f'{format_latency(child.quantile(0.99))}' + (f', ошибок {errors:g}' if errors else '')
+            )
+    return '\n'.join(lines)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return await update.message.reply_text('Команда доступна только администраторам бота.')
+    await update.message.reply_text(render_stats(context.application.bot.rate_limiter))
+
+
+async def serve_metrics(_headers: Dict[str, str], _body: bytes) -> Tuple[int, str, bytes]:
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode()
+
+
+snapshot_tasks: List[asyncio.Task] = []
+metrics_server: Optional['HttpServer'] = None
+
+
+async def start_metrics_server() -> None:
+    global metrics_server
+    if not METRICS_PORT:
+        return
+    port = METRICS_PORT + 1 + WORKER_INDEX if WORKER_COUNT > 1 else METRICS_PORT
+    server = HttpServer(METRICS_HOST, port)
+    server.route('GET', '/metrics', serve_metrics)
+    try:
+        await server.start()
+    except OSError as e:
+        logging.warning(f'Не удалось запустить сервер метрик на {METRICS_HOST}:{port}: {e}')
+        return
+    metrics_server = server
+
+
+async def on_startup(application: Application) -> None:
+    global recorder
+    if RECORD_PATH:
+        # Воркеры пишут каждый в свой файл
+        recorder = Recorder(f'{RECORD_PATH}.{WORKER_INDEX}' if WORKER_COUNT > 1 else RECORD_PATH)
+        recorder.header(application.bot.bot)
+        snapshot_tasks.append(asyncio.create_task(recorder.run_flushes()))
+    await load_word_pools()
+    games.load(WORKER_INDEX, WORKER_COUNT)
+    chat_settings.load(WORKER_INDEX, WORKER_COUNT)
+    timers.start()
+    context = CallbackContext(application)
+    now = clock.time()
+    for key, game in list(games.items()):
+        if game.timer_kind in game.timeouts:
+            arm_timer(key, game.timer_kind, max(0.0, game.deadline - now), context)
+    logging.info(f'Восстановлено игр: {len(games)}')
+    snapshot_tasks.append(asyncio.create_task(games.run_snapshots()))
+    snapshot_tasks.append(asyncio.create_task(seen_questions.run_snapshots()))
+    snapshot_tasks.append(asyncio.create_task(stats.run_snapshots()))
+    await start_metrics_server()
+
+
+async def on_stop(_application: Application) -> None:
+    await timers.drain()
+
+
+async def on_shutdown(_application: Application) -> None:
+    global metrics_server, question_bank, recorder
+    for task in snapshot_tasks:
+        task.cancel()
+    snapshot_tasks.clear()
+    if metrics_server is not None:
+        await metrics_server.stop()
+        metrics_server = None
+    await games.flush()
+    games.backend.close()
+    await seen_questions.flush()
+    seen_questions.backend.close()
+    await stats.flush()
+    stats.close()
+    chat_settings.backend.close()
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+    if question_bank is not None:
+        question_bank.close()
+        question_bank = None
+
+
+class HttpServer:
+    # Минимальный HTTP/1.1 сервер на asyncio: вебхук, проверка здоровья и служебные страницы
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.routes: Dict[Tuple[str, str], Callable[[Dict[str, str], bytes], Coroutine]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Callable[[Dict[str, str], bytes], Coroutine]) -> None:
+        self.routes[(method, path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logging.info(f'HTTP-сервер слушает {self.host}:{self.port}')
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = await asyncio.wait_for(self._read_headers(reader), HTTP_READ_TIMEOUT)
+
+                length = int(headers.get('content-length', 0))
+                if length > HTTP_MAX_BODY:
+                    self._write(writer, 413, 'text/plain', b'Payload Too Large', False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), HTTP_READ_TIMEOUT) if length else b''
+
+                handler = self.routes.get((method, target.split('?', 1)[0]))
+                if handler is None:
+                    status, content_type, payload = 404, 'text/plain', b'Not Found'
+                else:
+                    status, content_type, payload = await handler(headers, body)
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                self._write(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, content_type: str, payload: bytes, keep_alive: bool) -> None:
+        head = (
+            f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+        )
+        writer.write(head.encode('latin-1') + payload)
+
+
+class UpdateDispatcher:
+    # Обрабатывает апдейты конкурентно, но не больше max_concurrency одновременно;
+    # апдейты одной темы чата (там живет не больше одной игры) идут строго по очереди.
+    def __init__(self, application: Application, max_concurrency: int) -> None:
+        self.application = application
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._locks: Dict[GameKey, asyncio.Lock] = {}
+        self._waiting: Dict[GameKey, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.received = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, update: Update) -> None:
+        # Возвращается, когда апдейт принят в работу: при перегрузке вызывающий ждет слот
+        await self._slots.acquire()
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._release)
+
+    def _release(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _process(self, update: Update) -> None:
+        key = update_key(update) if update.effective_chat else None
+        try:
+            if key is None:
+                await self.application.process_update(update)
+                return
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            try:
+                async with lock:
+                    await self.application.process_update(update)
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+                    del self._locks[key]
+        except Exception:
+            logging.error('Ошибка при обработке апдейта', exc_info=True)
+
+    async def drain(self, timeout: float = 10) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+
+def check_webhook_secret(headers: Dict[str, str], secret: str) -> bool:
+    return not secret or hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', ''), secret)
+
+
+class WebhookIngress:
+    # Принимает апдейты из POST-запросов Telegram и передает их диспетчеру
+    def __init__(self, application: Application, secret: str, max_concurrency: int) -> None:
+        self.application = application
+        self.secret = secret
+        self.dispatcher = UpdateDispatcher(application, max_concurrency)
+
+    async def handle_update(self, headers: Dict[str, str], body: bytes) -> Tuple[int, str, bytes]:
+        if not check_webhook_secret(headers, self.secret):
+            return 403, 'text/plain', b'Forbidden'
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, 'text/plain', b'Bad Request'
+        if update is None:
+            return 400, 'text/plain', b'Bad Request'
+        await self.dispatcher.submit(update)
+        return 200, 'text/plain', b'OK'
+
+    async def health(self, _headers: Dict[str, str], _body: bytes) -> Tuple[int, str, bytes]:
+        payload = {
+            'status': 'ok',
+            'games': len(games),
+            'pending_timers': timers.pending,
+            'updates_received': self.dispatcher.received,
+            'updates_in_flight': self.dispatcher.in_flight,
+        }
+        return 200, 'application/json', json.dumps(payload).encode()
+
+
+async def run_application(application: Application, serve: Callable[[], Coroutine]) -> None:
+    # Жизненный цикл приложения без встроенного Updater: serve() работает, пока бот не остановлен
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await serve()
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def stop_on_signals(stop_event: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остается signal_handler
+            pass
+
+
+async def set_webhook(bot: Bot) -> None:
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=min(100, MAX_CONCURRENT_UPDATES),
+        )
+
+
+async def run_webhook(application: Application) -> None:
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+
+    ingress = WebhookIngress(application, WEBHOOK_SECRET, MAX_CONCURRENT_UPDATES)
+    server = HttpServer(WEBHOOK_HOST, WEBHOOK_PORT)
+    server.route('POST', WEBHOOK_PATH, ingress.handle_update)
+    server.route('GET', '/healthz', ingress.health)
+
+    async def serve() -> None:
+        await set_webhook(application.bot)
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await ingress.dispatcher.drain()
+
+    await run_application(application, serve)
+
+
+def route_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    # Чат, которому принадлежит апдейт, по сырому JSON — без построения объектов telegram
+    callback = data.get('callback_query')
+    if callback:
+        payload = callback.get('data') or ''
+        if payload.startswith(CB_CROC_WORD + ':'):
+            try:
+                return int(payload.split(':', 2)[1])
+            except (IndexError, ValueError):
+                pass
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member', 'chat_join_request'):
+        if key in data:
+            return data[key]['chat']['id']
+    return None
+
+
+def worker_main(index: int, count: int, updates: 'multiprocessing.Queue', stats: 'multiprocessing.Queue') -> None:
+    global WORKER_INDEX, WORKER_COUNT
+    # Ctrl+C ловит супервизор и останавливает воркеры через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    WORKER_INDEX, WORKER_COUNT = index, count
+    app = build_application()
+    asyncio.run(run_worker(app, updates, stats))
+
+
+async def run_worker(application: Application, updates: 'multiprocessing.Queue',
+                     stats: 'multiprocessing.Queue') -> None:
+    dispatcher = UpdateDispatcher(application, MAX_CONCURRENT_UPDATES)
+    loop = asyncio.get_running_loop()
+
+    async def report_stats() -> None:
+        while True:
+            await asyncio.sleep(WORKER_STATS_INTERVAL)
+            try:
+                stats.put_nowait({
+                    'worker': WORKER_INDEX,
+                    'pid': os.getpid(),
+                    'updates': dispatcher.received,
+                    'in_flight': dispatcher.in_flight,
+                    'games': len(games),
+                    'pending_timers': timers.pending,
+                    'outbound_queue': application.bot.rate_limiter.queue_depth,
+                    'name_cache_hits': name_cache.hits,
+                    'name_cache_misses': name_cache.misses,
+                })
+            except queue.Full:
+                pass
+
+    async def serve() -> None:
+        reporter = asyncio.create_task(report_stats())
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates.get)
+                if data is None:
+                    break
+                update = Update.de_json(data, application.bot)
+                if update is not None:
+                    await dispatcher.submit(update)
+        finally:
+            reporter.cancel()
+            await dispatcher.drain()
+
+    await run_application(application, serve)
+
+
+class Supervisor:
+    # Главный процесс: принимает апдейты, раскладывает их по воркерам по хэшу chat_id
+    # (все темы чата попадают в один воркер, так что лимит игр на чат считается локально),
+    # перезапускает упавшие воркеры и собирает их статистику
+    def __init__(self, count: int) -> None:
+        import multiprocessing
+        self.count = count
+        self._mp = multiprocessing.get_context('spawn')
+        self.queues = [self._mp.Queue(WORKER_QUEUE_SIZE) for _ in range(count)]
+        self.stats_queue = self._mp.Queue()
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * count
+        self.restarts = [0] * count
+        self.routed = [0] * count
+        self.stats: Dict[int, Dict[str, Any]] = {}
+        self._stopping = False
+
+    def start_worker(self, index: int) -> None:
+        process = self._mp.Process(
+            target=worker_main,
+            args=(index, self.count, self.queues[index], self.stats_queue),
+            name=f'skillbit-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        logging.info(f'Воркер {index} запущен (pid {process.pid})')
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self.start_worker(index)
+
+    async def route(self, data: Dict[str, Any]) -> None:
+        chat_id = route_chat_id(data)
+        index = shard_for_chat(chat_id, self.count) if chat_id is not None else 0
+        self.routed[index] += 1
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            # Воркер не успевает: ждем место в очереди, не блокируя цикл событий
+            await asyncio.get_running_loop().run_in_executor(None, self.queues[index].put, data)
+
+    async def monitor(self) -> None:
+        last_report = time.monotonic()
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    self.restarts[index] += 1
+                    logging.error(f'Воркер {index} завершился с кодом {process.exitcode}, перезапуск')
+                    self.start_worker(index)
+            while True:
+                try:
+                    report = self.stats_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.stats[report['worker']] = report
+            if time.monotonic() - last_report >= WORKER_STATS_INTERVAL:
+                last_report = time.monotonic()
+                for line in self.stats_lines():
+                    logging.info(line)
+
+    def stats_lines(self) -> List[str]:
+        lines = []
+        for index in range(self.count):
+            report = self.stats.get(index, {})
+            lines.append(
+                f"Воркер {index}: маршрутизировано {self.routed[index]}, "
+                f"обработано {report.get('updates', 0)}, игр {report.get('games', 0)}, "
+                f"таймеров {report.get('pending_timers', 0)}, перезапусков {self.restarts[index]}"
+            )
+        return lines
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            dict(self.stats.get(index, {}), worker=index, routed=self.routed[index], restarts=self.restarts[index],
+                 alive=bool(self.processes[index] and self.processes[index].is_alive()))
+            for index in range(self.count)
+        ]
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for q in self.queues:
+            q.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, 15)
+                if process.is_alive():
+                    process.terminate()
+
+
+async def run_supervisor(count: int) -> None:
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+    supervisor = Supervisor(count)
+    supervisor.start()
+    monitor_task = asyncio.create_task(supervisor.monitor())
+
+    bot = Bot(API_KEY, request=telegram_request(256), get_updates_request=telegram_request(1))
+    try:
+        async with bot:
+            if RUN_MODE == 'webhook':
+                await supervise_webhook(bot, supervisor, stop_event)
+            else:
+                await supervise_polling(bot, supervisor, stop_event)
+    finally:
+        monitor_task.cancel()
+        await supervisor.stop()
+
+
+async def supervise_polling(bot: Bot, supervisor: Supervisor, stop_event: asyncio.Event) -> None:
+    async def poll() -> None:
+        offset = None
+        backoff = 1.0
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except InvalidToken:
+                raise
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logging.warning(f'Flood control при получении апдейтов: пауза {retry_after} с')
+                await asyncio.sleep(retry_after)
+                continue
+            except TelegramError as e:
+                # Сеть, Conflict (запущен второй экземпляр) и прочие ответы Telegram — повторяем с паузой
+                logging.warning(f'Ошибка получения апдейтов: {e!r}, повтор через {backoff:g} с')
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                continue
+            backoff = 1.0
+            for update in updates:
+                offset = update.update_id + 1
+                try:
+                    await supervisor.route(update.to_dict())
+                except Exception:
+                    logging.exception(f'Апдейт {update.update_id} не передан воркеру')
+
+    def poll_done(task: asyncio.Task) -> None:
+        # Без получения апдейтов воркеры простаивают: завершаем процесс, а не зависаем
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f'Получение апдейтов остановлено: {task.exception()!r}')
+            stop_event.set()
+
+    poll_task = asyncio.create_task(poll())
+    poll_task.add_done_callback(poll_done)
+    try:
+        await stop_event.wait()
+    finally:
+        poll_task.cancel()
+    if poll_task.done() and not poll_task.cancelled():
+        poll_task.result()
+
+
+async def supervise_webhook(bot: Bot, supervisor: Supervisor, stop_event: asyncio.Event) -> None:
+    async def handle_update(headers: Dict[str, str], body: bytes) -> Tuple[int, str, bytes]:
+        if not check_webhook_secret(headers, WEBHOOK_SECRET):
+            return 403, 'text/plain', b'Forbidden'
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, 'text/plain', b'Bad Request'
+        if not isinstance(data, dict):
+            return 400, 'text/plain', b'Bad Request'
+        await supervisor.route(data)
+        return 200, 'text/plain', b'OK'
+
+    async def health(_headers: Dict[str, str], _body: bytes) -> Tuple[int, str, bytes]:
+        alive = sum(1 for worker in supervisor.snapshot() if worker['alive'])
+        payload = {'status': 'ok' if alive == supervisor.count else 'degraded', 'workers_alive': alive}
+        return 200, 'application/json', json.dumps(payload).encode()
+
+    async def workers(_headers: Dict[str, str], _body: bytes) -> Tuple[int, str, bytes]:
+        return 200, 'application/json', json.dumps(supervisor.snapshot()).encode()
+
+    server = HttpServer(WEBHOOK_HOST, WEBHOOK_PORT)
+    server.route('POST', WEBHOOK_PATH, handle_update)
+    server.route('GET', '/healthz', health)
+    server.route('GET', '/workers', workers)
+    await set_webhook(bot)
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+
+
 def signal_handler(_signum: Any, _frame: Any) -> None:
     logging.info("Получен сигнал завершения. Остановка бота...")
     sys.exit(0)
 
 
-def main() -> None:
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+ssl_context: Optional[ssl.SSLContext] = None
+
+
+def telegram_request(pool_size: int) -> HTTPXRequest:
+    # HTTP-клиенты процесса (запросы и getUpdates) делят один SSL-контекст: иначе httpx
+    # для каждого клиента заново читает хранилище сертификатов, а это десятки миллисекунд старта
+    global ssl_context
+    if ssl_context is None:
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return HTTPXRequest(connection_pool_size=pool_size, httpx_kwargs={'verify': ssl_context})
 
-    app = ApplicationBuilder().token(API_KEY).build()
+
+def build_application(builder: Optional[ApplicationBuilder] = None) -> Application:
+    # builder можно передать заранее настроенным (например, с подменным Bot API для нагрузочных тестов)
+    # Общий лимит бота делится между воркерами поровну
+    limiter = OutboundLimiter(GLOBAL_RATE / WORKER_COUNT)
+    register_runtime_metrics(limiter)
+    app = (
+        (builder or ApplicationBuilder().token(API_KEY).request(telegram_request(256))
+         .get_updates_request(telegram_request(1)))
+        .rate_limiter(limiter)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     app.add_error_handler(error_handler)
 
-    app.add_handler(CommandHandler('start', start_command))
-    app.add_handler(CommandHandler('stop', stop_command))
-    app.add_handler(CommandHandler('quiz', quiz_command))
-    app.add_handler(CommandHandler('crocodile', crocodile_command))
-    app.add_handler(CommandHandler('cities', cities_command))
-    app.add_handler(CommandHandler('menu', menu_command))
+    if RECORD_PATH:
+        app.add_handler(TypeHandler(Update, record_update), group=-2)
+    app.add_handler(TypeHandler(Update, remember_user), group=-1)
+
+    app.add_handler(command_handler('start', start_command))
+    app.add_handler(command_handler('stop', stop_command))
+    for game_type in GAME_TYPES.values():
+        app.add_handler(command_handler(game_type.command, game_type.on_command))
+    app.add_handler(command_handler('menu', menu_command))
+    app.add_handler(command_handler('stats', stats_command))
+    app.add_handler(command_handler('top', top_command))
+    app.add_handler(command_handler('me', me_command))
+    app.add_handler(command_handler('timers', timers_command))
 
     app.add_handler(CallbackQueryHandler(on_callback))
-    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_messages))
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND),
+                                   timed(HANDLER_LATENCY.labels('message', 'text'), handle_messages)))
+    return app
+
+
+def main() -> None:
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    if WORKERS > 1:
+        logging.info(f'Bot started with {WORKERS} workers...')
+        asyncio.run(run_supervisor(WORKERS))
+        return
 
-    logging.info('Bot started polling...')
-    app.run_polling()
+    app = build_application()
+
+    if RUN_MODE == 'webhook':
+        logging.info('Bot started webhook...')
+        asyncio.run(run_webhook(app))
+    else:
+        logging.info('Bot started polling...')
+        app.run_polling()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Тесты не трогают диск и не поднимают сервер метрик
+os.environ.setdefault('SKILLBIT_STATE_BACKEND', 'memory')
+os.environ.setdefault('SKILLBIT_METRICS_PORT', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
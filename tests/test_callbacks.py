@@ -0,0 +1,65 @@
+import pytest
+
+import skillbit
+from skillbit import (
+    CALLBACK_DATA_LIMIT, CALLBACK_ROUTES, CB_CITIES_MODE, CB_GAME_INFO, CB_GAMES_LIST, CB_JOIN_CITIES,
+    CB_QUIZ_ANSWER, encode_callback, parse_callback,
+)
+
+
+def test_round_trip_keeps_handler_and_typed_args():
+    data = encode_callback(CB_QUIZ_ANSWER, -1001234567890, 42, 3, 2)
+    handler, args = parse_callback(data)
+    assert handler is CALLBACK_ROUTES[CB_QUIZ_ANSWER][0]
+    assert args == (-1001234567890, 42, 3, 2)
+    assert all(isinstance(arg, int) for arg in args)
+
+
+def test_routes_without_args():
+    handler, args = parse_callback(encode_callback(CB_GAMES_LIST))
+    assert handler is skillbit.show_games_list
+    assert args == ()
+
+
+@pytest.mark.parametrize('data', [
+    None,
+    '',
+    'zz',                                   # неизвестный префикс
+    f'{CB_GAME_INFO}',                      # не хватает аргумента
+    f'{CB_GAME_INFO}:1:2',                  # лишний аргумент
+    f'{CB_GAME_INFO}:abc',                  # не число
+    f'{CB_QUIZ_ANSWER}:-100:0:1',           # кнопка игры без варианта ответа
+    'game_info_0',                          # старый формат кнопок
+])
+def test_malformed_data_is_rejected(data):
+    assert parse_callback(data) is None
+
+
+def test_encode_rejects_data_over_telegram_limit():
+    with pytest.raises(ValueError):
+        encode_callback(CB_GAME_INFO, 'x' * CALLBACK_DATA_LIMIT)
+
+
+def test_longest_game_buttons_fit_the_limit():
+    # Кнопки игр несут ключ (chat_id, thread_id) — проверяем с самыми длинными значениями
+    chat_id, thread_id = -1009999999999999, 2 ** 31 - 1
+    for prefix, args in (
+        (CB_QUIZ_ANSWER, (chat_id, thread_id, 2 ** 31 - 1, 9)),
+        (CB_JOIN_CITIES, (chat_id, thread_id)),
+        (CB_CITIES_MODE, (1, 2)),
+    ):
+        data = encode_callback(prefix, *args)
+        assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+        assert parse_callback(data)[1] == args
+
+
+def test_every_static_keyboard_button_parses():
+    keyboards = [
+        skillbit.GAMES_LIST_KEYBOARD, skillbit.GAME_INFO_KEYBOARD,
+        *skillbit.CITIES_MODE_KEYBOARDS.values(), skillbit.main_menu_keyboard('skillbit_bot'),
+    ]
+    for keyboard in keyboards:
+        for row in keyboard.inline_keyboard:
+            for button in row:
+                if button.callback_data is not None:
+                    assert parse_callback(button.callback_data) is not None, button.callback_data
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, Tuple
+
+import skillbit
+from skillbit import HttpServer
+
+
+async def echo(headers: Dict[str, str], body: bytes) -> Tuple[int, str, bytes]:
+    return 200, 'text/plain', body or b'ok'
+
+
+async def start_server() -> Tuple[HttpServer, int]:
+    server = HttpServer('127.0.0.1', 0)
+    server.route('POST', '/echo', echo)
+    server.route('GET', '/health', echo)
+    await server.start()
+    return server, server._server.sockets[0].getsockname()[1]
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+def test_keep_alive_serves_several_requests():
+    async def scenario():
+        server, port = await start_server()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello')
+        first = await read_response(reader)
+        writer.write(b'GET /missing HTTP/1.1\r\n\r\n')
+        second = await read_response(reader)
+        writer.write(b'GET /health HTTP/1.1\r\nConnection: close\r\n\r\n')
+        third = await read_response(reader)
+        closed = await reader.read() == b''
+        writer.close()
+        await server.stop()
+        return first, second, third, closed
+
+    first, second, third, closed = asyncio.run(scenario())
+    assert first == (200, b'hello')
+    assert second == (404, b'Not Found')
+    assert third == (200, b'ok')
+    assert closed
+
+
+def test_oversized_body_is_rejected():
+    async def scenario():
+        server, port = await start_server()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'POST /echo HTTP/1.1\r\nContent-Length: {skillbit.HTTP_MAX_BODY + 1}\r\n\r\n'.encode())
+        response = await read_response(reader)
+        writer.close()
+        await server.stop()
+        return response
+
+    assert asyncio.run(scenario())[0] == 413
+
+
+async def closed_within(reader: asyncio.StreamReader, timeout: float) -> bool:
+    # Сервер закрыл соединение: чтение отдает конец потока, а не висит
+    return await asyncio.wait_for(reader.read(), timeout) == b''
+
+
+def test_idle_keep_alive_connection_is_closed(monkeypatch):
+    monkeypatch.setattr(skillbit, 'HTTP_IDLE_TIMEOUT', 0.2)
+
+    async def scenario():
+        server, port = await start_server()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /health HTTP/1.1\r\n\r\n')
+        response = await read_response(reader)
+        closed = await closed_within(reader, 2.0)
+        writer.close()
+        await server.stop()
+        return response, closed
+
+    response, closed = asyncio.run(scenario())
+    assert response == (200, b'ok')
+    assert closed
+
+
+def test_slow_request_is_closed(monkeypatch):
+    monkeypatch.setattr(skillbit, 'HTTP_READ_TIMEOUT', 0.2)
+
+    async def scenario():
+        server, port = await start_server()
+        results = []
+        # Заголовки не дописаны, затем тело короче обещанного
+        for partial in (b'POST /echo HTTP/1.1\r\nContent-Le', b'POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc'):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(partial)
+            results.append(await closed_within(reader, 2.0))
+            writer.close()
+        await server.stop()
+        return results
+
+    assert asyncio.run(scenario()) == [True, True]
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Tuple
+
+from telegram.error import RetryAfter
+
+from skillbit import (
+    GLOBAL_RATE, GROUP_RATE, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, RL_COSMETIC,
+    OutboundLimiter, OutboundRequest, SlidingWindow,
+)
+
+GROUP = -1001
+OTHER_GROUP = -1002
+
+
+def make_limiter(global_rate: float = GLOBAL_RATE) -> OutboundLimiter:
+    # Без фонового насоса: выдачу двигает drive на своих часах
+    limiter = OutboundLimiter(global_rate)
+    limiter._wakeup = asyncio.Event()
+    return limiter
+
+
+async def enqueue(limiter: OutboundLimiter, chat_id: int,
+                  priority: int = PRIORITY_NORMAL) -> Tuple[OutboundRequest, asyncio.Task]:
+    request = OutboundRequest('sendMessage', chat_id, priority, None, ())
+    task = asyncio.ensure_future(limiter._acquire(request))
+    await asyncio.sleep(0)
+    return request, task
+
+
+def drive(limiter: OutboundLimiter, requests: List[OutboundRequest],
+          until: float = 3600.0) -> List[Tuple[float, OutboundRequest]]:
+    # Выдает разрешения на виртуальных часах, сразу отмечая отправку, как это делает _send
+    now = 0.0
+    waiting = list(requests)
+    granted = []
+    while waiting and now <= until:
+        delay = limiter._grant(now)
+        if delay == 0:
+            request = next(r for r in waiting if r.granted.done())
+            waiting.remove(request)
+            limiter._global.stamp(now)
+            limiter._window(request.chat_id).stamp(now)
+            granted.append((now, request))
+        elif delay == float('inf'):
+            break
+        else:
+            now += delay
+    return granted
+
+
+def max_in_window(times: List[float], span: float) -> int:
+    # Наибольшее число отправок за любые span секунд, считая как Telegram
+    best = start = 0
+    for end, moment in enumerate(times):
+        while times[start] <= moment - span:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def test_sliding_window_never_exceeds_limit():
+    window = SlidingWindow(20, 60.0)
+    now, sent = 0.0, []
+    while len(sent) < 200:
+        delay = window.delay(now)
+        if delay:
+            now += delay
+            continue
+        window.take()
+        window.stamp(now)
+        sent.append(now)
+    assert max_in_window(sent, 60.0) == 20
+    # Первые 20 уходят сразу, дальше — по одному по мере выхода старых из окна
+    assert sent[19] == 0.0 and sent[20] == 60.0
+
+
+def test_reserved_slots_count_before_stamp():
+    window = SlidingWindow(2, 1.0)
+    window.take()
+    window.take()
+    assert window.delay(0.0) > 0
+    window.stamp(0.5)
+    window.stamp(0.5)
+    assert window.delay(1.4) > 0
+    assert window.delay(1.6) == 0
+
+
+def test_block_delays_until_retry_after():
+    window = SlidingWindow(20, 60.0)
+    window.block(10.0, 5.0)
+    assert window.delay(12.0) == 3.0
+    assert window.delay(15.0) == 0
+    assert not window.is_idle(12.0)
+
+
+def test_group_chat_stays_under_limit():
+    async def scenario() -> List[float]:
+        limiter = make_limiter()
+        requests = [(await enqueue(limiter, GROUP))[0] for _ in range(100)]
+        return [moment for moment, _ in drive(limiter, requests)]
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 100
+    assert max_in_window(sent, 60.0) <= GROUP_RATE
+
+
+def test_global_rate_stays_under_limit():
+    async def scenario() -> List[float]:
+        limiter = make_limiter()
+        requests = [(await enqueue(limiter, GROUP - i))[0] for i in range(300)]
+        return [moment for moment, _ in drive(limiter, requests)]
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 300
+    assert max_in_window(sent, 1.0) <= GLOBAL_RATE
+
+
+def test_worker_share_rounds_down():
+    limiter = make_limiter(GLOBAL_RATE / 4)
+    assert limiter._global.limit * 4 <= GLOBAL_RATE
+
+
+def test_higher_priority_goes_first():
+    async def scenario() -> List[int]:
+        limiter = make_limiter()
+        low, _ = await enqueue(limiter, GROUP, PRIORITY_LOW)
+        normal, _ = await enqueue(limiter, OTHER_GROUP, PRIORITY_NORMAL)
+        high, _ = await enqueue(limiter, GROUP - 2, PRIORITY_HIGH)
+        return [request.priority for _, request in drive(limiter, [low, normal, high])]
+
+    assert asyncio.run(scenario()) == [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW]
+
+
+def test_full_chat_does_not_hold_back_others():
+    async def scenario() -> List[Tuple[float, int]]:
+        limiter = make_limiter()
+        limiter._window(GROUP).block(0.0, 30.0)
+        blocked, _ = await enqueue(limiter, GROUP, PRIORITY_HIGH)
+        free, _ = await enqueue(limiter, OTHER_GROUP, PRIORITY_LOW)
+        return [(moment, request.chat_id) for moment, request in drive(limiter, [blocked, free])]
+
+    assert asyncio.run(scenario()) == [(0.0, OTHER_GROUP), (30.0, GROUP)]
+
+
+def test_cancelled_request_leaves_queue():
+    async def scenario() -> Tuple[List[OutboundRequest], OutboundRequest, int]:
+        limiter = make_limiter()
+        first, first_task = await enqueue(limiter, GROUP)
+        second, _ = await enqueue(limiter, GROUP)
+        first_task.cancel()
+        await asyncio.sleep(0)
+        granted = [request for _, request in drive(limiter, [second])]
+        return granted, second, limiter.queue_depth
+
+    granted, second, depth = asyncio.run(scenario())
+    assert granted == [second]
+    assert depth == 0
+
+
+def test_pending_edits_coalesce_into_last():
+    calls: List[str] = []
+
+    async def edit(text: str) -> Dict[str, Any]:
+        calls.append(text)
+        return {'text': text}
+
+    async def scenario() -> List[Any]:
+        limiter = OutboundLimiter()
+        await limiter.initialize()
+        limiter._window(GROUP).block(time.monotonic(), 0.1)
+        data = {'chat_id': GROUP, 'message_id': 7}
+        results = await asyncio.gather(*(
+            limiter.process_request(edit, (text,), {}, 'editMessageText', data, RL_COSMETIC)
+            for text in ('1', '2', '3')
+        ))
+        await limiter.shutdown()
+        return results
+
+    results = asyncio.run(scenario())
+    assert calls == ['3']
+    assert results == [{'text': '3'}] * 3
+
+
+def run_edits_around_send(fail_first: bool) -> Tuple[List[str], List[Any]]:
+    # Правка «2» приходит, пока «1» уже в пути; «1» может получить flood control
+    calls: List[str] = []
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def edit(text: str) -> Dict[str, Any]:
+        calls.append(text)
+        if len(calls) == 1:
+            started.set()
+            await release.wait()
+            if fail_first:
+                raise RetryAfter(timedelta(milliseconds=50))
+        return {'text': text}
+
+    async def scenario() -> List[Any]:
+        limiter = OutboundLimiter()
+        await limiter.initialize()
+        data = {'chat_id': GROUP, 'message_id': 7}
+        first = asyncio.ensure_future(limiter.process_request(edit, ('1',), {}, 'editMessageText', data, RL_COSMETIC))
+        await started.wait()
+        second = asyncio.ensure_future(limiter.process_request(edit, ('2',), {}, 'editMessageText', data, RL_COSMETIC))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, second)
+        await limiter.shutdown()
+        return results
+
+    results = asyncio.run(scenario())
+    return calls, results
+
+
+def test_retry_after_does_not_resend_stale_edit():
+    calls, results = run_edits_around_send(fail_first=True)
+    # Повтор после flood control отправляет уже новый текст, и старый не приходит последним
+    assert calls == ['1', '2']
+    assert results == [{'text': '2'}] * 2
+
+
+def test_edit_during_send_is_delivered_after_it():
+    calls, results = run_edits_around_send(fail_first=False)
+    assert calls == ['1', '2']
+    assert results == [{'text': '2'}] * 2
@@ -0,0 +1,109 @@
+import random
+from typing import Dict, List
+
+import pytest
+
+import build_question_bank
+from skillbit import QUESTION_BANK_HEADER, QUIZ_QUESTIONS, QuestionBank, encode_question_bank
+
+
+def make_questions(count: int, category: str, language: str) -> List[Dict]:
+    return [{
+        'question': f'{category} {language} вопрос {i}?',
+        'options': [f'ответ {i}', f'мимо {i}', 'Ёлка «в кавычках»'],
+        'answer': f'ответ {i}',
+        'category': category,
+        'language': language,
+    } for i in range(count)]
+
+
+QUESTIONS = make_questions(30, 'История', 'ru') + make_questions(20, 'Наука', 'ru') + make_questions(10, 'Science', 'en')
+
+
+def test_round_trip_keeps_every_question():
+    bank = QuestionBank.from_questions(QUESTIONS)
+    assert len(bank) == len(QUESTIONS)
+    decoded = {bank.question(number)['question']: bank.question(number) for number in range(len(bank))}
+    for question in QUESTIONS:
+        restored = decoded[question['question']]
+        assert restored['options'] == question['options']
+        assert restored['answer'] == question['answer']
+
+
+def test_groups_are_contiguous_ranges():
+    bank = QuestionBank.from_questions(QUESTIONS)
+    assert bank.languages() == {'ru', 'en'}
+    assert bank.categories('ru') == ['История', 'Наука']
+    assert sorted(len(numbers) for numbers in bank.groups.values()) == [10, 20, 30]
+    for (category, language), numbers in bank.groups.items():
+        for number in numbers:
+            assert bank.question(number)['question'].startswith(f'{category} {language}')
+
+
+def test_sample_stays_in_category_without_repeats():
+    bank = QuestionBank.from_questions(QUESTIONS)
+    numbers = bank.sample(15, category='Наука', language='ru', rng=random.Random(1))
+    assert len(set(numbers)) == 15
+    assert all(bank.question(number)['question'].startswith('Наука ru') for number in numbers)
+    # Вопросов в теме меньше, чем просят, — отдаются все
+    assert len(bank.sample(50, language='en')) == 10
+
+
+def test_sample_prefers_questions_not_excluded():
+    bank = QuestionBank.from_questions(QUESTIONS)
+    history = bank.ranges('История', 'ru')[0]
+    asked = set(history[:25])
+    numbers = bank.sample(5, category='История', language='ru', exclude=asked.__contains__, rng=random.Random(2))
+    assert sorted(numbers) == list(history[25:])
+    # Когда свежих не хватает, добираются уже заданные
+    numbers = bank.sample(8, category='История', language='ru', exclude=asked.__contains__, rng=random.Random(2))
+    assert len(numbers) == 8 and set(history[25:]) <= set(numbers)
+
+
+def test_open_from_file_through_mmap(tmp_path):
+    path = tmp_path / 'questions.skqb'
+    path.write_bytes(encode_question_bank(QUESTIONS))
+    bank = QuestionBank.open(str(path))
+    try:
+        assert len(bank) == len(QUESTIONS)
+        assert bank.question(len(bank) - 1)['options'][2] == 'Ёлка «в кавычках»'
+    finally:
+        bank.close()
+
+
+def test_key_does_not_depend_on_number():
+    shuffled = QUESTIONS[::-1]
+    first, second = QuestionBank.from_questions(QUESTIONS), QuestionBank.from_questions(shuffled + QUIZ_QUESTIONS)
+    keys = {first.question(n)['question']: first.key(n) for n in range(len(first))}
+    for n in range(len(second)):
+        question = second.question(n)['question']
+        if question in keys:
+            assert second.key(n) == keys[question]
+
+
+def test_rejects_foreign_files_and_bad_numbers():
+    data = encode_question_bank(QUESTIONS)
+    with pytest.raises(ValueError):
+        QuestionBank(b'XXXX' + data[4:])
+    header = bytearray(data[:QUESTION_BANK_HEADER.size])
+    header[4] = 99  # другая версия формата
+    with pytest.raises(ValueError):
+        QuestionBank(bytes(header) + data[QUESTION_BANK_HEADER.size:])
+    bank = QuestionBank(data)
+    with pytest.raises(IndexError):
+        bank.question(len(bank))
+
+
+def test_builder_normalizes_and_validates():
+    question = build_question_bank.normalize(
+        {'question': ' Столица Франции? ', 'options': ['Париж', 'Лион'], 'answer': 0}, 'Общие', 'ru')
+    assert question == {'question': 'Столица Франции?', 'options': ['Париж', 'Лион'], 'answer': 'Париж',
+                        'category': 'Общие', 'language': 'ru'}
+    for broken in (
+        {'question': '', 'options': ['а', 'б'], 'answer': 'а'},
+        {'question': 'Один вариант?', 'options': ['а'], 'answer': 'а'},
+        {'question': 'Повтор?', 'options': ['а', 'а'], 'answer': 'а'},
+        {'question': 'Нет ответа?', 'options': ['а', 'б'], 'answer': 'в'},
+    ):
+        with pytest.raises(ValueError):
+            build_question_bank.normalize(broken, 'Общие', 'ru')
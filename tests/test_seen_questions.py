@@ -0,0 +1,69 @@
+import base64
+import hashlib
+import json
+from typing import List
+
+from skillbit import SEEN_FILTER_BYTES, SEEN_GENERATION_SIZE, RotatingBloomFilter
+
+
+def keys(prefix: str, count: int) -> List[bytes]:
+    # Такие же 8-байтные ключи, как QuestionBank.key
+    return [hashlib.blake2b(f'{prefix}{i}'.encode(), digest_size=8).digest() for i in range(count)]
+
+
+def false_positive_rate(bloom: RotatingBloomFilter, probes: int = 20000) -> float:
+    return sum(key in bloom for key in keys('probe', probes)) / probes
+
+
+def test_no_false_negatives_for_recent_keys():
+    bloom = RotatingBloomFilter()
+    added = keys('q', SEEN_GENERATION_SIZE * 5)
+    for i, key in enumerate(added):
+        bloom.add(key)
+        # Последние SEEN_GENERATION_SIZE ключей помнятся всегда, при любой ротации
+        recent = added[max(0, i + 1 - SEEN_GENERATION_SIZE):i + 1]
+        if i % 97 == 0:
+            assert all(k in bloom for k in recent)
+    assert all(key in bloom for key in added[-SEEN_GENERATION_SIZE:])
+
+
+def test_false_positive_rate_matches_sizing():
+    bloom = RotatingBloomFilter()
+    for key in keys('q', SEEN_GENERATION_SIZE):
+        bloom.add(key)
+    # Одно полное поколение: около 1%
+    assert false_positive_rate(bloom) < 0.015
+    for key in keys('r', SEEN_GENERATION_SIZE):
+        bloom.add(key)
+    # Оба поколения полны — ошибки двух фильтров складываются
+    assert false_positive_rate(bloom) < 0.03
+
+
+def test_rotation_forgets_old_generations():
+    bloom = RotatingBloomFilter()
+    old = keys('old', SEEN_GENERATION_SIZE)
+    for key in old:
+        bloom.add(key)
+    for key in keys('new', SEEN_GENERATION_SIZE * 2 + 1):
+        bloom.add(key)
+    # Старые ключи вытеснены двумя ротациями; «помнятся» только ложные срабатывания
+    assert sum(key in bloom for key in old) / len(old) < 0.05
+    assert bloom.count <= SEEN_GENERATION_SIZE
+
+
+def test_dump_and_load_round_trip():
+    bloom = RotatingBloomFilter()
+    added = keys('q', SEEN_GENERATION_SIZE + 10)
+    for key in added:
+        bloom.add(key)
+    restored = RotatingBloomFilter.load(bloom.dump())
+    assert restored.count == bloom.count == 10
+    assert restored.current == bloom.current and restored.previous == bloom.previous
+    assert all(key in restored for key in added)
+
+
+def test_load_with_other_size_starts_empty():
+    other = base64.b64encode(b'\xff' * (SEEN_FILTER_BYTES // 2)).decode()
+    restored = RotatingBloomFilter.load(json.dumps({'count': 7, 'current': other, 'previous': other}))
+    assert restored.count == 0
+    assert not any(key in restored for key in keys('q', 100))
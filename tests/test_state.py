@@ -0,0 +1,168 @@
+import asyncio
+import sqlite3
+
+from skillbit import (
+    ChatSettings, CitiesGame, CrocodileGame, GameStore, MemoryStateBackend, QuizGame, SQLiteStateBackend,
+    default_timings, dump_game,
+)
+
+CHAT = -1001
+OTHER_CHAT = -1002
+
+
+def make_games():
+    quiz = QuizGame((CHAT, 0), [5, 1, 9])
+    quiz.stage = 'asking'
+    quiz.current_round = 1
+    quiz.scores = {101: 250, 102: 40}
+    quiz.last_answered = {101: 1, 102: 0}
+    quiz.answers.add(101, 2, 1500)
+    quiz.answers.add(102, 0, 3200)
+    quiz.timer_kind, quiz.deadline = 'quiz_answer', 1234.5
+    croc = CrocodileGame((CHAT, 42), 103)
+    croc.word = 'жираф'
+    cities = CitiesGame((OTHER_CHAT, 0), 'cities', 104, 'Москва', 77, 'trap')
+    cities.players.append(105)
+    cities.used_words.append('Анкара')
+    cities.word_pool.use('Анкара')
+    cities.scores = {104: 1, 105: 1}
+    return [quiz, croc, cities]
+
+
+def test_sqlite_backend_round_trip(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path, 'games')
+    backend.write_batch({(CHAT, 0): 'a', (CHAT, 7): 'b', (OTHER_CHAT, 0): 'c'}, set())
+    backend.write_batch({(CHAT, 0): 'a2'}, {(CHAT, 7), (CHAT, 99)})
+    backend.close()
+
+    backend = SQLiteStateBackend(path, 'games')
+    assert backend.load_all() == {(CHAT, 0): 'a2', (OTHER_CHAT, 0): 'c'}
+    assert backend.load_one((CHAT, 0)) == 'a2'
+    assert backend.load_one((CHAT, 7)) is None
+    # Доли воркеров не пересекаются и вместе дают все записи
+    shards = [backend.load_all(shard, 2) for shard in range(2)]
+    assert not shards[0].keys() & shards[1].keys()
+    assert {**shards[0], **shards[1]} == backend.load_all()
+    backend.close()
+
+
+def test_tables_share_one_file(tmp_path):
+    path = str(tmp_path / 'state.db')
+    games, seen = SQLiteStateBackend(path, 'games'), SQLiteStateBackend(path, 'seen_questions')
+    games.write_batch({(CHAT, 0): 'game'}, set())
+    seen.write_batch({(CHAT, 0): 'bloom'}, set())
+    assert games.load_one((CHAT, 0)) == 'game'
+    assert seen.load_one((CHAT, 0)) == 'bloom'
+    games.close()
+    seen.close()
+
+
+def test_game_store_flush_and_load(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = GameStore(SQLiteStateBackend(path))
+    games = make_games()
+    for game in games:
+        store[game.key] = game
+    asyncio.run(store.flush())
+    store.backend.close()
+
+    restored = GameStore(SQLiteStateBackend(path))
+    restored.load()
+    assert sorted(restored) == sorted(game.key for game in games)
+    for game in games:
+        again = restored[game.key]
+        assert type(again) is type(game)
+        assert dump_game(again) == dump_game(game)
+    assert sorted(restored.in_chat(CHAT)) == [(CHAT, 0), (CHAT, 42)]
+
+    quiz = restored[(CHAT, 0)]
+    # Ключи-идентификаторы снова числа, ответы раунда — снова RoundAnswers
+    assert quiz.scores == {101: 250, 102: 40}
+    assert quiz.answers.option_of(102) == 0 and list(quiz.answers.latency_ms) == [1500, 3200]
+    cities = restored[(OTHER_CHAT, 0)]
+    assert cities.word_pool.is_used('Анкара') and cities.word_pool.is_used('Москва')
+    restored.backend.close()
+
+
+def test_game_store_writes_only_changes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    store = GameStore(backend)
+    quiz, croc, cities = make_games()
+    for game in (quiz, croc, cities):
+        store[game.key] = game
+    asyncio.run(store.flush())
+
+    store.pop(croc.key)
+    quiz.current_round = 2
+    store.touch(quiz.key)
+    asyncio.run(store.flush())
+    assert set(backend.load_all()) == {quiz.key, cities.key}
+    assert '"current_round":2' in backend.load_one(quiz.key)
+    # Без изменений снимок ничего не пишет
+    backend.write_batch({cities.key: 'untouched'}, set())
+    asyncio.run(store.flush())
+    assert backend.load_one(cities.key) == 'untouched'
+    backend.close()
+
+
+def test_broken_snapshot_is_skipped():
+    backend = MemoryStateBackend()
+    good = make_games()[0]
+    backend.write_batch({good.key: dump_game(good), (CHAT, 5): '{"type": "quiz"', (CHAT, 6): '{"type": "chess"}'},
+                        set())
+    store = GameStore(backend)
+    store.load()
+    assert list(store) == [good.key]
+    assert store.count_in_chat(CHAT) == 1
+
+
+def test_table_without_thread_id_is_migrated(tmp_path):
+    # Формат до тем форума: одна игра на чат
+    path = str(tmp_path / 'state.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE games (chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)')
+    conn.executemany('INSERT INTO games VALUES (?, ?, ?)', [(CHAT, 'old-a', 1.0), (OTHER_CHAT, 'old-b', 2.0)])
+    conn.commit()
+    conn.close()
+
+    backend = SQLiteStateBackend(path)
+    assert backend.load_all() == {(CHAT, 0): 'old-a', (OTHER_CHAT, 0): 'old-b'}
+    # После миграции в чате уживаются игры в разных темах
+    backend.write_batch({(CHAT, 42): 'new'}, set())
+    assert backend.load_all()[(CHAT, 42)] == 'new'
+    backend.close()
+
+    conn = sqlite3.connect(path)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(games)')]
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    conn.close()
+    assert columns == ['chat_id', 'thread_id', 'state', 'updated_at']
+    assert tables == ['games']
+
+    # Повторное открытие уже новой таблицы ничего не меняет
+    backend = SQLiteStateBackend(path)
+    assert len(backend.load_all()) == 3
+    backend.close()
+
+
+def test_concurrent_settings_writes(tmp_path):
+    # Администраторы разных чатов меняют сроки одновременно: записи идут через одно соединение
+    path = str(tmp_path / 'state.db')
+    name = next(iter(default_timings()))
+
+    async def scenario() -> list:
+        settings = ChatSettings(SQLiteStateBackend(path, 'chat_settings'))
+        results = await asyncio.gather(*(settings.set_timing(CHAT - i, name, 30 + i) for i in range(50)))
+        results += await asyncio.gather(*(settings.set_timing(CHAT - i, name, None) for i in range(0, 50, 2)))
+        settings.backend.close()
+        return results
+
+    assert all(asyncio.run(scenario()))
+    restored = ChatSettings(SQLiteStateBackend(path, 'chat_settings'))
+    restored.load()
+    assert restored.timings(CHAT - 1)[name] == 31
+    assert restored.timings(CHAT - 2) == default_timings()
+    assert len(restored.backend.load_all()) == 25
+    restored.backend.close()
@@ -0,0 +1,130 @@
+import asyncio
+from typing import Callable, Coroutine, List, Tuple
+
+import skillbit
+from skillbit import TimerScheduler, VirtualClock
+
+CHAT = (-100, 0)
+OTHER_CHAT = (-200, 0)
+
+
+def make_scheduler() -> Tuple[TimerScheduler, Callable[..., Coroutine], List[Tuple[float, str]]]:
+    clock = VirtualClock(1000.0)
+    fired: List[Tuple[float, str]] = []
+
+    async def callback(name: str) -> None:
+        fired.append((clock.monotonic(), name))
+
+    return TimerScheduler(clock), callback, fired
+
+
+def test_timers_fire_in_deadline_order():
+    scheduler, callback, fired = make_scheduler()
+    scheduler.schedule(CHAT, 'late', 30, callback, 'late')
+    scheduler.schedule(OTHER_CHAT, 'early', 10, callback, 'early')
+    scheduler.schedule(CHAT, 'middle', 20, callback, 'middle')
+    asyncio.run(scheduler.run_until(1100.0))
+    assert fired == [(1010.0, 'early'), (1020.0, 'middle'), (1030.0, 'late')]
+    assert scheduler.pending == 0
+
+
+def test_equal_deadlines_keep_schedule_order():
+    scheduler, callback, fired = make_scheduler()
+    for name in ('a', 'b', 'c'):
+        scheduler.schedule((-1, 0), name, 5, callback, name)
+    asyncio.run(scheduler.run_until(1005.0))
+    assert [name for _, name in fired] == ['a', 'b', 'c']
+
+
+def test_only_due_timers_fire():
+    scheduler, callback, fired = make_scheduler()
+    scheduler.schedule(CHAT, 'soon', 5, callback, 'soon')
+    scheduler.schedule(CHAT, 'later', 50, callback, 'later')
+    asyncio.run(scheduler.run_until(1010.0))
+    assert fired == [(1005.0, 'soon')]
+    assert scheduler.pending == 1
+    assert scheduler.next_deadline() == 1050.0
+
+
+def test_cancel_and_reschedule():
+    scheduler, callback, fired = make_scheduler()
+    scheduler.schedule(CHAT, 'answer', 10, callback, 'first')
+    assert scheduler.cancel(CHAT, 'answer')
+    assert not scheduler.cancel(CHAT, 'answer')
+    # Повторный schedule того же вида заменяет срок, а не добавляет второй таймер
+    scheduler.schedule(CHAT, 'turn', 10, callback, 'old')
+    scheduler.schedule(CHAT, 'turn', 20, callback, 'new')
+    asyncio.run(scheduler.run_until(1100.0))
+    assert fired == [(1020.0, 'new')]
+
+
+def test_cancel_game_drops_all_its_timers():
+    scheduler, callback, fired = make_scheduler()
+    scheduler.schedule(CHAT, 'answer', 10, callback, 'answer')
+    scheduler.schedule(CHAT, 'next', 15, callback, 'next')
+    scheduler.schedule(OTHER_CHAT, 'answer', 12, callback, 'other')
+    scheduler.cancel_game(CHAT)
+    asyncio.run(scheduler.run_until(1100.0))
+    assert fired == [(1012.0, 'other')]
+    assert scheduler.pending == 0
+
+
+def test_dead_entries_are_compacted():
+    scheduler, callback, fired = make_scheduler()
+    for i in range(1000):
+        scheduler.schedule((-i, 0), 'answer', 10 + i, callback, i)
+    for i in range(999):
+        scheduler.cancel((-i, 0), 'answer')
+    # Отмененные записи не копятся в куче бесконечно
+    assert len(scheduler._heap) < 1000
+    asyncio.run(scheduler.run_until(5000.0))
+    assert fired == [(2009.0, 999)]
+
+
+def test_fire_runs_timer_immediately():
+    scheduler, callback, fired = make_scheduler()
+    scheduler.schedule(CHAT, 'answer', 10, callback, 'answer')
+
+    async def scenario() -> bool:
+        return await scheduler.fire(CHAT, 'answer')
+
+    assert asyncio.run(scenario())
+    assert fired == [(1000.0, 'answer')]
+    assert not asyncio.run(scenario())
+
+
+def test_failing_timer_does_not_stop_others(caplog):
+    scheduler, callback, fired = make_scheduler()
+
+    async def broken() -> None:
+        raise RuntimeError('boom')
+
+    scheduler.schedule(CHAT, 'broken', 1, broken)
+    scheduler.schedule(CHAT, 'answer', 2, callback, 'answer')
+    asyncio.run(scheduler.run_until(1010.0))
+    assert fired == [(1002.0, 'answer')]
+    assert 'boom' in caplog.text
+
+
+def test_background_loop_fires_on_real_clock():
+    fired: List[str] = []
+
+    async def scenario() -> None:
+        scheduler = TimerScheduler(skillbit.Clock())
+        done = asyncio.Event()
+
+        async def callback(name: str) -> None:
+            fired.append(name)
+            if len(fired) == 2:
+                done.set()
+
+        scheduler.start()
+        scheduler.schedule(CHAT, 'second', 0.05, callback, 'second')
+        scheduler.schedule(CHAT, 'first', 0.01, callback, 'first')
+        scheduler.schedule(CHAT, 'cancelled', 0.02, callback, 'cancelled')
+        scheduler.cancel(CHAT, 'cancelled')
+        await asyncio.wait_for(done.wait(), 2)
+        await scheduler.drain()
+
+    asyncio.run(scenario())
+    assert fired == ['first', 'second']
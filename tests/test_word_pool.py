@@ -0,0 +1,121 @@
+import random
+import time
+from typing import List, Set, Tuple
+
+import pytest
+
+from skillbit import BOT_MOVES, CITIES, CITY_ALIASES, WordPool, first_letter, get_effective_letters, normalize_word
+
+ALPHABET = 'абвгдежзийклмнопрстуфхцчшщъыьэюя'
+# Окончания на ь, ы, ъ, й чаще, чем в случайном слове: на них next_letter ищет запасные буквы
+ENDINGS = ['', '', 'ь', 'й', 'ы', 'ъ', 'ьй', 'ыь']
+
+
+def random_words(rng: random.Random, count: int) -> List[str]:
+    words = []
+    for _ in range(count):
+        parts = [''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6))) for _ in range(rng.randint(1, 2))]
+        word = rng.choice(['-', ' ']).join(parts) + rng.choice(ENDINGS)
+        words.append(word.capitalize())
+    return words
+
+
+def skewed_words(rng: random.Random, count: int) -> List[str]:
+    # Частоты букв убывают, как в настоящих словарях: редкие буквы кончаются первыми,
+    # и в конце партии бот обходит почти пустое дерево маршрутов
+    letters = list(ALPHABET)
+    rng.shuffle(letters)
+    weights = [1 / (i + 1) ** 1.2 for i in range(len(letters))]
+    return [''.join(rng.choices(letters, weights, k=rng.randint(3, 9))).capitalize() for _ in range(count)]
+
+
+# Прежний алгоритм: остатки на букву считаются просмотром всего словаря
+def scan_left(pool: WordPool, used: Set[str], letter: str, taken: Tuple[str, ...] = ()) -> int:
+    return sum(1 for word in pool.words if word not in used and first_letter(word) == letter) - taken.count(letter)
+
+
+def scan_next_letter(pool: WordPool, used: Set[str], last_word: str, taken: Tuple[str, ...] = ()) -> str:
+    effective_letters = get_effective_letters(last_word)
+    if not effective_letters:
+        return normalize_word(last_word)[-1:]
+    if 'я' in effective_letters and scan_left(pool, used, 'я', taken) > 0:
+        return 'я'
+    for letter in effective_letters:
+        if scan_left(pool, used, letter, taken) > 0:
+            return letter
+    return effective_letters[0]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_next_letter_and_dead_end_match_scan(seed):
+    rng = random.Random(seed)
+    # Словарь небольшой: буквы кончаются посреди партии, и запасные буквы идут в ход
+    pool = WordPool(random_words(rng, rng.randint(20, 200)))
+    outsiders = random_words(rng, 10)
+    state = pool.new_game(rng.sample(pool.words, rng.randint(0, len(pool.words) // 4)))
+    used = set(state.used)
+
+    while True:
+        unused = [word for word in pool.words if word not in used]
+        starts = {first_letter(word) for word in unused}
+        for letter in ALPHABET:
+            assert state.is_dead_end(letter) == (letter not in starts), letter
+        for last_word in rng.sample(pool.words, min(5, len(pool.words))) + rng.sample(outsiders, 2):
+            taken = tuple(rng.choice(ALPHABET) for _ in range(rng.randint(0, 3)))
+            assert state.next_letter(last_word, taken) == scan_next_letter(pool, used, last_word, taken), last_word
+
+        if not unused:
+            break
+        word = rng.choice(unused)
+        state.use(word)
+        # Повтор и слово не из словаря остатков не меняют
+        state.use(word)
+        state.use(rng.choice(outsiders))
+        used.add(word)
+
+        letter = scan_next_letter(pool, used, word)
+        next_word = state.next_word(letter)
+        if state.is_dead_end(letter):
+            assert next_word is None
+        else:
+            assert next_word not in used and first_letter(next_word) == letter
+
+
+@pytest.mark.parametrize('strategy', sorted(BOT_MOVES))
+@pytest.mark.parametrize('seed', range(3))
+def test_bot_moves_are_legal(strategy, seed):
+    rng = random.Random(seed)
+    pools = [WordPool(CITIES, CITY_ALIASES), WordPool(skewed_words(rng, 500))]
+    for pool in pools:
+        # Бот играет сам с собой до конца партии
+        state = pool.new_game()
+        letter = first_letter(rng.choice(pool.words))
+        while True:
+            word = BOT_MOVES[strategy](state, letter, rng)
+            if word is None:
+                assert state.is_dead_end(letter)
+                break
+            assert pool.lookup(word) == word
+            assert not state.is_used(word) and first_letter(word) == letter
+            state.use(word)
+            letter = state.next_letter(word)
+
+
+@pytest.mark.parametrize('fill', [0.0, 0.98])
+def test_lookahead_move_fits_time_budget(fill):
+    rng = random.Random(7)
+    pool = WordPool(skewed_words(rng, 50000))
+    state = pool.new_game(rng.sample(pool.words, int(len(pool.words) * fill)))
+    letter = max(pool.by_letter, key=state.count)
+    times = []
+    for _ in range(100):
+        started = time.perf_counter()
+        word = BOT_MOVES['lookahead'](state, letter, rng)
+        times.append(time.perf_counter() - started)
+        if word is None:
+            break
+        state.use(word)
+        letter = state.next_letter(word)
+    # Ход бота выполняется в цикле событий и не должен задерживать другие чаты
+    assert sum(times) / len(times) < 0.01
+    assert max(times) < 0.05
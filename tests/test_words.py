@@ -0,0 +1,117 @@
+import pytest
+
+from skillbit import (
+    CITIES, CITY_ALIASES, COUNTRIES, COUNTRY_ALIASES, WordPool, first_letter, get_effective_letters,
+    load_gazetteer, normalize_word,
+)
+
+CITY_POOL = WordPool(CITIES, CITY_ALIASES)
+COUNTRY_POOL = WordPool(COUNTRIES, COUNTRY_ALIASES)
+
+
+@pytest.mark.parametrize('text, key', [
+    ('Нью-Йорк', 'нью-йорк'),
+    ('НЬЮ – ЙОРК', 'нью-йорк'),              # тире с пробелами
+    ('нью  йорк', 'нью-йорк'),
+    ('Нью‑Йорк', 'нью-йорк'),                # неразрывный дефис
+    ('Санкт петербург', 'санкт-петербург'),
+    ('  Киев. ', 'киев'),
+    ('«Рига»', 'рига'),
+    ('Орёл!', 'орел'),
+    ('-Осло-', 'осло'),
+    ('', ''),
+])
+def test_normalize_word(text, key):
+    assert normalize_word(text) == key
+
+
+@pytest.mark.parametrize('text, city', [
+    ('НЬЮ – ЙОРК', 'Нью-Йорк'),
+    ('СПб', 'Санкт-Петербург'),
+    ('спб.', 'Санкт-Петербург'),
+    ('Киев.', 'Киев'),
+    ('Киів', 'Киев'),
+    ('Санкт петербург', 'Санкт-Петербург'),
+    ('рио', 'Рио-де-Жанейро'),
+    ('Таллинн', 'Таллин'),
+    ('Питер', None),                         # не из списка
+    ('Атлантида', None),
+])
+def test_city_lookup(text, city):
+    assert CITY_POOL.lookup(text) == city
+    assert (text in CITY_POOL) == (city is not None)
+
+
+@pytest.mark.parametrize('text, country', [
+    ('Соединенные Штаты Америки', 'США'),
+    ('соединённые штаты', 'США'),
+    ('Тайланд', 'Таиланд'),
+    ('Российская Федерация', 'Россия'),
+    ('южная  корея', 'Южная Корея'),
+])
+def test_country_lookup(text, country):
+    assert COUNTRY_POOL.lookup(text) == country
+
+
+def test_alias_on_another_letter_is_ignored():
+    # «Питер» записался бы ходом на «С»: такой псевдоним не попадает в индекс
+    pool = WordPool(['Санкт-Петербург', 'Москва'], {'Питер': 'Санкт-Петербург', 'СПб': 'Санкт-Петербург',
+                                                    'Мск': 'Москва', 'Столица': 'Москва'})
+    assert pool.lookup('Питер') is None
+    assert pool.lookup('Столица') is None
+    assert pool.lookup('СПб') == 'Санкт-Петербург'
+    assert pool.lookup('мск') == 'Москва'
+
+
+def test_alias_to_unknown_word_is_ignored():
+    pool = WordPool(['Москва'], {'Мск': 'Мадрид'})
+    assert pool.lookup('Мск') is None
+
+
+def test_builtin_aliases_keep_first_letter():
+    for pool, aliases in ((CITY_POOL, CITY_ALIASES), (COUNTRY_POOL, COUNTRY_ALIASES)):
+        for alias in aliases:
+            canonical = pool.lookup(alias)
+            assert canonical is not None, alias
+            assert first_letter(alias) == first_letter(canonical), alias
+
+
+def test_duplicates_collapse_to_first_spelling():
+    pool = WordPool(['Нью-Йорк', 'нью йорк', 'Япония', 'Япония'])
+    assert pool.words == ('Нью-Йорк', 'Япония')
+
+
+@pytest.mark.parametrize('word, letter', [
+    ('Ёшкар-Ола', 'е'),
+    ('Нью-Йорк', 'н'),
+    ('  «Рим»', 'р'),
+    ('', ''),
+])
+def test_first_letter(word, letter):
+    assert first_letter(word) == letter
+
+
+@pytest.mark.parametrize('word, letters', [
+    ('Москва', ['а', 'в', 'к', 'с', 'о', 'м']),
+    ('Казань', ['н', 'а', 'з', 'а', 'к']),          # мягкий знак пропускается
+    ('Токай', ['а', 'к', 'о', 'т']),
+    ('Нью-Йорк', ['к', 'р', 'о', 'ю', 'н']),        # дефис не буква
+    ('Гроссбритания.', ['я', 'и', 'н', 'а', 'т', 'и', 'р', 'б', 'с', 'с', 'о', 'р', 'г']),
+])
+def test_effective_letters_skip_bad_endings(word, letters):
+    assert get_effective_letters(word) == letters
+
+
+def test_gazetteer_file(tmp_path):
+    path = tmp_path / 'cities.txt'
+    path.write_text('# комментарий\n'
+                    'Санкт-Петербург | СПб | Питер  # Питер отбросит WordPool\n'
+                    '\n'
+                    '|Без названия\n'
+                    'Нью-Йорк\n', encoding='utf-8')
+    words, aliases = load_gazetteer(str(path))
+    assert words == ['Санкт-Петербург', 'Нью-Йорк']
+    assert aliases == {'СПб': 'Санкт-Петербург', 'Питер': 'Санкт-Петербург'}
+    pool = WordPool(words, aliases)
+    assert pool.lookup('спб') == 'Санкт-Петербург'
+    assert pool.lookup('питер') is None